@@ -1,5 +1,27 @@
-from .xmodel import Model
-from .xanim import Anim
-from .sanim import SiegeAnim
+# The format modules are only imported once they're first used
+#  ie. by 'from PyCod import Model' or 'PyCod.Anim'
+__LAZY_ATTRIBUTES__ = {
+    'Model': 'xmodel',
+    'Anim': 'xanim',
+    'SiegeAnim': 'sanim',
+    'ParseCache': 'cache',
+}
+
+__all__ = ['Model', 'Anim', 'SiegeAnim', 'ParseCache']
 
 version = (0, 1, 5)  # Version specifier for PyCoD
+
+
+def __getattr__(name):
+    module_name = __LAZY_ATTRIBUTES__.get(name)
+    if module_name is None:
+        raise AttributeError("module '%s' has no attribute '%s'" %
+                             (__name__, name))
+    from importlib import import_module
+    value = getattr(import_module('.' + module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,129 +1,649 @@
-try:
-    # Try to import the python-lz4 package
-    import lz4
+import struct
+import tempfile
 
-except:
-    # If python-lz4 isn't present, fallback to using pure python
-    import sys
-    from io import BytesIO
+# Matches can reach at most this far back
+MAX_OFFSET = 0xFFFF
+# The last match must start at least MF_LIMIT bytes before the end of
+#  the block, and the last LAST_LITERALS bytes must be literals
+MF_LIMIT = 12
+LAST_LITERALS = 5
+
+# The number of earlier positions that are checked for a match at each
+#  compression level (0 only stores literals)
+LEVEL_CANDIDATES = (0, 1, 1, 2, 4, 8, 16, 32, 64, 128)
+DEFAULT_LEVEL = 1
+MAX_LEVEL = len(LEVEL_CANDIDATES) - 1
+
+# The number of positions that Compressor checks for a match to split the
+#  input at, before giving up until the run of literals is spilled
+SPLIT_PROBES = 0x400
+
+
+class CorruptError(Exception):
+    pass
 
-    try:
-        from six import byte2int
-        from six.moves import xrange
-    except:
-        xrange = range
 
-        def byte2int(bytes):
-            return int(bytes[0])
+def __write_length__(out, length):
+    out += b'\xff' * (length // 255)
+    out.append(length % 255)
 
-    class CorruptError(Exception):
-        pass
 
-    __support_mode__ = 'pure Python'
+def __write_literals__(out, literals):
+    length = len(literals)
+    if length >= 15:
+        out.append(0xf0)
+        __write_length__(out, length - 15)
+    else:
+        out.append(length << 4)
+    out += literals
 
-    def uncompress(src, offset=4):
-        """uncompress a block of lz4 data.
 
-        :param bytes src: lz4 compressed data (LZ4 Blocks)
-        :param int offset: offset that the uncompressed data starts at
-                           (Used to implicitly read the uncompressed data size)
-        :returns: uncompressed data
-        :rtype: bytearray
+def __uncompress_python__(src, offset=4):
+    """uncompress a block of lz4 data.
 
-        .. seealso:: http://cyan4973.github.io/lz4/lz4_Block_format.html
-        """
-        src = BytesIO(src)
-        if offset > 0:
-            src.read(offset)
+    :param bytes src: lz4 compressed data (LZ4 Blocks)
+    :param int offset: offset that the uncompressed data starts at
+                       (Used to implicitly read the uncompressed data size)
+    :returns: uncompressed data
+    :rtype: bytearray
 
-        # if we have the original size, we could pre-allocate the buffer with
-        # bytearray(original_size), but then we would have to use indexing
-        # instad of .append() and .extend()
+    .. seealso:: http://cyan4973.github.io/lz4/lz4_Block_format.html
+    """
+    src = memoryview(src)
+    src_size = len(src)
+
+    # The output is preallocated when the uncompressed size is known,
+    #  otherwise the slice assignments below simply append to it
+    if offset >= 4:
+        dst_size = struct.unpack_from('<I', src, offset - 4)[0]
+        dst = bytearray(dst_size)
+    else:
+        dst_size = None
         dst = bytearray()
-        min_match_len = 4
 
-        def get_length(src, length):
-            """get the length of a lz4 variable length integer."""
-            if length != 0x0f:
-                return length
+    pos = offset
+    out = 0
+    try:
+        while True:
+            token = src[pos]
+            pos += 1
+
+            # Literals
+            length = token >> 4
+            if length == 0x0f:
+                while True:
+                    len_part = src[pos]
+                    pos += 1
+                    length += len_part
+                    if len_part != 0xff:
+                        break
+            if length:
+                if pos + length > src_size:
+                    raise CorruptError("not literal data")
+                dst[out:out + length] = src[pos:pos + length]
+                pos += length
+                out += length
+
+            # The last sequence has no match
+            if pos >= src_size:
+                if token & 0x0f != 0:
+                    raise CorruptError(
+                        "EOF, but match-len > 0: %u" % (token & 0x0f, ))
+                break
+
+            # Match
+            match_offset = src[pos] | (src[pos + 1] << 8)
+            pos += 2
+            if match_offset == 0:
+                raise CorruptError("offset can't be 0")
+
+            length = token & 0x0f
+            if length == 0x0f:
+                while True:
+                    len_part = src[pos]
+                    pos += 1
+                    length += len_part
+                    if len_part != 0xff:
+                        break
+            length += 4
+
+            start = out - match_offset
+            if start < 0:
+                raise CorruptError("offset before the start of the data")
+            if match_offset >= length:
+                dst[out:out + length] = dst[start:start + length]
+                out += length
+            else:
+                # The match overlaps the bytes it produces, so copy the
+                #  repeating part, doubling its length each time
+                while length:
+                    chunk = min(out - start, length)
+                    dst[out:out + chunk] = dst[start:start + chunk]
+                    out += chunk
+                    length -= chunk
+    except IndexError:
+        raise CorruptError("premature EOF")
+
+    if dst_size is not None and out != dst_size:
+        raise CorruptError("expected %u bytes, got %u" % (dst_size, out))
+    return dst
+
 
-            while True:
-                read_buf = src.read(1)
-                if len(read_buf) != 1:
-                    raise CorruptError("EOF at length read")
-                len_part = byte2int(read_buf)
+def __write_sequence__(out, literals, offset, match_length):
+    length = len(literals)
+    match_length -= 4
+    out.append((min(length, 15) << 4) | min(match_length, 15))
+    if length >= 15:
+        __write_length__(out, length - 15)
+    out += literals
+    out.append(offset & 0xff)
+    out.append(offset >> 8)
+    if match_length >= 15:
+        __write_length__(out, match_length - 15)
 
-                length += len_part
 
-                if len_part != 0xff:
+def __match_length__(data, source, target, limit):
+    '''
+    Get the number of bytes (at least 4) that match between
+    data[source:] & data[target:] without passing limit
+    Slices are compared while doubling the length, then bisected
+    '''
+    low = 4
+    high = 8
+    longest = limit - target
+    while high <= longest and (data[source:source + high] ==
+                               data[target:target + high]):
+        low = high
+        high *= 2
+    if high > longest:
+        if data[source:source + longest] == data[target:target + longest]:
+            return longest
+        high = longest
+    while high - low > 1:
+        middle = (low + high) // 2
+        if data[source:source + middle] == data[target:target + middle]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def __compress_python__(data, level=DEFAULT_LEVEL):
+    """compress data into a single lz4 block.
+
+    :param bytes data: the data to compress
+    :param int level: 0 (literals only) to MAX_LEVEL, higher levels
+                      search harder for matches
+    :returns: compressed data (the size isn't stored)
+    :rtype: bytearray
+    """
+    data = bytes(data)
+    size = len(data)
+    out = bytearray()
+    if level <= 0 or size <= MF_LIMIT:
+        __write_literals__(out, data)
+        return out
+
+    candidates = LEVEL_CANDIDATES[min(level, MAX_LEVEL)]
+    match_start_limit = size - MF_LIMIT
+    match_end_limit = size - LAST_LITERALS
+    table = {}
+    anchor = 0
+    pos = 0
+    misses = 0
+    while pos < match_start_limit:
+        key = data[pos:pos + 4]
+        if candidates == 1:
+            source = table.get(key, -1)
+            table[key] = pos
+            if source < 0 or pos - source > MAX_OFFSET:
+                # Skip ahead faster the longer there's no match
+                misses += 1
+                pos += 1 + (misses >> 6) if level == 1 else 1
+                continue
+            if data[source + 4] == data[pos + 4]:
+                length = __match_length__(data, source, pos,
+                                          match_end_limit)
+            else:
+                length = 4
+        else:
+            chain = table.get(key)
+            if chain is None:
+                table[key] = [pos]
+                pos += 1
+                continue
+            source = -1
+            length = 0
+            for candidate in reversed(chain):
+                if pos - candidate > MAX_OFFSET:
                     break
+                candidate_length = __match_length__(data, candidate, pos,
+                                                    match_end_limit)
+                if candidate_length > length:
+                    source = candidate
+                    length = candidate_length
+            chain.append(pos)
+            if len(chain) > candidates:
+                del chain[0]
+            if source < 0:
+                pos += 1
+                continue
+        misses = 0
 
-            return length
+        # Extend the match backwards over the pending literals
+        while (pos > anchor and source > 0 and
+               data[pos - 1] == data[source - 1]):
+            pos -= 1
+            source -= 1
+            length += 1
 
-        while True:
-            # decode a block
-            read_buf = src.read(1)
-            if not read_buf:
-                raise CorruptError("EOF at reading literal-len")
-            token = byte2int(read_buf)
+        offset = pos - source
+        if pos - anchor < 15 and length < 19:
+            # The common case of short literals & a short match
+            out.append(((pos - anchor) << 4) | (length - 4))
+            out += data[anchor:pos]
+            out.append(offset & 0xff)
+            out.append(offset >> 8)
+        else:
+            __write_sequence__(out, data[anchor:pos], offset, length)
+        end = pos + length
+        if level > 1:
+            # Index the positions within the match as well
+            for position in range(pos + 1, min(end, match_start_limit)):
+                key = data[position:position + 4]
+                if candidates == 1:
+                    table[key] = position
+                    continue
+                chain = table.get(key)
+                if chain is None:
+                    table[key] = [position]
+                else:
+                    chain.append(position)
+                    if len(chain) > candidates:
+                        del chain[0]
+        elif end - 2 < match_start_limit:
+            table[data[end - 2:end + 2]] = end - 2
+        pos = anchor = end
 
-            literal_len = get_length(src, (token >> 4) & 0x0f)
+    __write_literals__(out, data[anchor:])
+    return out
 
-            # copy the literal to the output buffer
-            read_buf = src.read(literal_len)
 
-            if len(read_buf) != literal_len:
-                raise CorruptError("not literal data")
-            dst.extend(read_buf)
+# The python-lz4 block module, False if it isn't installed, or None if
+#  that hasn't been checked yet (it's only imported once it's first needed)
+__lz4_block__ = None
 
-            read_buf = src.read(2)
-            if not read_buf:
-                if token & 0x0f != 0:
-                    raise CorruptError(
-                        "EOF, but match-len > 0: %u" % (token % 0x0f, ))
+
+def __load_backend__():
+    global __lz4_block__
+    if __lz4_block__ is None:
+        try:
+            import lz4.block
+            __lz4_block__ = lz4.block
+        except ImportError:
+            __lz4_block__ = False
+    return __lz4_block__
+
+
+def uncompress(src):
+    '''
+    Uncompress a LZ4 block that's preceded by its (uint32) uncompressed size
+    Uses python-lz4 if it's installed, and pure Python otherwise
+    '''
+    block = __load_backend__()
+    if block:
+        return block.decompress(src)
+    return __uncompress_python__(src)
+
+
+def compress(data, level=DEFAULT_LEVEL):
+    '''
+    Accepts a byte array as input - returns a LZ4 block
+     (the uncompressed size is stored separately by the caller)
+    level is 0 (literals only) to MAX_LEVEL - with python-lz4, levels above
+     1 use its high compression mode
+    '''
+    block = __load_backend__()
+    if not block:
+        return __compress_python__(data, level)
+    if level <= 0:
+        out = bytearray()
+        __write_literals__(out, data)
+        return out
+    if level == 1:
+        return block.compress(data, store_size=False)
+    return block.compress(data, mode='high_compression',
+                          compression=level, store_size=False)
+
+
+def __getattr__(name):
+    # support_info is only known once the backend has been loaded
+    if name == 'support_info':
+        if __load_backend__():
+            return 'LZ4: Using python-lz4'
+        return 'LZ4: Using pure Python'
+    raise AttributeError("module '%s' has no attribute '%s'" %
+                         (__name__, name))
+
+
+class Compressor(object):
+    '''
+    Incrementally compresses data into a single LZ4 block
+
+    The input is cut into chunks of roughly chunk_size bytes, each of which
+    is compressed on its own. Each chunk is joined to the next one with a 4
+    byte match that repeats earlier data, so the result is still one valid
+    LZ4 block, and only about chunk_size + 64KB of input is kept in memory.
+
+    Only the last sequence of a block can end without a match, so input
+    without such a match for more than chunk_size bytes (and all of the
+    input at level 0) is written as one run of literals, whose length comes
+    before them. Those literals are kept in a temporary file (in memory up
+    to chunk_size bytes) until the run ends. Only SPLIT_PROBES positions
+    are checked for a match per chunk_size bytes of such input. If write
+    is given, the
+    compressed data is passed to it as it's produced rather than returned
+    by compress() & flush(), so long runs are never held in memory
+    '''
+    __slots__ = ('chunk_size', 'level', 'buffer', 'history', 'scan',
+                 'probes', 'spill', 'spill_size', 'write')
+
+    def __init__(self, chunk_size=0x40000, level=DEFAULT_LEVEL, write=None):
+        self.chunk_size = chunk_size
+        self.level = level
+        # The most recent input, starting with 'history' bytes that were
+        #  already compressed (or spilled)
+        self.buffer = bytearray()
+        self.history = 0
+        # Where to continue looking for the next split point, and how many
+        #  more positions can be checked
+        self.scan = chunk_size
+        self.probes = SPLIT_PROBES
+        # The start of the current run of literals, if it's been spilled
+        self.spill = None
+        self.spill_size = 0
+        self.write = write
+
+    def __find_split__(self, end):
+        '''
+        Find a position before end whose next 4 bytes also occur within
+        MAX_OFFSET bytes before it
+        Once self.probes positions have been checked, the rest (until the
+        input is spilled) are assumed not to match
+        Returns (position, offset) or (-1, 0)
+        '''
+        buffer = self.buffer
+        start = self.scan
+        stop = min(end, start + self.probes)
+        for position in range(start, stop):
+            found = buffer.rfind(buffer[position:position + 4],
+                                 max(0, position - MAX_OFFSET),
+                                 position + 3)
+            if found != -1:
+                return position, position - found
+        self.probes -= max(0, stop - start)
+        self.scan = max(start, end)
+        return -1, 0
+
+    def __spill__(self, end):
+        '''
+        Move the input before end to the current run of literals
+        '''
+        if self.spill is None:
+            self.spill = tempfile.SpooledTemporaryFile(self.chunk_size)
+        buffer = self.buffer
+        self.spill.write(buffer[self.history:end])
+        self.spill_size += end - self.history
+        # Only the part that later matches can refer to is kept
+        keep = max(0, end - MAX_OFFSET)
+        del buffer[:keep]
+        self.history = end - keep
+        self.scan = self.history
+        self.probes = SPLIT_PROBES
+
+    def __literals__(self, result, end):
+        '''
+        Add the current run of literals, up to buffer[end], to result
+        '''
+        buffer = self.buffer
+        header = bytearray()
+        length = self.spill_size + end - self.history
+        if length >= 15:
+            header.append(0xf0)
+            __write_length__(header, length - 15)
+        else:
+            header.append(length << 4)
+        self.__output__(result, bytes(header))
+        if self.spill_size:
+            spill = self.spill
+            spill.seek(0)
+            for chunk in iter(lambda: spill.read(self.chunk_size), b''):
+                self.__output__(result, chunk)
+            spill.seek(0)
+            spill.truncate()
+            self.spill_size = 0
+        self.__output__(result, bytes(buffer[self.history:end]))
+
+    def __output__(self, result, data):
+        if self.write is None:
+            result.append(data)
+        else:
+            self.write(data)
+
+    def compress(self, data):
+        '''
+        Add data to the stream
+        Returns whatever compressed data is ready (may be empty)
+        '''
+        buffer = self.buffer
+        buffer += data
+        result = []
+        if self.level <= 0:
+            # Stored as a single run of literals
+            self.__spill__(len(buffer))
+            return b''
+        while True:
+            end = len(buffer) - 4 - MF_LIMIT
+            if end <= self.scan:
+                break
+            split, offset = self.__find_split__(end)
+            if split == -1:
+                # Nothing matches, so a run of literals has to be kept
+                #  until something does - it's spilled once it's too long
+                if end - self.history >= 2 * self.chunk_size:
+                    self.__spill__(end)
                 break
 
-            if len(read_buf) != 2:
+            # The last sequence of a block is always literals followed by a
+            #  match length of 0, ie. a 4 byte match once an offset is added
+            if self.spill_size:
+                self.__literals__(result, split)
+            else:
+                self.__output__(result, bytes(compress(
+                    bytes(buffer[self.history:split]), self.level)))
+            self.__output__(result, bytes(bytearray((offset & 0xFF,
+                                                     offset >> 8))))
+
+            # Keep just enough of the input to look for the next split
+            keep = max(0, split + 4 - MAX_OFFSET)
+            del buffer[:keep]
+            self.history = split + 4 - keep
+            self.scan = self.history + self.chunk_size
+            self.probes = SPLIT_PROBES
+        return b''.join(result)
+
+    def flush(self):
+        '''
+        Compress whatever is left of the input & end the block
+        '''
+        result = []
+        if self.spill_size or self.level <= 0:
+            self.__literals__(result, len(self.buffer))
+        else:
+            self.__output__(result, bytes(compress(
+                bytes(self.buffer[self.history:]), self.level)))
+        self.buffer = bytearray()
+        self.history = 0
+        self.scan = self.chunk_size
+        self.probes = SPLIT_PROBES
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+        return b''.join(result)
+
+
+def __read_length__(src, pos, read, read_size):
+    '''
+    Read the extra bytes of a sequence length starting at src[pos]
+    reading more input into src if needed
+    Returns (length, pos)
+    '''
+    length = 0
+    while True:
+        if pos >= len(src):
+            src += read(read_size)
+            if pos >= len(src):
                 raise CorruptError("premature EOF")
+        len_part = src[pos]
+        pos += 1
+        length += len_part
+        if len_part != 0xff:
+            return length, pos
+
+
+def __refill__(src, read, read_size):
+    '''
+    Read more input into src until it holds at least 0x100 bytes
+    Returns True if the end of the input was reached
+    '''
+    while len(src) < 0x100:
+        more = read(read_size)
+        if not more:
+            return True
+        src += more
+    return False
+
+
+def stream_uncompress(read, chunk_size=0x40000, size=None):
+    '''
+    Incrementally uncompress a single LZ4 block
+    The compressed data is read with read(n), and the uncompressed data is
+    yielded in chunks of at least chunk_size bytes (except for the last one)
+    Only about chunk_size bytes of input and chunk_size + MAX_OFFSET bytes of
+    output (the part that matches can still refer to) are kept in memory
+    If size is given, the total uncompressed size is checked against it
+    '''
+    src = bytearray()
+    pos = 0
+    src_size = 0
+    eof = False
+    dst = bytearray()
+    # The number of bytes at the start of dst that were already yielded,
+    #  and the number that were dropped from it before that
+    emitted = 0
+    dropped = 0
+    try:
+        while True:
+            # Keep enough input for the next sequence (barring very long
+            #  lengths, which are read by __read_length__)
+            if src_size - pos < 0x100 and not eof:
+                del src[:pos]
+                pos = 0
+                eof = __refill__(src, read, chunk_size)
+                src_size = len(src)
+
+            token = src[pos]
+            pos += 1
 
-            offset = byte2int([read_buf[0]]) | (byte2int([read_buf[1]]) << 8)
+            # Literals
+            length = token >> 4
+            if length == 0x0f:
+                extra, pos = __read_length__(src, pos, read, chunk_size)
+                length += extra
+                src_size = len(src)
+            while length:
+                available = src_size - pos
+                if length <= available:
+                    dst += src[pos:pos + length]
+                    pos += length
+                    break
+                # Long runs of literals are copied as they're read
+                dst += src[pos:]
+                length -= available
+                del src[:]
+                pos = 0
+                src += read(max(chunk_size, 0x100))
+                src_size = len(src)
+                if not src_size:
+                    raise CorruptError("not literal data")
+                if len(dst) - emitted >= chunk_size:
+                    yield dst[emitted:]
+                    drop = len(dst) - MAX_OFFSET
+                    if drop > 0:
+                        del dst[:drop]
+                        dropped += drop
+                    emitted = len(dst)
 
+            # The last sequence has no match
+            if src_size - pos < 0x100 and not eof:
+                del src[:pos]
+                pos = 0
+                eof = __refill__(src, read, chunk_size)
+                src_size = len(src)
+            if pos >= src_size:
+                if token & 0x0f != 0:
+                    raise CorruptError(
+                        "EOF, but match-len > 0: %u" % (token & 0x0f, ))
+                break
+
+            # Match
+            offset = src[pos] | (src[pos + 1] << 8)
+            pos += 2
             if offset == 0:
                 raise CorruptError("offset can't be 0")
 
-            match_len = get_length(src, (token >> 0) & 0x0f)
-            match_len += min_match_len
+            length = token & 0x0f
+            if length == 0x0f:
+                extra, pos = __read_length__(src, pos, read, chunk_size)
+                length += extra
+                src_size = len(src)
+            length += 4
 
-            # append the sliding window of the previous literals
-            for _ in xrange(match_len):
-                dst.append(dst[-offset])
+            start = len(dst) - offset
+            if start < 0:
+                raise CorruptError("offset before the start of the data")
+            if offset >= length:
+                dst += dst[start:start + length]
+            else:
+                # The match overlaps the bytes it produces, so copy the
+                #  repeating part, doubling its length each time (at most
+                #  chunk_size bytes at a time, so long runs can be yielded)
+                while length:
+                    chunk = min(len(dst) - start, length, chunk_size)
+                    dst += dst[start:start + chunk]
+                    length -= chunk
+                    if len(dst) - emitted >= chunk_size:
+                        yield dst[emitted:]
+                        drop = len(dst) - MAX_OFFSET
+                        if drop > 0:
+                            del dst[:drop]
+                            dropped += drop
+                        emitted = len(dst)
+                        # The data repeats every offset bytes
+                        start = len(dst) - offset
 
-        return dst
+            if len(dst) - emitted >= chunk_size:
+                yield dst[emitted:]
+                drop = len(dst) - MAX_OFFSET
+                if drop > 0:
+                    del dst[:drop]
+                    dropped += drop
+                emitted = len(dst)
+    except IndexError:
+        raise CorruptError("premature EOF")
 
-    def compress(data):
-        '''
-        Accepts a byte array as input - returns a LZ4 compatible (uncompressed)
-         byte array
-        '''
-        length = len(data)
-        if length > 15:
-            result = [15 << 4 | 0]  # Add the token
-
-            # Add the literal size bytes
-            result.extend([255] * (int)((length - 15) / 255))
-            result.append((int)((length - 15) % 255))
-        else:  # length <= 15
-            result = [length << 4 | 0]  # Add the token
-            if length == 15:
-                result.append(0)  # Add the empty length byte
-
-        result.extend(data)
-        return bytearray(result)
-
-else:
-    # Use python-lz4 if present
-    __support_mode__ = 'python-lz4'
-    compress = lz4.block.compress
-    uncompress = lz4.block.decompress
-
-support_info = 'LZ4: Using %s' % __support_mode__
+    if size is not None and dropped + len(dst) != size:
+        raise CorruptError("expected %u bytes, got %u" %
+                           (size, dropped + len(dst)))
+    if len(dst) > emitted:
+        yield dst[emitted:]
@@ -0,0 +1,331 @@
+import os
+import hashlib
+import pickle
+from array import array
+from itertools import accumulate
+
+from .xbin import __gc_paused__
+from .xmodel import Model, Mesh, Vertex, Face, FaceVertex
+
+# Bump this whenever the snapshot layout changes, so that old entries are
+#  ignored rather than misread
+__SNAPSHOT_VERSION__ = 3
+
+__ENTRY_EXT__ = '.pycod'
+
+
+def __file_digest__(path):
+    '''
+    Hash the contents of the given file
+    '''
+    digest = hashlib.sha1()
+    file = open(path, 'rb')
+    try:
+        for chunk in iter(lambda: file.read(0x100000), b''):
+            digest.update(chunk)
+    finally:
+        file.close()
+    return digest.hexdigest()
+
+
+def __pack_verts__(verts):
+    '''
+    Pack a list of Vertex objects into arrays
+    Returns None if they can't be restored exactly from arrays
+    '''
+    positions = array('d')
+    weight_counts = array('I')
+    weight_bones = array('i')
+    weight_values = array('d')
+    for vertex in verts:
+        offset = vertex.offset
+        weights = vertex.weights
+        if (offset.__class__ is not tuple or len(offset) != 3 or
+                weights.__class__ is not list):
+            return None
+        positions.extend(offset)
+        weight_counts.append(len(weights))
+        for weight in weights:
+            if weight.__class__ is not tuple or len(weight) != 2:
+                return None
+            weight_bones.append(weight[0])
+            weight_values.append(weight[1])
+    return positions, weight_counts, weight_bones, weight_values
+
+
+def __unpack_verts__(packed):
+    positions, weight_counts, weight_bones, weight_values = packed
+    coords = iter(positions.tolist())
+    offsets = zip(coords, coords, coords)
+    weights = list(zip(weight_bones.tolist(), weight_values.tolist()))
+    ends = list(accumulate(weight_counts))
+    starts = [0] + ends[:-1]
+    return list(map(Vertex, offsets,
+                    [weights[start:end] for start, end in zip(starts, ends)]))
+
+
+def __pack_faces__(faces):
+    '''
+    Pack a list of Face objects into arrays
+    Returns None if they can't be restored exactly from arrays
+    '''
+    ids = array('i')
+    corners = array('i')
+    normals = array('d')
+    colors = array('d')
+    uvs = array('d')
+    # Faces loaded from version 5 files have no colors
+    has_colors = None
+    for face in faces:
+        indices = face.indices
+        if indices.__class__ is not list or len(indices) != 3:
+            return None
+        ids.append(face.mesh_id)
+        ids.append(face.material_id)
+        for index in indices:
+            if (index.__class__ is not FaceVertex or
+                    index.normal.__class__ is not tuple or
+                    len(index.normal) != 3 or
+                    index.uv.__class__ is not tuple or len(index.uv) != 2):
+                return None
+            color = index.color
+            if has_colors is None:
+                has_colors = color is not None
+            if has_colors:
+                if color.__class__ is not tuple or len(color) != 4:
+                    return None
+                colors.extend(color)
+            elif color is not None:
+                return None
+            corners.append(index.vertex)
+            normals.extend(index.normal)
+            uvs.extend(index.uv)
+    return ids, corners, normals, colors if has_colors else None, uvs
+
+
+def __unpack_faces__(packed):
+    ids, corners, normals, colors, uvs = packed
+    values = iter(normals.tolist())
+    normals = zip(values, values, values)
+    if colors is None:
+        colors = [None] * len(corners)
+    else:
+        values = iter(colors.tolist())
+        colors = zip(values, values, values, values)
+    values = iter(uvs.tolist())
+    uvs = zip(values, values)
+    face_verts = iter(map(FaceVertex, corners.tolist(), normals, colors, uvs))
+    ids = iter(ids.tolist())
+    faces = list(map(Face, ids, ids))
+    for face, a, b, c in zip(faces, face_verts, face_verts, face_verts):
+        face.indices = [a, b, c]
+    return faces
+
+
+def __snapshot_mesh__(mesh):
+    if mesh.buffer is not None:
+        # MeshBuffers are already stored as arrays
+        verts = faces = None
+    else:
+        verts = __pack_verts__(mesh.verts)
+        if verts is None:
+            verts = mesh.verts
+        faces = __pack_faces__(mesh.faces)
+        if faces is None:
+            faces = mesh.faces
+    # The groups aren't stored, as they're rebuilt from the verts & faces
+    #  when they're first used
+    return (mesh.name, mesh.buffer, verts, faces)
+
+
+def __restore_mesh__(snapshot, bone_count, material_count):
+    name, buffer, verts, faces = snapshot
+    mesh = Mesh(name, buffer)
+    if buffer is None:
+        # Meshes that couldn't be packed are stored as lists of objects
+        if verts.__class__ is tuple:
+            verts = __unpack_verts__(verts)
+        if faces.__class__ is tuple:
+            faces = __unpack_faces__(faces)
+        mesh.verts = verts
+        mesh.faces = faces
+    mesh.__set_group_counts__(bone_count, material_count)
+    return mesh
+
+
+def __snapshot__(asset):
+    '''
+    Convert a loaded asset into something that can be pickled efficiently
+    Models store their vertex & face data in arrays, while anims (which are
+    far smaller) are pickled as they are
+    '''
+    if isinstance(asset, Model):
+        return ('MODEL', asset.version, asset.name, asset.cosmetics,
+                asset.bones, asset.materials,
+                [__snapshot_mesh__(mesh) for mesh in asset.meshes])
+    return ('OBJECT', asset)
+
+
+def __restore__(snapshot):
+    if snapshot[0] == 'OBJECT':
+        return snapshot[1]
+    model = Model()
+    (model.version, model.name, model.cosmetics,
+     model.bones, model.materials) = snapshot[1:6]
+    model.meshes = [__restore_mesh__(mesh, len(model.bones),
+                                     len(model.materials))
+                    for mesh in snapshot[6]]
+    return model
+
+
+def __load_entry__(file, digest):
+    '''
+    Restore the asset of an entry, or return None if a digest is given &
+    the entry was stored for another one (See ParseCache.verify)
+    '''
+    with __gc_paused__():
+        entry_digest, snapshot = pickle.load(file)
+        if digest is not None and entry_digest != digest:
+            return None
+        return __restore__(snapshot)
+
+
+class ParseCache(object):
+    '''
+    An on-disk cache of loaded models & anims
+
+    Pass one as the cache argument of Model / Anim .FromFile_Raw or
+    .FromFile_Bin to reuse the result of an earlier load of the same file
+    Entries are keyed by the file's path, size & modification time (and the
+    load options), and hold a compact snapshot of the loaded object. If
+    verify is True, the contents of the file are hashed as well, and an
+    entry is only used if they still match - this catches changes that
+    keep the size & modification time, but reads the whole file on every
+    hit. Once the entries take up more than max_size bytes, the least
+    recently used ones are removed
+    A cache that can't be written to is still used for hits - failing to
+    store an entry doesn't affect the loaded object
+    '''
+    __slots__ = ('directory', 'max_size', 'verify', 'hits', 'misses',
+                 'size')
+
+    def __init__(self, directory, max_size=0x40000000, verify=False):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_size = max_size
+        self.verify = verify
+        self.hits = 0
+        self.misses = 0
+        # The total size of the entries as of the last Trim() plus whatever
+        #  was stored since, or None if it hasn't been counted yet
+        self.size = None
+
+    def __entry_path__(self, path, options):
+        info = os.stat(path)
+        key = repr((__SNAPSHOT_VERSION__, os.path.realpath(path),
+                    info.st_size, info.st_mtime_ns, options))
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + __ENTRY_EXT__)
+
+    def Load(self, path, options, load):
+        '''
+        Get the object that load() returns for the file at path, from the
+        cache if possible
+        options should be a tuple of the load options that affect the result
+        '''
+        entry = self.__entry_path__(path, options)
+        digest = __file_digest__(path) if self.verify else None
+        try:
+            file = open(entry, 'rb')
+        except (IOError, OSError):
+            file = None
+        if file is not None:
+            try:
+                result = __load_entry__(file, digest)
+            except Exception:
+                # Treat damaged entries as missing - they'll be replaced
+                #  (as are entries for other contents)
+                result = None
+            finally:
+                file.close()
+            if result is not None:
+                self.hits += 1
+                # The modification time of an entry is its last use
+                #  (unless the cache is read-only)
+                try:
+                    os.utime(entry, None)
+                except OSError:
+                    pass
+                return result
+
+        self.misses += 1
+        result = load()
+        self.__store__(entry, result, digest)
+        return result
+
+    def __store__(self, entry, asset, digest=None):
+        '''
+        Write the snapshot of asset (and the digest of its file) to the given
+        entry, and trim the cache once it may be larger than max_size
+        '''
+        # Written to a temporary file first, so other processes sharing
+        #  the cache never see a partial entry
+        temp = '%s.%d.tmp' % (entry, os.getpid())
+        snapshot = (digest, __snapshot__(asset))
+        try:
+            file = open(temp, 'wb')
+            try:
+                pickle.dump(snapshot, file, pickle.HIGHEST_PROTOCOL)
+            finally:
+                file.close()
+            os.replace(temp, entry)
+            size = os.path.getsize(entry)
+        # Objects that can't be pickled raise any of the last three
+        except (OSError, pickle.PicklingError, AttributeError, TypeError):
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            return
+
+        if self.size is not None:
+            self.size += size
+        if self.size is None or self.size > self.max_size:
+            self.Trim()
+
+    def Trim(self, max_size=None):
+        '''
+        Remove the least recently used entries until the cache is no larger
+        than max_size bytes (defaults to self.max_size)
+        '''
+        if max_size is None:
+            max_size = self.max_size
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(__ENTRY_EXT__):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+            total += info.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self.size = total
+
+    def Clear(self):
+        '''
+        Remove every entry from the cache
+        '''
+        self.Trim(0)
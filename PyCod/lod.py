@@ -0,0 +1,353 @@
+from heapq import heapify, heappop, heappush
+from math import sqrt
+
+from .xmodel import Mesh, Vertex, Face, FaceVertex
+
+# Collapses that turn any remaining face by more than this (as the cosine
+#  of the angle between its old & new normal) are rejected
+__MIN_NORMAL_COS__ = 0.2
+
+
+def __face_normal__(p0, p1, p2):
+    '''
+    Get the (unnormalized) normal of a triangle - its length is twice the
+    triangle's area
+    '''
+    ux = p1[0] - p0[0]
+    uy = p1[1] - p0[1]
+    uz = p1[2] - p0[2]
+    vx = p2[0] - p0[0]
+    vy = p2[1] - p0[1]
+    vz = p2[2] - p0[2]
+    return (uy * vz - uz * vy, uz * vx - ux * vz, ux * vy - uy * vx)
+
+
+def __plane_quadric__(p0, p1, p2):
+    '''
+    Get the area weighted error quadric of the plane through the given
+    points, as its 10 unique values (See Garland & Heckbert, 1997)
+    '''
+    nx, ny, nz = __face_normal__(p0, p1, p2)
+    length = sqrt(nx * nx + ny * ny + nz * nz)
+    if length == 0.0:
+        return [0.0] * 10
+    area = length * 0.5
+    nx /= length
+    ny /= length
+    nz /= length
+    d = -(nx * p0[0] + ny * p0[1] + nz * p0[2])
+    return [area * nx * nx, area * nx * ny, area * nx * nz, area * nx * d,
+            area * ny * ny, area * ny * nz, area * ny * d,
+            area * nz * nz, area * nz * d,
+            area * d * d]
+
+
+def __quadric_error__(q, p):
+    x, y, z = p
+    return (q[0] * x * x + q[4] * y * y + q[7] * z * z + q[9] +
+            2.0 * (q[1] * x * y + q[2] * x * z + q[5] * y * z +
+                   q[3] * x + q[6] * y + q[8] * z))
+
+
+def __weight_distance__(a, b):
+    '''
+    Get half the L1 distance between two {bone: weight} dicts
+     ie. 0 for the same weights, 1 for normalized weights on other bones
+    '''
+    distance = 0.0
+    for bone, weight in a.items():
+        distance += abs(weight - b.get(bone, 0.0))
+    for bone, weight in b.items():
+        if bone not in a:
+            distance += abs(weight)
+    return distance * 0.5
+
+
+class Decimator(object):
+    '''
+    Simplifies a mesh by repeatedly collapsing the edge (a, b) that adds the
+    least quadric error, moving vertex a onto vertex b (half edge collapse)
+
+    Vertices on a UV / normal / color seam, on the border between materials
+    (or objects), or on an open or non-manifold edge are never moved, and
+    an edge is only collapsed if the weights of its vertices differ by at
+    most weight_tolerance (See __weight_distance__). As vertices are only
+    ever removed, the remaining ones keep their exact offset, weights and
+    face vertex data
+
+    Each free vertex has an entry in a heap, holding the lowest error of
+    its collapses when it was last checked. When a collapse changes the
+    vertices around it, their entries are pushed again with the same error,
+    which is only recomputed once they're popped (a lazy queue)
+    '''
+    __slots__ = ('positions', 'weights', 'bone_weights', 'face_ids',
+                 'face_verts', 'face_attrs', 'vert_faces', 'quadrics',
+                 'errors', 'costs', 'free', 'stamps', 'heap', 'face_count',
+                 'weight_tolerance')
+
+    def __init__(self, mesh, weight_tolerance=0.25):
+        self.positions = [tuple(vert.offset) for vert in mesh.verts]
+        self.weights = [list(vert.weights) for vert in mesh.verts]
+        self.bone_weights = []
+        for weights in self.weights:
+            bone_weights = {}
+            for bone, weight in weights:
+                bone_weights[bone] = bone_weights.get(bone, 0.0) + weight
+            self.bone_weights.append(bone_weights)
+        self.weight_tolerance = weight_tolerance
+
+        # Faces are never removed from these lists, only from vert_faces
+        self.face_ids = []
+        self.face_verts = []
+        self.face_attrs = []
+        for face in mesh.faces:
+            self.face_ids.append((face.mesh_id, face.material_id))
+            verts = []
+            attrs = []
+            for ind in face.indices:
+                verts.append(ind.vertex)
+                attrs.append((tuple(ind.normal),
+                              None if ind.color is None else tuple(ind.color),
+                              tuple(ind.uv)))
+            self.face_verts.append(verts)
+            self.face_attrs.append(attrs)
+        self.face_count = len(self.face_verts)
+
+        vert_count = len(self.positions)
+        self.vert_faces = [set() for i in range(vert_count)]
+        self.quadrics = [[0.0] * 10 for i in range(vert_count)]
+        positions = self.positions
+        for face_index, verts in enumerate(self.face_verts):
+            quadric = __plane_quadric__(positions[verts[0]],
+                                        positions[verts[1]],
+                                        positions[verts[2]])
+            for vert in verts:
+                self.vert_faces[vert].add(face_index)
+                vert_quadric = self.quadrics[vert]
+                for i in range(10):
+                    vert_quadric[i] += quadric[i]
+
+        # The error of each vertex's quadric at its own offset
+        self.errors = list(map(__quadric_error__, self.quadrics, positions))
+
+        self.free = [self.__is_free__(vert) for vert in range(vert_count)]
+        self.stamps = [0] * vert_count
+        self.costs = [None] * vert_count
+        self.heap = []
+        for vert in range(vert_count):
+            if self.free[vert]:
+                costs = self.__costs__(vert)
+                if costs:
+                    self.costs[vert] = min(costs)[0]
+                    self.heap.append((self.costs[vert], 0, vert))
+        heapify(self.heap)
+
+    def __is_free__(self, vert):
+        '''
+        Check whether vert can be moved - it must be surrounded by a closed
+        fan of faces that all have the same ids & face vertex data for it
+        '''
+        faces = self.vert_faces[vert]
+        if not faces:
+            return False
+        ids = set()
+        attrs = set()
+        edge_counts = {}
+        for face_index in faces:
+            verts = self.face_verts[face_index]
+            if verts.count(vert) != 1:
+                return False
+            ids.add(self.face_ids[face_index])
+            attrs.add(self.face_attrs[face_index][verts.index(vert)])
+            for other in verts:
+                if other != vert:
+                    edge_counts[other] = edge_counts.get(other, 0) + 1
+        if len(ids) != 1 or len(attrs) != 1:
+            return False
+        for count in edge_counts.values():
+            if count != 2:
+                return False
+        return True
+
+    def __neighbors__(self, vert):
+        face_verts = self.face_verts
+        result = set()
+        for face_index in self.vert_faces[vert]:
+            result.update(face_verts[face_index])
+        result.discard(vert)
+        return result
+
+    def __costs__(self, a):
+        '''
+        Get the (error, b) of every collapse of a whose weights are close
+        enough
+        '''
+        positions = self.positions
+        errors = self.errors
+        bone_weights = self.bone_weights
+        weights = bone_weights[a]
+        quadric = self.quadrics[a]
+        result = []
+        for b in self.__neighbors__(a):
+            other = bone_weights[b]
+            if (other != weights and __weight_distance__(weights, other) >
+                    self.weight_tolerance):
+                continue
+            result.append((__quadric_error__(quadric, positions[b]) +
+                           errors[b], b))
+        return result
+
+    def __shared_faces__(self, a, b):
+        face_verts = self.face_verts
+        return [face_index for face_index in self.vert_faces[a]
+                if b in face_verts[face_index]]
+
+    def __can_collapse__(self, a, b):
+        '''
+        Check whether moving a onto b keeps the mesh manifold, keeps the
+        face vertex data of b & doesn't fold over any faces
+        '''
+        shared = self.__shared_faces__(a, b)
+        if len(shared) != 2:
+            return False
+        first, second = shared
+        first_verts = self.face_verts[first]
+        second_verts = self.face_verts[second]
+        if (self.face_attrs[first][first_verts.index(b)] !=
+                self.face_attrs[second][second_verts.index(b)]):
+            return False
+
+        # The only vertices next to both a & b must be the other corners of
+        #  the faces that are removed
+        opposite = set(first_verts + second_verts)
+        opposite.discard(a)
+        opposite.discard(b)
+        if self.__neighbors__(a) & self.__neighbors__(b) != opposite:
+            return False
+
+        positions = self.positions
+        target = positions[b]
+        for face_index in self.vert_faces[a]:
+            if face_index == first or face_index == second:
+                continue
+            verts = self.face_verts[face_index]
+            old = [positions[vert] for vert in verts]
+            new = [target if vert == a else positions[vert] for vert in verts]
+            ox, oy, oz = __face_normal__(*old)
+            nx, ny, nz = __face_normal__(*new)
+            dot = ox * nx + oy * ny + oz * nz
+            if dot <= 0.0 or dot * dot < (__MIN_NORMAL_COS__ ** 2 *
+                                          (ox * ox + oy * oy + oz * oz) *
+                                          (nx * nx + ny * ny + nz * nz)):
+                return False
+        return True
+
+    def __collapse__(self, a, b):
+        face_verts = self.face_verts
+        face_attrs = self.face_attrs
+        vert_faces = self.vert_faces
+
+        shared = self.__shared_faces__(a, b)
+        removed = shared[0]
+        attr = face_attrs[removed][face_verts[removed].index(b)]
+        for face_index in shared:
+            for vert in face_verts[face_index]:
+                vert_faces[vert].discard(face_index)
+        self.face_count -= len(shared)
+
+        # The faces around a now use b, with b's face vertex data
+        for face_index in vert_faces[a]:
+            verts = face_verts[face_index]
+            i = verts.index(a)
+            verts[i] = b
+            face_attrs[face_index][i] = attr
+            vert_faces[b].add(face_index)
+        vert_faces[a] = set()
+        self.free[a] = False
+
+        quadric = [x + y for x, y in zip(self.quadrics[b], self.quadrics[a])]
+        self.quadrics[b] = quadric
+        self.errors[b] = __quadric_error__(quadric, self.positions[b])
+
+        # The collapses of b & its neighbors are out of date
+        stamps = self.stamps
+        costs = self.costs
+        for vert in self.__neighbors__(b) | set([b]):
+            stamps[vert] += 1
+            if self.free[vert]:
+                cost = costs[vert]
+                if cost is None:
+                    cost = self.errors[vert]
+                heappush(self.heap, (cost, stamps[vert], vert))
+
+    def run(self, face_count):
+        '''
+        Collapse edges until there are at most face_count faces left, or no
+        more edges can be collapsed
+        '''
+        heap = self.heap
+        stamps = self.stamps
+        while self.face_count > face_count and heap:
+            cost, stamp, a = heappop(heap)
+            if stamp != stamps[a] or not self.free[a]:
+                continue
+            costs = sorted(self.__costs__(a))
+            if not costs:
+                continue
+            # The error may have grown since the entry was pushed
+            self.costs[a] = costs[0][0]
+            if heap and costs[0][0] > heap[0][0]:
+                heappush(heap, (costs[0][0], stamp, a))
+                continue
+            for new_cost, b in costs:
+                if self.__can_collapse__(a, b):
+                    self.__collapse__(a, b)
+                    break
+            # Otherwise a is retried once one of its neighbors changes
+
+    def to_mesh(self, name):
+        '''
+        Build a Mesh from the remaining faces & the vertices they use
+        '''
+        mesh = Mesh(name)
+        face_verts = self.face_verts
+        alive = set()
+        for faces in self.vert_faces:
+            alive.update(faces)
+        alive = sorted(alive)
+
+        used = set()
+        for face_index in alive:
+            used.update(face_verts[face_index])
+        remap = {}
+        for vert in sorted(used):
+            remap[vert] = len(mesh.verts)
+            mesh.verts.append(Vertex(self.positions[vert],
+                                     list(self.weights[vert])))
+
+        for face_index in alive:
+            mesh_id, material_id = self.face_ids[face_index]
+            face = Face(mesh_id, material_id)
+            face.indices = [FaceVertex(remap[vert], normal, color, uv)
+                            for vert, (normal, color, uv) in
+                            zip(face_verts[face_index],
+                                self.face_attrs[face_index])]
+            mesh.faces.append(face)
+        return mesh
+
+
+def decimate_mesh(mesh, ratios, weight_tolerance=0.25):
+    '''
+    Build a simplified copy of mesh with at most ratio times as many faces
+    for each of the given ratios, or as few as the locked vertices allow
+    (See Decimator)
+    Each copy is simplified further from the previous (larger) one
+    Returns the copies in the same order as ratios
+    '''
+    decimator = Decimator(mesh, weight_tolerance)
+    face_count = decimator.face_count
+    results = {}
+    for ratio in sorted(set(ratios), reverse=True):
+        decimator.run(int(face_count * ratio))
+        results[ratio] = decimator.to_mesh(mesh.name)
+    return [results[ratio] for ratio in ratios]
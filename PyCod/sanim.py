@@ -1,5 +1,3 @@
-import json
-import zipfile
 import struct
 
 '''
@@ -82,6 +80,7 @@ class SiegeAnim(object):
 
     def __load_index__(self, file):
         # Load the serialized index file
+        import json
         idx_parse = json.loads(file.read("index.json"))
 
         # All of this data is required so we must be able to load it
@@ -127,6 +126,7 @@ class SiegeAnim(object):
 
     def __write_positions__(self, file):
         # Serialize the positions per node, per frame
+        import zipfile
         byte_stride = 12 * len(self.nodes)
         data_length = self.frames * len(self.nodes) * 12
         data_buffer = bytearray(int(data_length))
@@ -147,6 +147,7 @@ class SiegeAnim(object):
 
     def __write_rotations__(self, file):
         # Serialize the positions per node, per frame
+        import zipfile
         byte_stride = 16 * len(self.nodes)
         data_length = self.frames * len(self.nodes) * 16
         data_buffer = bytearray(int(data_length))
@@ -213,15 +214,19 @@ class SiegeAnim(object):
         }
 
         # Inject the index file
+        import json
+        import zipfile
         file.writestr("index.json", json.dumps(idx_dict),
                       compress_type=zipfile.ZIP_DEFLATED)
 
     def LoadFile(self, path):
+        import zipfile
         file = zipfile.ZipFile(path, "r")
         self.__load_index__(file)
         file.close()
 
     def WriteFile(self, path):
+        import zipfile
         file = zipfile.ZipFile(path, "w")
         self.__write_index__(file)
         file.close()
@@ -1,7 +1,8 @@
 from time import strftime
 import os
 
-from .xbin import XBinIO
+from .xbin import XBinIO, XBinStats, __compression_level__, \
+    __float_format__, __compact_floats__
 
 # Can be int or float
 #  Changes the internal type for frames indices
@@ -206,6 +207,20 @@ class Frame(object):
         return lines_read
 
 
+class AnimInfo(object):
+    '''
+    Summary of an anim file, as returned by Anim.Probe()
+    parts is a list of part (bone) names
+    '''
+    __slots__ = ('version', 'parts', 'framerate', 'frame_count')
+
+    def __init__(self):
+        self.version = None
+        self.parts = []
+        self.framerate = None
+        self.frame_count = 0
+
+
 class Anim(XBinIO, object):
     __slots__ = ('version', 'framerate', 'parts', 'frames', 'notes')
 
@@ -365,8 +380,11 @@ class Anim(XBinIO, object):
 
     # Write an XANIM_EXPORT file
     # if embed_notes is False, a NT_EXPORT file will be created
+    # Floats are written with precision decimal places, and if compact_floats
+    #  is True, without any trailing zeros
     def WriteFile_Raw(self, path, version=3,
-                      header_message="", embed_notes=True):
+                      header_message="", embed_notes=True,
+                      precision=6, compact_floats=False):
         first_frame = 0
         last_frame = 0
         if self.frames:
@@ -397,18 +415,26 @@ class Anim(XBinIO, object):
 
         file.write("FRAMERATE %s\n" % __clean_float2str__(self.framerate))
         file.write("NUMFRAMES %d\n" % len(self.frames))
+        # Each frame is formatted & written as a whole
+        part_fmt = __float_format__("PART %d\n"
+                                    "OFFSET %f %f %f\n"
+                                    "SCALE %f %f %f\n"
+                                    "X %f %f %f\n"
+                                    "Y %f %f %f\n"
+                                    "Z %f %f %f\n\n", precision)
         for frame in self.frames:
-            file.write("FRAME %s\n" % __clean_float2str__(frame.frame))
-            for part_index, part in enumerate(frame.parts):
-                file.write("PART %d\n" % part_index)
-                # Investigate precision options?
-                offset = (part.offset[0], part.offset[1], part.offset[2])
-                scale = (part.scale[0], part.scale[1], part.scale[2])
-                file.write("OFFSET %f %f %f\n" % offset)
-                file.write("SCALE %f %f %f\n" % scale)
-                file.write("X %f %f %f\n" % __clamp_multi__(part.matrix[0]))
-                file.write("Y %f %f %f\n" % __clamp_multi__(part.matrix[1]))
-                file.write("Z %f %f %f\n\n" % __clamp_multi__(part.matrix[2]))
+            text = "FRAME %s\n" % __clean_float2str__(frame.frame)
+            text += ''.join([
+                part_fmt % ((part_index,
+                             part.offset[0], part.offset[1], part.offset[2],
+                             part.scale[0], part.scale[1], part.scale[2]) +
+                            __clamp_multi__(part.matrix[0]) +
+                            __clamp_multi__(part.matrix[1]) +
+                            __clamp_multi__(part.matrix[2]))
+                for part_index, part in enumerate(frame.parts)])
+            if compact_floats:
+                text = __compact_floats__(text)
+            file.write(text)
 
         # NOTE: Despite having the same version number
         #   BO1 supports the NUMKEYS style embedded notetracks
@@ -455,36 +481,146 @@ class Anim(XBinIO, object):
         file.close()
 
     @staticmethod
-    def FromFile_Raw(filepath):
+    def FromFile_Raw(filepath, cache=None):
         '''
         Load from an XANIM_EXPORT file and return the resulting Anim()
+        cache can be a ParseCache to reuse the result of an earlier load
         '''
+        if cache is not None:
+            return cache.Load(filepath, ('XANIM_EXPORT',),
+                              lambda: Anim.FromFile_Raw(filepath))
         anim = Anim()
         anim.LoadFile_Raw(filepath)
         return anim
 
-    def LoadFile_Bin(self, path, is_compressed=True, dump=False):
+    def LoadFile_Bin(self, path, is_compressed=True, dump=False,
+                     sections=None, stats=None, window_size=None):
+        '''
+        Load a XANIM_BIN file
+        sections can be used to only load part of the file
+         ie. sections={'parts', 'notetracks'} (See xbin.SECTIONS)
+        stats can be an XBinStats to fill in, or a function to call with one
+        If window_size is given, the file is decompressed & loaded in chunks
+         of about window_size bytes, rather than all at once, to limit the
+         memory used (Can't be combined with sections)
+        '''
+        collected = XBinStats.begin(stats)
         file = open(path, "rb")
 
-        if is_compressed:
-            file = XBinIO.__decompress_internal__(file, dump)
+        if window_size is not None:
+            data = XBinIO.__stream_internal__(file, window_size,
+                                              is_compressed, dump)
+            if collected is not None:
+                collected.compressed_size = os.path.getsize(path)
+        elif is_compressed:
+            data = XBinIO.__decompress_internal__(file, dump)
+        else:
+            data = file.read()
+            file.close()
 
-        self.__xbin_loadfile_internal__(file, 'ANIM')
-        file.close()
+        if collected is not None and window_size is None:
+            collected.lap('decompress')
+            collected.compressed_size = os.path.getsize(path)
+            collected.uncompressed_size = len(data)
+
+        self.__xbin_loadfile_internal__(data, 'ANIM', sections=sections,
+                                        stats=collected)
+        XBinStats.end(stats, collected)
 
-    def WriteFile_Bin(self, path, version=3, header_message=""):
+    def WriteFile_Bin(self, path, version=3, header_message="", stats=None,
+                      compression='fast', compression_level=None):
+        '''
+        Write a XANIM_BIN file
+        compression can be 'fast', 'hc' (using compression_level if given)
+         or 'none' (See xbin.COMPRESSION_MODES)
+        stats can be an XBinStats to fill in, or a function to call with one
+        Returns an XBinStats with the file's sizes, compression ratio & timings
+        '''
         # If there is no current version, fallback to the argument
         if self.version is None:
             self.version = version
-        return self.__xbin_writefile_anim_internal__(path,
-                                                     self.version,
-                                                     header_message)
+        level = __compression_level__(compression, compression_level)
+        collected = XBinStats.begin(stats) or XBinStats()
+        self.__xbin_writefile_anim_internal__(path,
+                                              self.version,
+                                              header_message,
+                                              collected,
+                                              level,
+                                              stats is not None)
+        XBinStats.end(stats, collected)
+        return collected
 
     @staticmethod
-    def FromFile_Bin(filepath, is_compressed=True, dump=False):
+    def FromFile_Bin(filepath, is_compressed=True, dump=False,
+                     sections=None, stats=None, window_size=None,
+                     cache=None):
         '''
         Load from a XANIM_BIN file and return the resulting Anim()
+        cache can be a ParseCache to reuse the result of an earlier load
+         (stats are only collected when the file is actually loaded)
         '''
+        if cache is not None:
+            options = ('XANIM_BIN', is_compressed,
+                       None if sections is None else sorted(sections))
+            return cache.Load(filepath, options,
+                              lambda: Anim.FromFile_Bin(
+                                  filepath, is_compressed, dump, sections,
+                                  stats, window_size))
         anim = Anim()
-        anim.LoadFile_Bin(filepath, is_compressed, dump)
+        anim.LoadFile_Bin(filepath, is_compressed, dump, sections, stats,
+                          window_size)
         return anim
+
+    @staticmethod
+    def __probe_raw__(path):
+        info = AnimInfo()
+        file = open(path, "r")
+        for line in file:
+            line_split = line.split()
+            if not line_split:
+                continue
+
+            if line_split[0] == "VERSION":
+                info.version = int(line_split[1])
+            elif line_split[0] == "NUMPARTS":
+                info.parts = [None] * int(line_split[1])
+            elif line_split[0] == "PART":
+                info.parts[int(line_split[1])] = line_split[2].strip('"')
+            elif line_split[0] == "FRAMERATE":
+                info.framerate = float(line_split[1])
+            elif line_split[0] == "NUMFRAMES":
+                info.frame_count = int(line_split[1])
+                break
+        file.close()
+        return info
+
+    @staticmethod
+    def __probe_bin__(path, is_compressed=True):
+        file = open(path, "rb")
+        if is_compressed:
+            data = XBinIO.__decompress_internal__(file)
+        else:
+            data = file.read()
+            file.close()
+
+        anim = Anim()
+        counts = anim.__xbin_probe_internal__(data, 'ANIM')
+
+        info = AnimInfo()
+        info.version = counts['version']
+        info.parts = [part.name for part in anim.parts]
+        info.framerate = anim.framerate
+        info.frame_count = counts['frames']
+        return info
+
+    @staticmethod
+    def Probe(path):
+        '''
+        Read the version, part names, framerate & frame count from an
+        XANIM_EXPORT or XANIM_BIN file without loading any of its frames
+        Returns an AnimInfo()
+        '''
+        file_type = XBinIO.__file_type__(path)
+        if file_type == 'RAW':
+            return Anim.__probe_raw__(path)
+        return Anim.__probe_bin__(path, file_type == 'LZ4')
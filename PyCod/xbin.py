@@ -1,6 +1,11 @@
 import struct
 import os
+import gc
+import re
+from array import array
+from contextlib import contextmanager
 from io import BytesIO
+from time import perf_counter
 
 from . import _lz4 as lz4
 
@@ -9,6 +14,19 @@ LZ4_VERBOSE = False
 
 __LZ4_DISPLAY_SUPPORT_INFO__ = True
 
+# The number of vertices / faces that the model writer packs at a time
+__WRITE_BATCH_SIZE__ = 0x1000
+
+# When loading in chunks (See LoadFile_Bin's window_size), blocks are only
+#  loaded once there's at least this much data after their start
+__STREAM_MARGIN__ = 0x10000
+
+# The compression argument of WriteFile_Bin can be one of these
+#  'none' stores the data uncompressed (but still as a valid LZ4 block)
+COMPRESSION_MODES = ('none', 'fast', 'hc')
+# The level used by 'hc' when no compression_level is given
+HC_DEFAULT_LEVEL = 9
+
 
 def print_lz4_support_info(force=False):
     '''
@@ -25,6 +43,65 @@ def padded(size):
     return (size + 0x3) & 0xFFFFFFFFFFFFFC
 
 
+def __compression_level__(compression, compression_level=None):
+    '''
+    Convert a compression mode (See COMPRESSION_MODES) & optional level to
+    the level used by the lz4 module
+    '''
+    if compression == 'none':
+        return 0
+    if compression == 'fast':
+        return 1
+    if compression == 'hc':
+        if compression_level is None:
+            return HC_DEFAULT_LEVEL
+        return max(2, int(compression_level))
+    raise ValueError("Unknown compression '%s' - must be one of %s" %
+                     (compression, repr(COMPRESSION_MODES)))
+
+
+@contextmanager
+def __gc_paused__():
+    '''
+    Pause the cyclic garbage collector while lots of (acyclic) objects are
+    created, as it would otherwise keep scanning them to no avail
+    '''
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def __float_format__(fmt, precision=6):
+    '''
+    Use the given number of decimal places for every %f in fmt
+    Shared by the XMODEL_EXPORT & XANIM_EXPORT writers
+    '''
+    if precision == 6:
+        return fmt
+    return fmt.replace('%f', '%%.%df' % precision)
+
+
+# Used by __compact_floats__ - the trailing zeros of a float with other
+#  decimals, and the decimal point & zeros of one without
+_TRAILING_ZEROS = re.compile(r'(\.[0-9]*[1-9])0+(?![0-9])')
+_ZERO_DECIMALS = re.compile(r'\.0+(?![0-9])')
+
+
+def __compact_floats__(text):
+    '''
+    Strip the trailing zeros (and then the decimal point) from every float
+    in text, like __clean_float2str__ in xanim
+    text must only contain keywords & numbers - not (quoted) names
+    Done for a whole batch of formatted records at once, which is far
+    cheaper than formatting & stripping each float on its own
+    '''
+    return _ZERO_DECIMALS.sub('', _TRAILING_ZEROS.sub(r'\1', text))
+
+
 def __clamp_float_to_short__(value, clamp=(-32768, 32767)):
     return max(min(int(value * clamp[1]), clamp[1]), clamp[0])
 
@@ -33,6 +110,116 @@ def __str2bytes__(string):
     return bytearray(str(string).encode('utf-8'))
 
 
+# Precompiled layouts for the fixed-size portion of each block
+#  All offsets are relative to the start of the block (its hash)
+_BLOCK_HASH = struct.Struct('H')
+_BLOCK_INT16 = struct.Struct('2xh')
+_BLOCK_UINT16 = struct.Struct('2xH')
+_BLOCK_INT32 = struct.Struct('4xi')
+_BLOCK_FLOAT = struct.Struct('4xf')
+_BLOCK_VEC2 = struct.Struct('4xff')
+_BLOCK_VEC3 = struct.Struct('4xfff')
+_BLOCK_VEC4 = struct.Struct('4xffff')
+_BLOCK_SHORT_VEC3 = struct.Struct('2xhhh')
+_BLOCK_BONE = struct.Struct('4xii')
+_BLOCK_WEIGHT = struct.Struct('=2xhf')
+_BLOCK_TRI = struct.Struct('2xBB')
+_BLOCK_TRI16 = struct.Struct('4xHH')
+_BLOCK_COLOR = struct.Struct('4xBBBB')
+_BLOCK_UV = struct.Struct('=4xff')
+
+# Layouts for runs of blocks that the exporters always write together
+#  (Vertex offset + weight count) and (Face vertex index, normal, color, uv)
+_VERT_RECORD = struct.Struct('=HxxfffHh')
+_FACE_RECORD16 = struct.Struct('=' + ('HH' 'Hhhh' 'HxxBBBB' 'Hhff') * 3)
+_FACE_RECORD32 = struct.Struct('=' + ('HxxI' 'Hhhh' 'HxxBBBB' 'Hhff') * 3)
+_FACE_INDEX16_HASHES = (0x8F03,) * 3
+_FACE_INDEX32_HASHES = (0xB097,) * 3
+_FACE_NORMAL_HASHES = (0x89EC,) * 3
+_FACE_COLOR_HASHES = (0x6DD8,) * 3
+_FACE_UV_HASHES = (0x1AD4,) * 3
+
+__WEIGHT_LAYOUTS__ = {}
+
+
+def __weight_layout__(count):
+    '''
+    Get the (cached) layout for a run of 'count' vertex weight blocks
+    along with the expected block hashes
+    '''
+    try:
+        return __WEIGHT_LAYOUTS__[count]
+    except KeyError:
+        layout = (struct.Struct('=' + 'Hhf' * count), (0xF1AB,) * count)
+        __WEIGHT_LAYOUTS__[count] = layout
+        return layout
+
+
+__VERTEX_LAYOUTS__ = {}
+
+
+def __vertex_layout__(weight_count, vert32):
+    '''
+    Get the (cached) layout used to write a vertex with 'weight_count'
+    weights - its index, offset, weight count & weight blocks
+    '''
+    try:
+        return __VERTEX_LAYOUTS__[(weight_count, vert32)]
+    except KeyError:
+        fmt = '=HxxI' if vert32 else '=HH'
+        fmt += 'HxxfffHh' + 'Hhf' * weight_count
+        layout = struct.Struct(fmt)
+        __VERTEX_LAYOUTS__[(weight_count, vert32)] = layout
+        return layout
+
+
+def __face_template__(vert32):
+    '''
+    Get a face record (info block + 3 corners of index, normal, color & uv
+    blocks) with just the block hashes filled in, and the offset of the
+    first index, normal, color & uv in each corner
+    '''
+    if vert32:
+        index_block = struct.pack('HxxI', 0xB097, 0)
+        index_offset = 4
+    else:
+        index_block = struct.pack('HH', 0x8F03, 0)
+        index_offset = 2
+    corner = (index_block +
+              struct.pack('Hhhh', 0x89EC, 0, 0, 0) +
+              struct.pack('HxxBBBB', 0x6DD8, 0, 0, 0, 0) +
+              struct.pack('Hhff', 0x1AD4, 1, 0, 0))
+    normal_offset = len(index_block) + 2
+    color_offset = len(index_block) + 12
+    uv_offset = len(index_block) + 20
+    record = struct.pack('HBB', 0x562F, 0, 0) + corner * 3
+    return (record, len(corner),
+            (index_offset, normal_offset, color_offset, uv_offset))
+
+
+def __load_string__(buf, offset):
+    '''
+    Read a null terminated string from buf
+    Returns the string and the offset of the byte following the terminator
+    '''
+    end = offset
+    while buf[end]:
+        end += 1
+    return bytes(buf[offset:end]).decode('utf-8'), end + 1
+
+
+def __load_string_aligned__(buf, offset):
+    string, end = __load_string__(buf, offset)
+    return string, offset + padded(end - offset)
+
+
+def __raise_block_error__(block_hash, offset):
+    if block_hash in BLOCK_INFO:
+        raise NotImplementedError("Unimplemented Block '%s' at 0x%X" %
+                                  (BLOCK_INFO[block_hash][0], offset + 2))
+    raise ValueError("Unknown Block Hash 0x%X at 0x%X" % (block_hash, offset))
+
+
 class XBlock(object):
     '''
     This is a namespace-like class that contains all of the block read/write
@@ -260,7 +447,8 @@ class XBlock(object):
     @staticmethod
     def WriteCommentBlock(file, comment):
         comment = bytearray(comment.encode('utf-8'))
-        data = struct.pack('Hxx%ds' % (len(comment) + 1), 0xC355, comment)
+        data = struct.pack('Hxx%ds' % padded(len(comment) + 1), 0xC355,
+                           comment)
         file.write(data)
 
     @staticmethod
@@ -365,6 +553,109 @@ class XBlock(object):
         data = struct.pack('Hhff', 0x1AD4, layer, *uv)
         file.write(data)
 
+    @staticmethod
+    def WriteVertexBlocks(file, verts, vert_offset, vert32=False):
+        '''
+        Write the index, offset & weight blocks for each vertex in verts
+        The whole run is packed into a single buffer of the exact size
+        '''
+        layouts = [__vertex_layout__(len(vert.weights), vert32)
+                   for vert in verts]
+        data = bytearray(sum([layout.size for layout in layouts]))
+
+        index_hash = 0xB097 if vert32 else 0x8F03
+        offset = 0
+        for index, vert in enumerate(verts):
+            layout = layouts[index]
+            args = [index_hash, index + vert_offset, 0x9383]
+            args.extend(vert.offset)
+            args.append(0xEA46)
+            args.append(len(vert.weights))
+            for weight in vert.weights:
+                args.append(0xF1AB)
+                args.extend(weight)
+            layout.pack_into(data, offset, *args)
+            offset += layout.size
+        file.write(data)
+
+    @staticmethod
+    def WriteFaceBlocks(file, faces, vert_offset, vert32=False):
+        '''
+        Write the info block & the index, normal, color and uv blocks for
+        each corner of each face in faces
+        Each field is gathered for all of the faces at once and scattered
+        into a buffer of face record templates
+        '''
+        count = len(faces)
+        corners = [ind for face in faces for ind in face.indices]
+        normals = [int(n * 32767) for ind in corners for n in ind.normal]
+        colors = [int(c * 255) for ind in corners for c in ind.color]
+        uvs = [uv for ind in corners for uv in ind.uv]
+
+        if (len(corners) != 3 * count or len(normals) != 9 * count or
+                len(colors) != 12 * count or len(uvs) != 6 * count or
+                [face for face in faces
+                 if face.mesh_id > 255 or face.material_id > 255]):
+            # Uncommon records are written a block at a time
+            if vert32:
+                WriteVertexIndexBlock = XBlock.WriteVertex32Index
+            else:
+                WriteVertexIndexBlock = XBlock.WriteVertex16Index
+            for face in faces:
+                XBlock.WriteFaceInfoBlock(file, face)
+                for i in range(3):
+                    ind = face.indices[i]
+                    WriteVertexIndexBlock(file, ind.vertex + vert_offset)
+                    XBlock.WriteFaceVertexNormalBlock(file, ind.normal)
+                    XBlock.WriteColorBlock(file, ind.color)
+                    XBlock.WriteFaceVertexUVBlock(file, 1, ind.uv)
+            return
+
+        if count == 0:
+            return
+
+        if min(normals) < -32768 or max(normals) > 32767:
+            normals = [max(min(n, 32767), -32768) for n in normals]
+
+        record, corner_size, field_offsets = __face_template__(vert32)
+        index_offset, normal_offset, color_offset, uv_offset = field_offsets
+        size = len(record)
+        data = bytearray(record) * count
+
+        buffer = memoryview(data)
+        bytes_view = buffer.cast('B')
+        shorts = buffer.cast('h')
+        floats = buffer.cast('f')
+        index_type = 'I' if vert32 else 'H'
+        indices = buffer.cast(index_type)
+
+        # Convert each field once, then copy it into every record with
+        #  strided memoryview assignments
+        vertex_ids = memoryview(array(index_type, [ind.vertex + vert_offset
+                                                   for ind in corners]))
+        normals = memoryview(array('h', normals))
+        colors = memoryview(array('B', colors))
+        uvs = memoryview(array('f', uvs))
+
+        bytes_view[2::size] = array('B', [face.mesh_id for face in faces])
+        bytes_view[3::size] = array('B', [face.material_id for face in faces])
+        for i in range(3):
+            start = 4 + i * corner_size
+
+            index = (start + index_offset) // indices.itemsize
+            indices[index::size // indices.itemsize] = vertex_ids[i::3]
+            for k in range(3):
+                index = (start + normal_offset) // 2 + k
+                shorts[index::size // 2] = normals[i * 3 + k::9]
+            for k in range(4):
+                index = start + color_offset + k
+                bytes_view[index::size] = colors[i * 4 + k::12]
+            for k in range(2):
+                index = (start + uv_offset) // 4 + k
+                floats[index::size // 4] = uvs[i * 2 + k::6]
+
+        file.write(data)
+
     @staticmethod
     def WriteMaterialInfoBlock(file,
                                material_index,
@@ -419,7 +710,1143 @@ class XBlock(object):
                            0x1675, int(note.frame), string)
         end = file.tell() + len(data)
         file.write(data)
-        file.write("\0" * (padded(end) - end))
+        file.write(b"\0" * (padded(end) - end))
+
+
+# The asset modules import this one, so they're bound on the first load
+XModel = None
+XAnim = None
+
+
+def __bind_asset_modules__():
+    global XModel, XAnim
+    from . import xmodel, xanim
+    XModel = xmodel
+    XAnim = xanim
+
+
+class LoadState(object):
+    '''
+    The state of a single x*_bin load
+
+    Each of the Load* methods is a block handler - they're called as
+    handler(state, buf, offset) where offset is the start of the block
+    (including its hash), and return the offset of the next block
+    '''
+    __slots__ = ('asset', 'expected_type', 'asset_type', 'mesh',
+                 'active_thing', 'active_tri', 'active_frame')
+
+    def __init__(self, asset, expected_type):
+        self.asset = asset
+        self.expected_type = expected_type
+        self.asset_type = None
+        self.active_thing = None
+        self.active_tri = None
+        self.active_frame = None
+        if expected_type == 'MODEL':
+            # A global mesh containing all of the vertex and face data for
+            #  the entire model
+            self.mesh = XModel.Mesh("$default")
+        else:
+            self.mesh = None
+
+    def Finish(self):
+        '''
+        Called once all of the blocks have been loaded
+        '''
+        pass
+
+    def LoadComment(self, buf, offset):
+        string, end = __load_string__(buf, offset + 4)
+        return offset + padded(end - offset)
+
+    def LoadInt16(self, buf, offset):
+        return offset + 4
+
+    def InitModel(self, buf, offset):
+        self.asset_type = 'MODEL'
+        if self.expected_type != self.asset_type:
+            raise TypeError("Found %s asset. Expected %s" %
+                            (self.asset_type, self.expected_type))
+        return offset + 4
+
+    def InitAnim(self, buf, offset):
+        self.asset_type = 'ANIM'
+        if self.expected_type != self.asset_type:
+            raise TypeError("Found %s asset. Expected %s" %
+                            (self.asset_type, self.expected_type))
+        return offset + 4
+
+    def LoadBoneCount(self, buf, offset):
+        self.asset.bones = [None] * _BLOCK_INT16.unpack_from(buf, offset)[0]
+        return offset + 4
+
+    def LoadCosmeticCount(self, buf, offset):
+        self.asset.cosmetics = _BLOCK_INT32.unpack_from(buf, offset)[0]
+        return offset + 8
+
+    def LoadBoneInfo(self, buf, offset):
+        model = self.asset
+        index, parent = _BLOCK_BONE.unpack_from(buf, offset)
+        name, end = __load_string__(buf, offset + 12)
+        bone = XModel.Bone(name, parent)
+        if index >= (len(model.bones) - model.cosmetics):
+            bone.cosmetic = True
+        model.bones[index] = bone
+        return offset + padded(end - offset)
+
+    def LoadBoneIndex(self, buf, offset):
+        bone = self.asset.bones[_BLOCK_INT16.unpack_from(buf, offset)[0]]
+        bone.matrix = []
+        self.active_thing = bone
+        return offset + 4
+
+    def LoadOffset(self, buf, offset):
+        self.active_thing.offset = _BLOCK_VEC3.unpack_from(buf, offset)
+        return offset + 16
+
+    def LoadBoneScale(self, buf, offset):
+        self.active_thing.scale = _BLOCK_VEC3.unpack_from(buf, offset)
+        return offset + 16
+
+    def LoadBoneMatrix(self, buf, offset):
+        x, y, z = _BLOCK_SHORT_VEC3.unpack_from(buf, offset)
+        self.active_thing.matrix.append(
+            (x / 32767.0, y / 32767.0, z / 32767.0))
+        return offset + 8
+
+    def LoadVertexCount(self, buf, offset):
+        self.mesh.verts = [None] * _BLOCK_UINT16.unpack_from(buf, offset)[0]
+        return offset + 4
+
+    def LoadVertex32Count(self, buf, offset):
+        self.mesh.verts = [None] * _BLOCK_INT32.unpack_from(buf, offset)[0]
+        return offset + 8
+
+    def LoadVertex(self, buf, offset, index, size):
+        vertex = XModel.Vertex()
+        self.mesh.verts[index] = vertex
+        self.active_thing = vertex
+
+        # Vertices written by the stock exporters are always laid out as
+        #  index, offset, weight count & weights - so try to decode
+        #  them all at once, falling back to block by block if needed
+        offset += size
+        if offset + 24 > len(buf):
+            return offset
+        h0, x, y, z, h1, count = _VERT_RECORD.unpack_from(buf, offset)
+        if h0 != 0x9383 or h1 != 0xEA46:
+            return offset
+        vertex.offset = (x, y, z)
+        offset += 20
+        layout, expected = __weight_layout__(count)
+        if offset + layout.size > len(buf):
+            vertex.weights = []
+            return offset + 4
+        weights = layout.unpack_from(buf, offset)
+        if weights[0::3] != expected:
+            vertex.weights = []
+            return offset + 4
+        vertex.weights = list(zip(weights[1::3], weights[2::3]))
+        return offset + layout.size
+
+    def LoadFaceVertices(self, buf, offset, tri):
+        # Same as LoadVertex, but for the 3 verts of a given face
+        if offset + _FACE_RECORD16.size > len(buf):
+            return offset
+        v = _FACE_RECORD16.unpack_from(buf, offset)
+        if v[0::15] != _FACE_INDEX16_HASHES:
+            if v[0] != 0xB097 or offset + _FACE_RECORD32.size > len(buf):
+                return offset
+            v = _FACE_RECORD32.unpack_from(buf, offset)
+            if v[0::15] != _FACE_INDEX32_HASHES:
+                return offset
+        if (v[2::15] != _FACE_NORMAL_HASHES or
+                v[6::15] != _FACE_COLOR_HASHES or
+                v[11::15] != _FACE_UV_HASHES):
+            return offset
+        FaceVertex = XModel.FaceVertex
+        tri.indices = indices = [
+            FaceVertex(v[i + 1],
+                       (v[i + 3] / 32767.0, v[i + 4] / 32767.0,
+                        v[i + 5] / 32767.0),
+                       (v[i + 7] / 255.0, v[i + 8] / 255.0,
+                        v[i + 9] / 255.0, v[i + 10] / 255.0),
+                       (v[i + 13], v[i + 14]))
+            for i in (0, 15, 30)]
+        self.active_thing = indices[2]
+        if v[0] == 0x8F03:
+            return offset + _FACE_RECORD16.size
+        return offset + _FACE_RECORD32.size
+
+    def LoadFaceVertex(self, index):
+        face_vert = XModel.FaceVertex(index)
+        self.active_tri.indices.append(face_vert)
+        self.active_thing = face_vert
+
+    def LoadVertexIndex(self, buf, offset):
+        index = _BLOCK_UINT16.unpack_from(buf, offset)[0]
+        if self.active_tri is None:
+            return self.LoadVertex(buf, offset, index, 4)
+        self.LoadFaceVertex(index)
+        return offset + 4
+
+    def LoadVertex32Index(self, buf, offset):
+        index = _BLOCK_INT32.unpack_from(buf, offset)[0]
+        if self.active_tri is None:
+            return self.LoadVertex(buf, offset, index, 8)
+        self.LoadFaceVertex(index)
+        return offset + 8
+
+    def LoadVertexWeightCount(self, buf, offset):
+        self.active_thing.weights = []
+        return offset + 4
+
+    def LoadVertexWeight(self, buf, offset):
+        self.active_thing.weights.append(
+            _BLOCK_WEIGHT.unpack_from(buf, offset))
+        return offset + 8
+
+    def LoadTriCount(self, buf, offset):
+        self.mesh.faces = []
+        return offset + 8
+
+    def LoadTri(self, object_index, material_index):
+        tri = XModel.Face(object_index, material_index)
+        tri.indices = []
+        self.mesh.faces.append(tri)
+        self.active_tri = tri
+        return tri
+
+    def LoadTriInfo(self, buf, offset):
+        tri = self.LoadTri(*_BLOCK_TRI.unpack_from(buf, offset))
+        return self.LoadFaceVertices(buf, offset + 4, tri)
+
+    def LoadTri16Info(self, buf, offset):
+        tri = self.LoadTri(*_BLOCK_TRI16.unpack_from(buf, offset))
+        return self.LoadFaceVertices(buf, offset + 8, tri)
+
+    def LoadTriVertNormal(self, buf, offset):
+        x, y, z = _BLOCK_SHORT_VEC3.unpack_from(buf, offset)
+        self.active_thing.normal = (x / 32767.0, y / 32767.0, z / 32767.0)
+        return offset + 8
+
+    def LoadTriVertColor(self, buf, offset):
+        r, g, b, a = _BLOCK_COLOR.unpack_from(buf, offset)
+        self.active_thing.color = (r / 255.0, g / 255.0,
+                                   b / 255.0, a / 255.0)
+        return offset + 8
+
+    def LoadTriVertUV(self, buf, offset):
+        # Ignore UV layer for now
+        self.active_thing.uv = _BLOCK_UV.unpack_from(buf, offset)
+        return offset + 12
+
+    def LoadObjectCount(self, buf, offset):
+        self.asset.meshes = [None] * _BLOCK_INT16.unpack_from(buf, offset)[0]
+        return offset + 4
+
+    def LoadObjectInfo(self, buf, offset):
+        index = _BLOCK_INT16.unpack_from(buf, offset)[0]
+        name, end = __load_string__(buf, offset + 4)
+        self.asset.meshes[index] = XModel.Mesh(name)
+        return offset + padded(end - offset)
+
+    def LoadMaterialCount(self, buf, offset):
+        count = _BLOCK_INT16.unpack_from(buf, offset)[0]
+        self.asset.materials = [None] * count
+        return offset + 4
+
+    def LoadMaterialInfo(self, buf, offset):
+        index = _BLOCK_INT16.unpack_from(buf, offset)[0]
+        name, end = __load_string_aligned__(buf, offset + 4)
+        _type, end = __load_string_aligned__(buf, end)
+        images, end = __load_string_aligned__(buf, end)
+        images = XModel.deserialize_image_string(images)
+        material = XModel.Material(name, _type, images)
+        self.asset.materials[index] = material
+        self.active_thing = material
+        return offset + padded(end - offset)
+
+    def LoadMaterialTransparency(self, buf, offset):
+        self.active_thing.transparency = _BLOCK_VEC4.unpack_from(buf, offset)
+        return offset + 20
+
+    def LoadMaterialAmbientColor(self, buf, offset):
+        self.active_thing.color_ambient = _BLOCK_VEC4.unpack_from(buf, offset)
+        return offset + 20
+
+    def LoadMaterialIncandescence(self, buf, offset):
+        self.active_thing.incandescence = _BLOCK_VEC4.unpack_from(buf, offset)
+        return offset + 20
+
+    def LoadMaterialCoeffs(self, buf, offset):
+        self.active_thing.coeffs = _BLOCK_VEC2.unpack_from(buf, offset)
+        return offset + 12
+
+    def LoadMaterialGlow(self, buf, offset):
+        self.active_thing.glow = _BLOCK_VEC2.unpack_from(buf, offset)
+        return offset + 12
+
+    def LoadMaterialRefractive(self, buf, offset):
+        self.active_thing.refractive = _BLOCK_VEC2.unpack_from(buf, offset)
+        return offset + 12
+
+    def LoadMaterialSpecularColor(self, buf, offset):
+        self.active_thing.color_specular = _BLOCK_VEC4.unpack_from(buf,
+                                                                   offset)
+        return offset + 20
+
+    def LoadMaterialReflectiveColor(self, buf, offset):
+        self.active_thing.color_reflective = _BLOCK_VEC4.unpack_from(buf,
+                                                                     offset)
+        return offset + 20
+
+    def LoadMaterialReflective(self, buf, offset):
+        self.active_thing.reflective = _BLOCK_VEC2.unpack_from(buf, offset)
+        return offset + 12
+
+    def LoadMaterialBlinn(self, buf, offset):
+        self.active_thing.blinn = _BLOCK_VEC2.unpack_from(buf, offset)
+        return offset + 12
+
+    def LoadMaterialPhong(self, buf, offset):
+        self.active_thing.phong = _BLOCK_FLOAT.unpack_from(buf, offset)[0]
+        return offset + 8
+
+    # Animation
+    def LoadPartCount(self, buf, offset):
+        self.asset.parts = [None] * _BLOCK_INT16.unpack_from(buf, offset)[0]
+        return offset + 4
+
+    def LoadPartInfo(self, buf, offset):
+        index = _BLOCK_INT16.unpack_from(buf, offset)[0]
+        name, end = __load_string__(buf, offset + 4)
+        self.asset.parts[index] = XAnim.PartInfo(name)
+        return offset + padded(end - offset)
+
+    def LoadPartIndex(self, buf, offset):
+        index = _BLOCK_INT16.unpack_from(buf, offset)[0]
+        frame_part = XAnim.FramePart(matrix=[])
+        self.active_frame.parts[index] = frame_part
+        self.active_thing = frame_part
+        return offset + 4
+
+    def LoadFramerate(self, buf, offset):
+        self.asset.framerate = _BLOCK_INT16.unpack_from(buf, offset)[0]
+        return offset + 4
+
+    def LoadFrameCount(self, buf, offset):
+        return offset + 8
+
+    def LoadFrameIndex(self, buf, offset):
+        frame = XAnim.Frame(_BLOCK_INT32.unpack_from(buf, offset)[0])
+        frame.parts = [None] * len(self.asset.parts)
+        self.active_frame = frame
+        self.asset.frames.append(frame)
+        return offset + 8
+
+    def LoadNotetracksBegin(self, buf, offset):
+        # Activate a dummy frame, as notetracks sometimes contain part
+        # indices.
+        # If the active_frame isn't reset, the bone data for
+        #  the most recently loaded frame will be corrupted
+        dummy_frame = XAnim.Frame(-1)
+        dummy_frame.parts = [None] * len(self.asset.parts)
+        self.active_frame = dummy_frame
+        return offset + 4
+
+    def LoadNoteFrame(self, buf, offset):
+        frame = _BLOCK_INT32.unpack_from(buf, offset)[0]
+        string, end = __load_string__(buf, offset + 8)
+        self.asset.notes.append(XAnim.Note(frame, string))
+        return offset + padded(end - offset)
+
+
+# Markers for LoadState.active_thing when loading into a MeshBuffer
+__ACTIVE_VERTEX__ = 'vertex'
+__ACTIVE_CORNER__ = 'corner'
+
+
+class ArrayLoadState(LoadState):
+    '''
+    A LoadState that stores the vertex & face data for the model in a
+    MeshBuffer rather than creating Vertex / Face objects
+    '''
+    __slots__ = ('buffer', 'vert_index', 'corner',
+                 'weight_starts', 'weight_counts')
+
+    def __init__(self, asset, expected_type):
+        super(ArrayLoadState, self).__init__(asset, expected_type)
+        self.buffer = XModel.MeshBuffer(normal_type='h', color_type='B')
+        self.vert_index = -1
+        self.corner = -1
+        self.weight_starts = array('I')
+        self.weight_counts = array('H')
+
+    def Finish(self):
+        # Build the CSR weight offsets - the weights are stored in the order
+        #  they were loaded, so they only need to be moved if the verts
+        #  weren't in order
+        buffer = self.buffer
+        starts = self.weight_starts
+        counts = self.weight_counts
+        vert_count = len(counts)
+        offsets = array('I', [0]) * (vert_count + 1)
+        total = 0
+        for i in range(vert_count):
+            count = counts[i]
+            if count and starts[i] != total:
+                break
+            total += count
+            offsets[i + 1] = total
+        else:
+            buffer.weight_offsets = offsets
+            self.mesh = XModel.Mesh(self.mesh.name, buffer)
+            return
+
+        bones = buffer.weight_bones
+        values = buffer.weight_values
+        buffer.weight_bones = array('H')
+        buffer.weight_values = array('f')
+        for i in range(vert_count):
+            start = starts[i]
+            end = start + counts[i]
+            buffer.weight_bones.extend(bones[start:end])
+            buffer.weight_values.extend(values[start:end])
+            offsets[i + 1] = offsets[i] + counts[i]
+        buffer.weight_offsets = offsets
+        self.mesh = XModel.Mesh(self.mesh.name, buffer)
+
+    def LoadOffset(self, buf, offset):
+        if self.active_thing is not __ACTIVE_VERTEX__:
+            return LoadState.LoadOffset(self, buf, offset)
+        i = self.vert_index * 3
+        positions = self.buffer.positions
+        positions[i], positions[i + 1], positions[i + 2] = \
+            _BLOCK_VEC3.unpack_from(buf, offset)
+        return offset + 16
+
+    def LoadVertexCount(self, buf, offset):
+        self.__alloc_verts__(_BLOCK_UINT16.unpack_from(buf, offset)[0])
+        return offset + 4
+
+    def LoadVertex32Count(self, buf, offset):
+        self.__alloc_verts__(_BLOCK_INT32.unpack_from(buf, offset)[0])
+        return offset + 8
+
+    def __alloc_verts__(self, count):
+        self.buffer.positions = array('f', [0.0]) * (count * 3)
+        self.weight_starts = array('I', [0]) * count
+        self.weight_counts = array('H', [0]) * count
+
+    def LoadVertex(self, buf, offset, index, size):
+        buffer = self.buffer
+        self.active_thing = __ACTIVE_VERTEX__
+        self.vert_index = index
+        self.weight_starts[index] = len(buffer.weight_bones)
+        self.weight_counts[index] = 0
+
+        # See LoadState.LoadVertex
+        offset += size
+        if offset + 24 > len(buf):
+            return offset
+        h0, x, y, z, h1, count = _VERT_RECORD.unpack_from(buf, offset)
+        if h0 != 0x9383 or h1 != 0xEA46:
+            return offset
+        i = index * 3
+        positions = buffer.positions
+        positions[i] = x
+        positions[i + 1] = y
+        positions[i + 2] = z
+        offset += 20
+        layout, expected = __weight_layout__(count)
+        if offset + layout.size > len(buf):
+            return offset + 4
+        weights = layout.unpack_from(buf, offset)
+        if weights[0::3] != expected:
+            return offset + 4
+        buffer.weight_bones.extend(weights[1::3])
+        buffer.weight_values.extend(weights[2::3])
+        self.weight_counts[index] = count
+        return offset + layout.size
+
+    def LoadVertexWeightCount(self, buf, offset):
+        return offset + 4
+
+    def LoadVertexWeight(self, buf, offset):
+        bone, influence = _BLOCK_WEIGHT.unpack_from(buf, offset)
+        self.buffer.weight_bones.append(bone)
+        self.buffer.weight_values.append(influence)
+        self.weight_counts[self.vert_index] += 1
+        return offset + 8
+
+    def LoadTriCount(self, buf, offset):
+        return offset + 8
+
+    def LoadTri(self, object_index, material_index):
+        buffer = self.buffer
+        buffer.face_mesh_ids.append(object_index)
+        buffer.face_material_ids.append(material_index)
+        self.active_tri = len(buffer.face_mesh_ids) - 1
+        return self.active_tri
+
+    def LoadFaceVertices(self, buf, offset, tri):
+        # See LoadState.LoadFaceVertices
+        if offset + _FACE_RECORD16.size > len(buf):
+            return offset
+        v = _FACE_RECORD16.unpack_from(buf, offset)
+        if v[0::15] != _FACE_INDEX16_HASHES:
+            if v[0] != 0xB097 or offset + _FACE_RECORD32.size > len(buf):
+                return offset
+            v = _FACE_RECORD32.unpack_from(buf, offset)
+            if v[0::15] != _FACE_INDEX32_HASHES:
+                return offset
+        if (v[2::15] != _FACE_NORMAL_HASHES or
+                v[6::15] != _FACE_COLOR_HASHES or
+                v[11::15] != _FACE_UV_HASHES):
+            return offset
+        buffer = self.buffer
+        buffer.face_indices.extend(v[1::15])
+        normals = buffer.normals
+        normals.extend(v[3:6])
+        normals.extend(v[18:21])
+        normals.extend(v[33:36])
+        colors = buffer.colors
+        colors.extend(v[7:11])
+        colors.extend(v[22:26])
+        colors.extend(v[37:41])
+        uvs = buffer.uvs
+        uvs.extend(v[13:15])
+        uvs.extend(v[28:30])
+        uvs.extend(v[43:45])
+        self.corner += 3
+        self.active_thing = __ACTIVE_CORNER__
+        if v[0] == 0x8F03:
+            return offset + _FACE_RECORD16.size
+        return offset + _FACE_RECORD32.size
+
+    def LoadFaceVertex(self, index):
+        # Add the corner with default values that any following normal,
+        #  color or uv blocks will overwrite
+        buffer = self.buffer
+        buffer.face_indices.append(index)
+        buffer.normals.extend((0, 0, 32767))
+        buffer.colors.extend((255, 255, 255, 255))
+        buffer.uvs.extend((0.0, 0.0))
+        self.corner += 1
+        self.active_thing = __ACTIVE_CORNER__
+
+    def LoadTriVertNormal(self, buf, offset):
+        if self.active_thing is not __ACTIVE_CORNER__:
+            return LoadState.LoadTriVertNormal(self, buf, offset)
+        i = self.corner * 3
+        normals = self.buffer.normals
+        normals[i], normals[i + 1], normals[i + 2] = \
+            _BLOCK_SHORT_VEC3.unpack_from(buf, offset)
+        return offset + 8
+
+    def LoadTriVertColor(self, buf, offset):
+        if self.active_thing is not __ACTIVE_CORNER__:
+            return LoadState.LoadTriVertColor(self, buf, offset)
+        i = self.corner * 4
+        self.buffer.colors[i:i + 4] = array(
+            'B', _BLOCK_COLOR.unpack_from(buf, offset))
+        return offset + 8
+
+    def LoadTriVertUV(self, buf, offset):
+        if self.active_thing is not __ACTIVE_CORNER__:
+            return LoadState.LoadTriVertUV(self, buf, offset)
+        i = self.corner * 2
+        uvs = self.buffer.uvs
+        uvs[i], uvs[i + 1] = _BLOCK_UV.unpack_from(buf, offset)
+        return offset + 12
+
+
+# Maps each block hash to its description and handler
+BLOCK_INFO = {
+    0xC355: ("Comment block", LoadState.LoadComment),
+    0x46C8: ("Model identification block", LoadState.InitModel),
+    0x7AAC: ("Animation block", LoadState.InitAnim),
+    0x24D1: ("Version block", LoadState.LoadInt16),
+
+    # Model Specific
+    0x76BA: ("Bone count block", LoadState.LoadBoneCount),
+    0x7836: ("Cosmetic bone count block", LoadState.LoadCosmeticCount),
+    0xF099: ("Bone block", LoadState.LoadBoneInfo),
+    0xDD9A: ("Bone index block", LoadState.LoadBoneIndex),
+    0x9383: ("Vert / Bone offset block", LoadState.LoadOffset),
+    0x1C56: ("Bone scale block", LoadState.LoadBoneScale),
+    0xDCFD: ("Bone x matrix", LoadState.LoadBoneMatrix),
+    0xCCDC: ("Bone y matrix", LoadState.LoadBoneMatrix),
+    0xFCBF: ("Bone z matrix", LoadState.LoadBoneMatrix),
+
+    0x950D: ("Number of verts", LoadState.LoadVertexCount),
+    0x2AEC: ("Number of verts32", LoadState.LoadVertex32Count),
+    0x8F03: ("Vert info block marker", LoadState.LoadVertexIndex),
+    0xB097: ("Vert32 info block marker", LoadState.LoadVertex32Index),
+    0xEA46: ("Vert weighted bones count", LoadState.LoadVertexWeightCount),
+    0xF1AB: ("Vert bone weight info", LoadState.LoadVertexWeight),
+
+    0xBE92: ("Number of faces block", LoadState.LoadTriCount),
+    0x562F: ("Triangle info block", LoadState.LoadTriInfo),
+    0x6711: ("Triangle info (16) block", LoadState.LoadTri16Info),
+    0x89EC: ("Normal info", LoadState.LoadTriVertNormal),
+    0x6DD8: ("Color info", LoadState.LoadTriVertColor),
+    0x1AD4: ("UV info", LoadState.LoadTriVertUV),
+
+    0x62AF: ("Number of objects block", LoadState.LoadObjectCount),
+    0x87D4: ("Object info block", LoadState.LoadObjectInfo),
+
+    0xA1B2: ("Number of materials", LoadState.LoadMaterialCount),
+    0xA700: ("Material info block", LoadState.LoadMaterialInfo),
+    0x6DAB: ("Material transparency", LoadState.LoadMaterialTransparency),
+    0x37FF: ("Material ambient color", LoadState.LoadMaterialAmbientColor),
+    0x4265: ("Material incandescence", LoadState.LoadMaterialIncandescence),
+    0xC835: ("Material coeffs", LoadState.LoadMaterialCoeffs),
+    0xFE0C: ("Material glow", LoadState.LoadMaterialGlow),
+    0x7E24: ("Material refractive", LoadState.LoadMaterialRefractive),
+    0x317C: ("Material specular color", LoadState.LoadMaterialSpecularColor),
+    0xE593: ("Material reflective color",
+             LoadState.LoadMaterialReflectiveColor),
+    0x7D76: ("Material reflective", LoadState.LoadMaterialReflective),
+    0x83C7: ("Material blinn", LoadState.LoadMaterialBlinn),
+    0x5CD2: ("Material phong", LoadState.LoadMaterialPhong),
+
+    # Animation Specific
+    0x9279: ("NumParts block", LoadState.LoadPartCount),
+    0x360B: ("Part info block", LoadState.LoadPartInfo),
+    0x745A: ("Part index block", LoadState.LoadPartIndex),
+    0x92D3: ("Framerate block", LoadState.LoadFramerate),
+    0xB917: ("NumFrames block", LoadState.LoadFrameCount),
+    0xC723: ("Frame block", LoadState.LoadFrameIndex),
+
+    0xC7F3: ("Notetrack section block", LoadState.LoadNotetracksBegin),
+    0x9016: ("NumTracks block", LoadState.LoadInt16),
+    0x7A6C: ("NumKeys block", LoadState.LoadInt16),
+    0x4643: ("Notetrack block", LoadState.LoadInt16),
+    0x1675: ("Note frame block", LoadState.LoadNoteFrame),
+
+    # Misc (Unimplemented)
+    0xBCD4: ("FIRSTFRAME", None),
+    0x1FC2: ("NUMSBONES", None),
+    0xB35E: ("NUMSWEIGHTS", None),
+    0xEF69: ("QUATERNION", None),
+    0xA65B: ("NUMIKPITCHLAYERS", None),
+    0x1D7D: ("IKPITCHLAYER", None),
+    0xA58B: ("ROTATION", None),
+    0x6EEE: ("EXTRA", None)
+}
+
+
+def __build_handler_table__(state_type):
+    '''
+    Flatten BLOCK_INFO so the block loop only needs a single lookup
+    Handlers are resolved by name so state_type can override any of them
+    '''
+    return dict([(block_hash, getattr(state_type, entry[1].__name__))
+                 for block_hash, entry in BLOCK_INFO.items()
+                 if entry[1] is not None])
+
+
+__BLOCK_HANDLERS__ = __build_handler_table__(LoadState)
+__ARRAY_BLOCK_HANDLERS__ = __build_handler_table__(ArrayLoadState)
+
+
+def __load_blocks__(state, data, handlers, start=0, end=None, stats=None):
+    '''
+    Dispatch every block that starts in data[start:end] to its handler
+    If stats (an XBinStats) is given, each block is counted & timed
+    Returns the offset of the block following the last one loaded
+    '''
+    unpack_hash = _BLOCK_HASH.unpack_from
+
+    with __gc_paused__():
+        buf = memoryview(data)
+        if end is None:
+            end = len(buf)
+        size = end - 1
+        offset = start
+        if stats is not None:
+            add_block = stats.add_block
+            while offset < size:
+                block_hash = unpack_hash(buf, offset)[0]
+                handler = handlers.get(block_hash)
+                if handler is None:
+                    __raise_block_error__(block_hash, offset)
+                block_start = perf_counter()
+                next_offset = handler(state, buf, offset)
+                add_block(block_hash, next_offset - offset,
+                          perf_counter() - block_start)
+                offset = next_offset
+            return offset
+
+        while offset < size:
+            block_hash = unpack_hash(buf, offset)[0]
+            handler = handlers.get(block_hash)
+            if handler is None:
+                __raise_block_error__(block_hash, offset)
+            if LOG_BLOCKS:
+                print("Loading Block: '%s' at 0x%X" %
+                      (BLOCK_INFO[block_hash][0], offset + 2))
+            offset = handler(state, buf, offset)
+        return offset
+
+
+def __load_block_stream__(state, chunks, handlers, stats=None):
+    '''
+    Dispatch every block in an iterable of data chunks to its handler
+    Only the current chunk & whatever was left of the previous one are kept
+    Blocks that start within __STREAM_MARGIN__ bytes of the end of the data
+     received so far are held back until the next chunk has been added, so
+     each handler still sees the whole block (and any vertex / face record
+     that it begins)
+    If stats (an XBinStats) is given, the time spent waiting for chunks is
+     added to its 'decompress' phase
+    '''
+    chunks = iter(chunks)
+    data = b''
+    offset = 0
+    while True:
+        if stats is None:
+            chunk = next(chunks, None)
+        else:
+            start = perf_counter()
+            chunk = next(chunks, None)
+            stats.add_time('decompress', perf_counter() - start)
+        if chunk is None:
+            break
+        if stats is not None:
+            stats.uncompressed_size += len(chunk)
+        data = data[offset:] + chunk
+        offset = 0
+        end = len(data) - __STREAM_MARGIN__
+        if end > 0:
+            offset = __load_blocks__(state, data, handlers, 0, end, stats)
+    __load_blocks__(state, data, handlers, offset, stats=stats)
+
+
+def __string_block_size__(string_offset):
+    '''
+    Create a size function for blocks that end with a null terminated string
+    '''
+    def size(buf, offset):
+        string, end = __load_string__(buf, offset + string_offset)
+        return padded(end - offset)
+    return size
+
+
+def __material_block_size__(buf, offset):
+    name, end = __load_string_aligned__(buf, offset + 4)
+    _type, end = __load_string_aligned__(buf, end)
+    images, end = __load_string_aligned__(buf, end)
+    return padded(end - offset)
+
+
+# The size of each block - either a fixed size, or a function that
+#  calculates the size of the block at (buf, offset)
+BLOCK_SIZES = {
+    0xC355: __string_block_size__(4),
+    0x46C8: 4, 0x7AAC: 4, 0x24D1: 4,
+
+    0x76BA: 4, 0x7836: 8, 0xF099: __string_block_size__(12), 0xDD9A: 4,
+    0x9383: 16, 0x1C56: 16, 0xDCFD: 8, 0xCCDC: 8, 0xFCBF: 8,
+
+    0x950D: 4, 0x2AEC: 8, 0x8F03: 4, 0xB097: 8, 0xEA46: 4, 0xF1AB: 8,
+
+    0xBE92: 8, 0x562F: 4, 0x6711: 8, 0x89EC: 8, 0x6DD8: 8, 0x1AD4: 12,
+
+    0x62AF: 4, 0x87D4: __string_block_size__(4),
+
+    0xA1B2: 4, 0xA700: __material_block_size__,
+    0x6DAB: 20, 0x37FF: 20, 0x4265: 20, 0xC835: 12, 0xFE0C: 12, 0x7E24: 12,
+    0x317C: 20, 0xE593: 20, 0x7D76: 12, 0x83C7: 12, 0x5CD2: 8,
+
+    0x9279: 4, 0x360B: __string_block_size__(4), 0x745A: 4, 0x92D3: 4,
+    0xB917: 8, 0xC723: 8,
+
+    0xC7F3: 4, 0x9016: 4, 0x7A6C: 4, 0x4643: 4,
+    0x1675: __string_block_size__(8),
+}
+
+# The sections of an xbin, and the blocks that begin each of them
+SECTIONS = ('header', 'bones', 'verts', 'faces', 'objects', 'materials',
+            'parts', 'frames', 'notetracks')
+__SECTION_BLOCKS__ = {
+    0x76BA: 'bones', 0x7836: 'bones',
+    0x950D: 'verts', 0x2AEC: 'verts',
+    0xBE92: 'faces',
+    0x62AF: 'objects',
+    0xA1B2: 'materials',
+    0x9279: 'parts',
+    0x92D3: 'frames', 0xB917: 'frames',
+    0xC7F3: 'notetracks', 0x9016: 'notetracks', 0x7A6C: 'notetracks',
+}
+
+
+def __record_size__(buf, offset, block_hash):
+    '''
+    Get the size of the vertex or face record that begins at offset
+     (See LoadState.LoadVertex & LoadState.LoadFaceVertices)
+    Returns 0 if the blocks aren't laid out as a single record
+    '''
+    if block_hash == 0x8F03 or block_hash == 0xB097:
+        start = offset + BLOCK_SIZES[block_hash]
+        if start + 24 > len(buf):
+            return 0
+        h0, x, y, z, h1, count = _VERT_RECORD.unpack_from(buf, start)
+        if h0 != 0x9383 or h1 != 0xEA46:
+            return 0
+        layout, expected = __weight_layout__(count)
+        if start + 24 + layout.size > len(buf):
+            return 0
+        if layout.unpack_from(buf, start + 20)[0::3] != expected:
+            return 0
+        return start + 20 + layout.size - offset
+
+    start = offset + BLOCK_SIZES[block_hash]
+    if start + _FACE_RECORD32.size > len(buf):
+        return 0
+    v = _FACE_RECORD16.unpack_from(buf, start)
+    if v[0::15] == _FACE_INDEX16_HASHES:
+        size = _FACE_RECORD16.size
+    else:
+        v = _FACE_RECORD32.unpack_from(buf, start)
+        if v[0::15] != _FACE_INDEX32_HASHES:
+            return 0
+        size = _FACE_RECORD32.size
+    if (v[2::15] != _FACE_NORMAL_HASHES or
+            v[6::15] != _FACE_COLOR_HASHES or
+            v[11::15] != _FACE_UV_HASHES):
+        return 0
+    return start + size - offset
+
+
+def __face_section_size__(buf, offset, count):
+    '''
+    Check if the 'count' faces starting at offset are all laid out the same
+    way as the first one, using strided comparisons of their block hashes
+    Returns the total size of the faces, or 0 if they aren't
+    '''
+    if count <= 0 or offset + 4 > len(buf):
+        return 0
+    tri_hash = _BLOCK_HASH.unpack_from(buf, offset)[0]
+    if tri_hash != 0x562F and tri_hash != 0x6711:
+        return 0
+    record_size = __record_size__(buf, offset, tri_hash)
+    size = record_size * count
+    if not record_size or offset + size > len(buf):
+        return 0
+
+    header_size = BLOCK_SIZES[tri_hash]
+    index_hash = _BLOCK_HASH.unpack_from(buf, offset + header_size)[0]
+    index_size = BLOCK_SIZES[index_hash]
+    corner_size = index_size + 28
+    expected = [(0, tri_hash)]
+    for corner in range(3):
+        pos = header_size + corner * corner_size
+        expected.append((pos, index_hash))
+        expected.append((pos + index_size, 0x89EC))
+        expected.append((pos + index_size + 8, 0x6DD8))
+        expected.append((pos + index_size + 16, 0x1AD4))
+
+    words = buf[offset:offset + size].cast('H')
+    step = record_size // 2
+    for pos, block_hash in expected:
+        hashes = words[pos // 2::step].tobytes()
+        if hashes != _BLOCK_HASH.pack(block_hash) * count:
+            return 0
+    return size
+
+
+def scan_sections(data):
+    '''
+    Find the sections in the given (decompressed) xbin data without loading
+    any of them
+    Returns a dict that maps each section name (see SECTIONS) found in the
+    file to its (start, end) offsets
+    '''
+    unpack_hash = _BLOCK_HASH.unpack_from
+    sizes = BLOCK_SIZES
+    section_blocks = __SECTION_BLOCKS__
+    record_blocks = (0x8F03, 0xB097, 0x562F, 0x6711)
+
+    buf = memoryview(data)
+    size = len(buf) - 1
+    sections = {}
+    section = 'header'
+    section_start = 0
+    offset = 0
+    while offset < size:
+        block_hash = unpack_hash(buf, offset)[0]
+        block_section = section_blocks.get(block_hash)
+        if block_section is not None and block_section != section:
+            sections[section] = (section_start, offset)
+            section = block_section
+            section_start = offset
+            if block_hash == 0xBE92:
+                # Most files can skip all of their faces in one go
+                count = _BLOCK_INT32.unpack_from(buf, offset)[0]
+                offset += 8
+                offset += __face_section_size__(buf, offset, count)
+                continue
+        elif block_hash in record_blocks:
+            # Skip entire vertices / faces at once where possible
+            record_size = __record_size__(buf, offset, block_hash)
+            if record_size:
+                offset += record_size
+                continue
+
+        block_size = sizes.get(block_hash)
+        if block_size is None:
+            __raise_block_error__(block_hash, offset)
+        if block_size.__class__ is not int:
+            block_size = block_size(buf, offset)
+        offset += block_size
+
+    sections[section] = (section_start, offset)
+    return sections
+
+
+class XBinStats(object):
+    '''
+    Counts & timings collected while loading or writing an xbin file
+
+    Pass one as the stats argument of LoadFile_Bin / WriteFile_Bin to have
+    it filled in, or pass a function to have it called with a new one once
+    the file has been loaded / written
+
+    blocks maps each block hash to [count, bytes, seconds]
+     When loading, a vertex or face that was read in one go is counted as
+     its first block. Blocks aren't timed when writing
+    phases maps each phase to the number of seconds spent in it:
+     loading - 'decompress', 'scan', 'parse', 'finish', 'generate_meshes'
+     writing - 'pack', 'compress'
+    '''
+    __slots__ = ('blocks', 'phases', 'compressed_size', 'uncompressed_size',
+                 'compression', 'last')
+
+    def __init__(self):
+        self.blocks = {}
+        self.phases = {}
+        self.compressed_size = 0
+        self.uncompressed_size = 0
+        # The compression level used when writing
+        self.compression = None
+        self.last = perf_counter()
+
+    @staticmethod
+    def begin(stats):
+        '''
+        Get the XBinStats to fill in for a stats argument (None if stats is)
+        '''
+        if stats is None:
+            return None
+        if isinstance(stats, XBinStats):
+            stats.last = perf_counter()
+            return stats
+        return XBinStats()
+
+    @staticmethod
+    def end(stats, collected):
+        '''
+        Hand the collected XBinStats to the stats argument if it's a function
+        '''
+        if stats is not None and collected is not stats:
+            stats(collected)
+
+    def lap(self, phase):
+        '''
+        Add the time since the last lap to phase
+        '''
+        now = perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def add_time(self, phase, seconds):
+        '''
+        Add seconds to phase, leaving them out of the current lap
+        '''
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        self.last += seconds
+
+    def add_block(self, block_hash, size, seconds=0.0):
+        entry = self.blocks.get(block_hash)
+        if entry is None:
+            self.blocks[block_hash] = [1, size, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += size
+            entry[2] += seconds
+
+    def add_blocks(self, data):
+        '''
+        Count (without timing) each block in data
+        '''
+        buf = memoryview(data)
+        unpack_hash = _BLOCK_HASH.unpack_from
+        size = len(buf) - 1
+        offset = 0
+        while offset < size:
+            block_hash = unpack_hash(buf, offset)[0]
+            block_size = BLOCK_SIZES.get(block_hash)
+            if block_size is None:
+                __raise_block_error__(block_hash, offset)
+            if block_size.__class__ is not int:
+                block_size = block_size(buf, offset)
+            self.add_block(block_hash, block_size)
+            offset += block_size
+
+    @property
+    def total_time(self):
+        return sum(self.phases.values())
+
+    @property
+    def ratio(self):
+        '''
+        The compression ratio (uncompressed size / compressed size)
+        '''
+        if not self.compressed_size:
+            return 0.0
+        return float(self.uncompressed_size) / self.compressed_size
+
+    def __str__(self):
+        lines = []
+        for phase, seconds in sorted(self.phases.items(),
+                                     key=lambda item: -item[1]):
+            lines.append('%-16s %9.4fs' % (phase, seconds))
+        lines.append('%-16s %9.4fs' % ('total', self.total_time))
+        lines.append('size %d bytes (%d compressed, ratio %.2f)' %
+                     (self.uncompressed_size, self.compressed_size,
+                      self.ratio))
+
+        lines.append('%-32s %8s %10s %9s' % ('block', 'count', 'bytes',
+                                             'seconds'))
+        for block_hash, (count, size, seconds) in sorted(
+                self.blocks.items(), key=lambda item: (-item[1][2],
+                                                       -item[1][1])):
+            name = BLOCK_INFO[block_hash][0]
+            lines.append('%-32s %8d %10d %9.4f' % (name, count, size, seconds))
+        return '\n'.join(lines)
+
+
+class BlockWriter(object):
+    '''
+    Write-only file object that the XBlock.Write* methods can write to
+    Blocks are staged in a reusable buffer, which is handed to an
+    incremental LZ4 compressor by drain() once it holds buffer_size bytes -
+    so the uncompressed file is never held in memory as a whole. The
+    uncompressed size in the file header is filled in by close()
+    Used as a context manager, the file is closed when the block ends, or
+    removed if it ends with an exception (See abort())
+    level is the lz4 compression level (0 stores the data uncompressed)
+    If stats (an XBinStats) is given, the sizes & the time spent compressing
+    are recorded, and if count_blocks is True the blocks are counted too
+    '''
+    __slots__ = ('file', 'stage', 'write', 'buffer_size', 'size',
+                 'compressor', 'stats', 'count_blocks')
+
+    def __init__(self, file, buffer_size=0x10000, level=lz4.DEFAULT_LEVEL,
+                 stats=None, count_blocks=True):
+        if LZ4_VERBOSE:
+            print_lz4_support_info()
+            print('LZ4: Encoding')
+        self.file = file
+        self.stage = BytesIO()
+        # Blocks go straight into the stage
+        self.write = self.stage.write
+        self.buffer_size = buffer_size
+        # The number of bytes that have already been compressed
+        self.size = 0
+        # The compressed data is written as it's produced
+        self.compressor = lz4.Compressor(level=level, write=file.write)
+        self.stats = stats
+        self.count_blocks = count_blocks
+        if stats is not None:
+            stats.compression = level
+
+        try:
+            file.write(b'*LZ4*')
+            file.write(struct.pack('I', 0))
+        except BaseException:
+            self.abort()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def tell(self):
+        return self.size + self.stage.tell()
+
+    def drain(self, force=False):
+        '''
+        Compress the staged blocks if there are enough of them (or force)
+        Should be called regularly while writing
+        '''
+        stage = self.stage
+        used = stage.tell()
+        if used < self.buffer_size and not force:
+            return
+        # The stage is rewound rather than truncated, so its memory is reused
+        view = stage.getbuffer()
+        data = view[:used]
+        if self.stats is None:
+            self.compressor.compress(data)
+        else:
+            if self.count_blocks:
+                self.stats.add_blocks(data)
+            start = perf_counter()
+            self.compressor.compress(data)
+            self.stats.add_time('compress', perf_counter() - start)
+        data.release()
+        view.release()
+        stage.seek(0)
+        self.size += used
+
+    def close(self):
+        '''
+        Finish the block & fill in the header (See abort() for errors)
+        '''
+        file = self.file
+        try:
+            self.drain(force=True)
+            start = perf_counter()
+            self.compressor.flush()
+            compressed_size = file.tell()
+            if self.stats is not None:
+                self.stats.add_time('compress', perf_counter() - start)
+                self.stats.uncompressed_size = self.size
+                self.stats.compressed_size = compressed_size
+            file.seek(5, os.SEEK_SET)
+            file.write(struct.pack('I', self.size))
+            file.flush()
+        except BaseException:
+            self.abort()
+            raise
+        file.close()
+        if LZ4_VERBOSE:
+            print('LZ4: Done (%d -> %d bytes)' % (self.size, compressed_size))
+
+    def abort(self):
+        '''
+        Close & remove the file after an error, rather than leaving a
+        truncated file with the wrong size in its header
+        '''
+        file = self.file
+        try:
+            file.close()
+        except (IOError, OSError):
+            pass
+        try:
+            os.remove(file.name)
+        except (IOError, OSError, AttributeError):
+            pass
 
 
 class XBinIO(object):
@@ -449,477 +1876,298 @@ class XBinIO(object):
             dump_file.write(data)
             dump_file.close()
 
-        return BytesIO(data)
+        return data
 
     @staticmethod
-    def __compress_internal__(in_file, out_file, close_files=True):
-        if LZ4_VERBOSE:
-            print_lz4_support_info()
-            print('LZ4: Encoding')
-        in_file.seek(0, os.SEEK_END)
-        uncompressed_size = in_file.tell()
-        in_file.seek(0, os.SEEK_SET)
-        compressed_data = lz4.compress(in_file.read())
-        if close_files:
-            in_file.close()
-        if LZ4_VERBOSE:
-            print('LZ4: Done')
-        out_file.write(b'*LZ4*')
-        out_file.write(struct.pack('I', uncompressed_size))
-        out_file.write(compressed_data)
-        if close_files:
-            out_file.close()
-
-    def __xbin_loadfile_internal__(self, file, expected_type):
+    def __stream_internal__(file, window_size, is_compressed=True,
+                            dump=False):
         '''
-        Load an x*_bin file
-        file is a handle to the file
-        target_type = 'ANIM' or 'MODEL'
+        Yield the (decompressed) contents of file in chunks of about
+        window_size bytes, closing it once it's been read
         '''
-
-        # Ensure that these modules can inherit from us by delay loading
-        from . import xmodel as XModel
-        from . import xanim as XAnim
-
-        class LoadState(object):
-            __slots__ = ('active_thing', 'active_tri',
-                         'active_frame', 'asset_type')
-
-            def __init__(self):
-                self.active_thing = None
-                self.active_tri = None
-                self.active_frame = None
-                self.asset_type = None
-
-        state = LoadState()
-        dummy_mesh = XModel.Mesh("$default")
-
-        def InitModel(file):
-            XBlock.LoadInt16Block(file)
-            state.asset_type = 'MODEL'
-            if expected_type != state.asset_type:
-                raise TypeError("Found %s asset. Expected %s" %
-                                (state.asset_type, expected_type))
-
-        def InitAnim(file):
-            XBlock.LoadInt16Block(file)
-            state.asset_type = 'ANIM'
-            if expected_type != state.asset_type:
-                raise TypeError("Found %s asset. Expected %s" %
-                                (state.asset_type, expected_type))
-
-        def LoadBoneCount(file):
-            self.bones = [None] * XBlock.LoadInt16Block(file)
-
-        def LoadCosmeticCount(file):
-            self.cosmetics = XBlock.LoadInt32Block(file)
-
-        def LoadBoneInfo(file):
-            index, parent, name = XBlock.LoadBoneBlock(file)
-            bone = XModel.Bone(name, parent)
-            if index >= (len(self.bones) - self.cosmetics):
-                bone.cosmetic = True
-            self.bones[index] = bone
-
-        def LoadBoneIndex(file):
-            index = XBlock.LoadInt16Block(file)
-            bone = self.bones[index]
-            bone.matrix = []
-            state.active_thing = bone
-
-        def LoadOffset(file):
-            data = XBlock.LoadVec3Block(file)
-            state.active_thing.offset = data
-            return data
-
-        def LoadBoneScale(file):
-            data = XBlock.LoadVec3Block(file)
-            state.active_thing.scale = data
-
-        def LoadBoneMatrix(file):
-            data = XBlock.LoadShortVec3Block(file)
-            state.active_thing.matrix.append(data)
-            return data
-
-        def LoadVertexCount(file):
-            dummy_mesh.verts = [None] * XBlock.LoadUInt16Block(file)
-
-        def LoadVertex32Count(file):
-            dummy_mesh.verts = [None] * XBlock.LoadInt32Block(file)
-
-        def LoadVertexIndex(file):
-            index = XBlock.LoadUInt16Block(file)
-            if state.active_tri is None:
-                vertex = XModel.Vertex()
-                dummy_mesh.verts[index] = vertex
-                state.active_thing = vertex
-            else:
-                face_vert = XModel.FaceVertex(index)
-                state.active_tri.indices.append(face_vert)
-                state.active_thing = face_vert
-
-        def LoadVertex32Index(file):
-            index = XBlock.LoadInt32Block(file)
-            if state.active_tri is None:
-                vertex = XModel.Vertex()
-                dummy_mesh.verts[index] = vertex
-                state.active_thing = vertex
+        filepath = os.path.realpath(file.name)
+        dump_file = None
+        try:
+            if is_compressed:
+                bin_magic = file.read(5)
+                if bin_magic != b'*LZ4*':
+                    raise ValueError("Bad magic %s expected b'*LZ4*'" %
+                                     repr(bin_magic))
+                size = struct.unpack('I', file.read(4))[0]
+                if LZ4_VERBOSE:
+                    print_lz4_support_info()
+                    print("LZ4: Decompressing File: '%s' (%d byte window)" %
+                          (os.path.basename(filepath), window_size))
+                chunks = lz4.stream_uncompress(file.read, window_size, size)
             else:
-                face_vert = XModel.FaceVertex(index)
-                state.active_tri.indices.append(face_vert)
-                state.active_thing = face_vert
-
-        def LoadVertexWeightCount(file):
-            XBlock.LoadInt16Block(file)
-            state.active_thing.weights = []
+                chunks = iter(lambda: file.read(window_size), b'')
+
+            if dump:
+                dump_name = os.path.splitext(filepath)[0]
+                dump_file = open("%s.dump" % dump_name, "wb")
+            for chunk in chunks:
+                if dump_file is not None:
+                    dump_file.write(chunk)
+                yield chunk
+            if is_compressed and LZ4_VERBOSE:
+                print('LZ4: Done')
+        finally:
+            file.close()
+            if dump_file is not None:
+                dump_file.close()
 
-        def LoadVertexWeight(file):
-            state.active_thing.weights.append(
-                XBlock.LoadVertexWeightBlock(file))
-
-        def LoadTriCount(file):
-            XBlock.LoadInt32Block(file)
-            dummy_mesh.faces = []
-
-        def LoadTriInfo(file):
-            object_index, material_index = XBlock.LoadTriangleBlock(file)
-            tri = XModel.Face(object_index, material_index)
-            tri.indices = []
-            dummy_mesh.faces.append(tri)
-            state.active_tri = tri
-
-        def LoadTri16Info(file):
-            object_index, material_index = XBlock.LoadTriangle16Block(file)
-            tri = XModel.Face(object_index, material_index)
-            tri.indices = []
-            dummy_mesh.faces.append(tri)
-            state.active_tri = tri
+    @staticmethod
+    def __file_type__(path):
+        '''
+        Identify the type of the given file from its first few bytes
+        Returns 'LZ4' (compressed xbin), 'BIN' (uncompressed xbin) or 'RAW'
+        '''
+        file = open(path, "rb")
+        magic = file.read(5)
+        file.close()
+        if magic == b'*LZ4*':
+            return 'LZ4'
+        if len(magic) >= 2 and _BLOCK_HASH.unpack_from(magic)[0] in BLOCK_INFO:
+            return 'BIN'
+        return 'RAW'
 
-        def LoadTriVertNormal(file):
-            state.active_thing.normal = XBlock.LoadShortVec3Block(file)
-
-        def LoadTriVertColor(file):
-            state.active_thing.color = XBlock.LoadColorBlock(file)
-
-        def LoadTriVertUV(file):
-            state.active_thing.uv = XBlock.LoadUVBlock(file)
-
-        def LoadObjectCount(file):
-            self.meshes = [None] * XBlock.LoadInt16Block(file)
-
-        def LoadObjectInfo(file):
-            index, name = XBlock.LoadObjectBlock(file)
-            self.meshes[index] = XModel.Mesh(name)
-
-        def LoadMaterialCount(file):
-            self.materials = [None] * XBlock.LoadInt16Block(file)
-
-        def LoadMaterialInfo(file):
-            index, name, _type, images = XBlock.LoadMaterialBlock(file)
-            material = XModel.Material(name, _type, images)
-            self.materials[index] = material
-            state.active_thing = material
-
-        def LoadMaterialTransparency(file):
-            state.active_thing.transparency = XBlock.LoadVec4Block(file)
-
-        def LoadMaterialAmbientColor(file):
-            state.active_thing.color_ambient = XBlock.LoadVec4Block(file)
-
-        def LoadMaterialIncandescence(file):
-            state.active_thing.incandescence = XBlock.LoadVec4Block(file)
-
-        def LoadMaterialCoeffs(file):
-            state.active_thing.coeffs = XBlock.LoadVec2Block(file)
-
-        def LoadMaterialGlow(file):
-            state.active_thing.glow = XBlock.LoadVec2Block(file)
-
-        def LoadMaterialRefractive(file):
-            state.active_thing.refractive = XBlock.LoadVec2Block(file)
-
-        def LoadMaterialSpecularColor(file):
-            state.active_thing.color_specular = XBlock.LoadVec4Block(file)
-
-        def LoadMaterialReflectiveColor(file):
-            state.active_thing.color_reflective = XBlock.LoadVec4Block(file)
-
-        def LoadMaterialReflective(file):
-            state.active_thing.reflective = XBlock.LoadVec2Block(file)
-
-        def LoadMaterialBlinn(file):
-            state.active_thing.blinn = XBlock.LoadVec2Block(file)
-
-        def LoadMaterialPhong(file):
-            state.active_thing.phong = XBlock.LoadFloatBlock(file)
-
-        # Animation
-        def LoadPartCount(file):
-            self.parts = [None] * XBlock.LoadInt16Block(file)
-
-        def LoadPartInfo(file):
-            index, name = XBlock.LoadObjectBlock(file)
-            self.parts[index] = XAnim.PartInfo(name)
-
-        def LoadPartIndex(file):
-            index = XBlock.LoadInt16Block(file)
-            frame_part = XAnim.FramePart(matrix=[])
-            state.active_frame.parts[index] = frame_part
-            state.active_thing = frame_part
-            return index
-
-        def LoadFramerate(file):
-            self.framerate = XBlock.LoadInt16Block(file)
-
-        def LoadFrameCount(file):
-            XBlock.LoadInt32Block(file)
-
-        def LoadFrameIndex(file):
-            frame = XAnim.Frame(XBlock.LoadInt32Block(file))
-            frame.parts = [None] * len(self.parts)
-            state.active_frame = frame
-            self.frames.append(frame)
-            return frame.frame
-
-        def LoadNotetracksBegin(file):
-            # Activate a dummy frame, as notetracks sometimes contain part
-            # indices.
-            # If the active_frame isn't reset, the bone data for
-            #  the most recently loaded frame will be corrupted
-            dummy_frame = XAnim.Frame(-1)
-            dummy_frame.parts = [None] * len(self.parts)
-            state.active_frame = dummy_frame
-            XBlock.LoadInt16Block(file)
-
-        def LoadNoteFrame(file):
-            frame, string = XBlock.LoadNoteFrameBlock(file)
-            self.notes.append(XAnim.Note(frame, string))
-
-        hashmap = {
-            0xC355: ("Comment block", XBlock.LoadCommentBlock),
-            0x46C8: ("Model identification block", InitModel),
-            0x7AAC: ("Animation block", InitAnim),
-            0x24D1: ("Version block", XBlock.LoadInt16Block),
-
-            # Model Specific
-            0x76BA: ("Bone count block", LoadBoneCount),
-            0x7836: ("Cosmetic bone count block", LoadCosmeticCount),
-            0xF099: ("Bone block", LoadBoneInfo),
-            0xDD9A: ("Bone index block", LoadBoneIndex),
-            0x9383: ("Vert / Bone offset block", LoadOffset),
-            0x1C56: ("Bone scale block", LoadBoneScale),
-            0xDCFD: ("Bone x matrix", LoadBoneMatrix),
-            0xCCDC: ("Bone y matrix", LoadBoneMatrix),
-            0xFCBF: ("Bone z matrix", LoadBoneMatrix),
-
-            0x950D: ("Number of verts", LoadVertexCount),
-            0x2AEC: ("Number of verts32", LoadVertex32Count),
-            0x8F03: ("Vert info block marker", LoadVertexIndex),
-            0xB097: ("Vert32 info block marker", LoadVertex32Index),
-            0xEA46: ("Vert weighted bones count", LoadVertexWeightCount),
-            0xF1AB: ("Vert bone weight info", LoadVertexWeight),
-
-            0xBE92: ("Number of faces block", LoadTriCount),
-            0x562F: ("Triangle info block", LoadTriInfo),
-            0x6711: ("Triangle info (16) block", LoadTri16Info),
-            0x89EC: ("Normal info", LoadTriVertNormal),
-            0x6DD8: ("Color info", LoadTriVertColor),
-            0x1AD4: ("UV info", LoadTriVertUV),
-
-            0x62AF: ("Number of objects block", LoadObjectCount),
-            0x87D4: ("Object info block", LoadObjectInfo),
-
-            0xA1B2: ("Number of materials", LoadMaterialCount),
-            0xA700: ("Material info block", LoadMaterialInfo),
-            0x6DAB: ("Material transparency", LoadMaterialTransparency),
-            0x37FF: ("Material ambient color", LoadMaterialAmbientColor),
-            0x4265: ("Material incandescence", LoadMaterialIncandescence),
-            0xC835: ("Material coeffs", LoadMaterialCoeffs),
-            0xFE0C: ("Material glow", LoadMaterialGlow),
-            0x7E24: ("Material refractive", LoadMaterialRefractive),
-            0x317C: ("Material specular color", LoadMaterialSpecularColor),
-            0xE593: ("Material reflective color", LoadMaterialReflectiveColor),
-            0x7D76: ("Material reflective", LoadMaterialReflective),
-            0x83C7: ("Material blinn", LoadMaterialBlinn),
-            0x5CD2: ("Material phong", LoadMaterialPhong),
-
-            # Animation Specific
-            0x9279: ("NumParts block", LoadPartCount),
-            0x360B: ("Part info block", LoadPartInfo),
-            0x745A: ("Part index block", LoadPartIndex),
-            0x92D3: ("Framerate block", LoadFramerate),
-            0xB917: ("NumFrames block", LoadFrameCount),
-            0xC723: ("Frame block", LoadFrameIndex),
-
-            0xC7F3: ("Notetrack section block", LoadNotetracksBegin),
-            0x9016: ("NumTracks block", XBlock.LoadInt16Block),
-            0x7A6C: ("NumKeys block", XBlock.LoadInt16Block),
-            0x4643: ("Notetrack block", XBlock.LoadInt16Block),
-            0x1675: ("Note frame block", LoadNoteFrame),
-
-            # Misc (Unimplemented)
-            0xBCD4: ("FIRSTFRAME", None),
-            0x1FC2: ("NUMSBONES", None),
-            0xB35E: ("NUMSWEIGHTS", None),
-            0xEF69: ("QUATERNION", None),
-            0xA65B: ("NUMIKPITCHLAYERS", None),
-            0x1D7D: ("IKPITCHLAYER", None),
-            0xA58B: ("ROTATION", None),
-            0x6EEE: ("EXTRA", None)
-        }
-
-        # Read all blocks
-        data = file.read(2)
-        while data:
-            block_hash = struct.unpack('H', data)[0]
-            if block_hash in hashmap:
-                offset = file.tell()
-                data = hashmap[block_hash]
-                if data[1] is None:
-                    raise NotImplementedError(
-                        "Unimplemented Block '%s' at 0x%X" %
-                        (data[0], offset))
-                    break
+    def __xbin_probe_internal__(self, data, expected_type):
+        '''
+        Load only the bones / parts, objects and materials of an x*_bin file
+        Returns a dict with the file's version, vertex, face & frame counts
+        '''
+        if XModel is None:
+            __bind_asset_modules__()
+
+        state = LoadState(self, expected_type)
+        buf = memoryview(data)
+        counts = {'version': None, 'verts': 0, 'faces': 0, 'frames': 0}
+
+        if expected_type == 'MODEL':
+            # Materials are at the end of the file, so use the section table
+            #  to skip over the vertices & faces
+            toc = scan_sections(buf)
+            for name in ('header', 'bones', 'objects', 'materials'):
+                if name in toc:
+                    __load_blocks__(state, buf, __BLOCK_HANDLERS__, *toc[name])
+            if 'verts' in toc:
+                start = toc['verts'][0]
+                if _BLOCK_HASH.unpack_from(buf, start)[0] == 0x950D:
+                    counts['verts'] = _BLOCK_UINT16.unpack_from(buf, start)[0]
                 else:
-                    if LOG_BLOCKS:
-                        print("Loading Block: '%s' at 0x%X" %
-                              (data[0], offset))
-                    val = data[1](file)
-                    if LOG_BLOCKS:
-                        print("        Data: %s" % repr(val))
-
-                # Read the next block hash
-                data = file.read(2)
-            else:
-                offset = file.tell() - 2
-                raise ValueError("Unknown Block Hash 0x%X at 0x%X" %
-                                 (block_hash, offset))
+                    counts['verts'] = _BLOCK_INT32.unpack_from(buf, start)[0]
+            if 'faces' in toc:
+                start = toc['faces'][0]
+                counts['faces'] = _BLOCK_INT32.unpack_from(buf, start)[0]
+            end = toc['header'][1]
+        else:
+            # Everything we need precedes the first frame
+            end = len(buf)
+
+        offset = 0
+        while offset < end - 1:
+            block_hash = _BLOCK_HASH.unpack_from(buf, offset)[0]
+            if block_hash == 0x24D1:
+                counts['version'] = _BLOCK_INT16.unpack_from(buf, offset)[0]
+            elif block_hash == 0xB917:
+                counts['frames'] = _BLOCK_INT32.unpack_from(buf, offset)[0]
+            elif block_hash == 0xC723 or block_hash == 0xC7F3:
                 break
+            if expected_type == 'MODEL':
+                block_size = BLOCK_SIZES.get(block_hash)
+                if block_size is None:
+                    __raise_block_error__(block_hash, offset)
+                if block_size.__class__ is not int:
+                    block_size = block_size(buf, offset)
+                offset += block_size
+            else:
+                handler = __BLOCK_HANDLERS__.get(block_hash)
+                if handler is None:
+                    __raise_block_error__(block_hash, offset)
+                offset = handler(state, buf, offset)
+        return counts
+
+    def __xbin_loadfile_internal__(self, data, expected_type,
+                                   as_arrays=False, sections=None,
+                                   stats=None):
+        '''
+        Load an x*_bin file
+        data is the (decompressed) contents of the file, or an iterable of
+         chunks of it (See __stream_internal__)
+        target_type = 'ANIM' or 'MODEL'
+        as_arrays loads the model's vertex & face data into a MeshBuffer
+        sections can be used to only load the given sections (See SECTIONS)
+        stats is an optional XBinStats to record the blocks & phases in
+        '''
+        if XModel is None:
+            __bind_asset_modules__()
+
+        if as_arrays:
+            state = ArrayLoadState(self, expected_type)
+            handlers = __ARRAY_BLOCK_HANDLERS__
+        else:
+            state = LoadState(self, expected_type)
+            handlers = __BLOCK_HANDLERS__
+
+        if not isinstance(data, (bytes, bytearray)):
+            if sections is not None:
+                raise ValueError("sections can't be used when loading "
+                                 "the file in chunks")
+            __load_block_stream__(state, data, handlers, stats)
+        elif sections is None:
+            __load_blocks__(state, data, handlers, stats=stats)
+        else:
+            for name in sections:
+                if name not in SECTIONS:
+                    raise ValueError("Unknown section '%s' - must be one of %s"
+                                     % (name, repr(SECTIONS)))
+
+            # Frames & notetracks can't be loaded without the part count
+            sections = set(sections) | set(['header'])
+            if 'frames' in sections or 'notetracks' in sections:
+                sections.add('parts')
+
+            toc = scan_sections(data)
+            if stats is not None:
+                stats.lap('scan')
+            for name in SECTIONS:
+                if name in sections and name in toc:
+                    start, end = toc[name]
+                    __load_blocks__(state, data, handlers, start, end, stats)
+        if stats is not None:
+            stats.lap('parse')
+        state.Finish()
+        if stats is not None:
+            stats.lap('finish')
 
         # Return the dummy mesh for splitting if we imported a model
         if state.asset_type == 'MODEL':
-            return dummy_mesh
+            return state.mesh
 
     def __xbin_writefile_model_internal__(self, filepath, version=7,
                                           extended_features=True,
-                                          header_message=""):
+                                          header_message="", stats=None,
+                                          compression_level=1,
+                                          count_blocks=True):
         model = self
 
-        real_file = open(filepath, "wb")
-        file = BytesIO()
-        version = 7
-        if header_message != '':
-            XBlock.WriteCommentBlock(file, header_message)
-        XBlock.WriteModelBlock(file)
-        XBlock.WriteVersionBlock(file, version)
-
-        cosmetic_count = len([bone for bone in self.bones if bone.cosmetic])
-
-        XBlock.WriteBoneCountBlock(file, len(model.bones))
-        if cosmetic_count > 0:
-            XBlock.WriteCosmeticInfoBlock(file, cosmetic_count)
-
-        for bone_index, bone in enumerate(model.bones):
-            XBlock.WriteBoneInfoBlock(file, bone_index, bone)
-
-        for bone_index, bone in enumerate(model.bones):
-            XBlock.WriteBoneIndexBlock(file, bone_index)
-            XBlock.WriteOffsetBlock(file, bone.offset)
-            XBlock.WriteMetaVec3Block(file, 0x1C56, bone.scale)
-            XBlock.WriteMatrixBlock(file, bone.matrix)
-
-        # Used to offset the vertex indices for each mesh
-        vert_offsets = [0]
-        for mesh in model.meshes:
-            prev_index = len(vert_offsets) - 1
-            vert_offsets.append(vert_offsets[prev_index] + len(mesh.verts))
-
-        vert_count = vert_offsets[len(vert_offsets) - 1]
-
-        if version == 7 and vert_count > 0xFFFF:
-            WriteVertexCountBlock = XBlock.WriteVertex32Count
-            WriteVertexIndexBlock = XBlock.WriteVertex32Index
-        else:
-            WriteVertexCountBlock = XBlock.WriteVertex16Count
-            WriteVertexIndexBlock = XBlock.WriteVertex16Index
-
-        WriteVertexCountBlock(file, vert_count)
-        for mesh_index, mesh in enumerate(model.meshes):
-            vert_offset = vert_offsets[mesh_index]
-            for vert_index, vert in enumerate(mesh.verts):
-                WriteVertexIndexBlock(file, vert_index + vert_offset)
-                XBlock.WriteOffsetBlock(file, vert.offset)
-                XBlock.WriteMetaInt16Block(file, 0xEA46, len(vert.weights))
-                for weight in vert.weights:
-                    XBlock.WriteVertexWeightBlock(file, weight)
-
-        # Faces
-        face_count = sum([len(mesh.faces) for mesh in model.meshes])
-        XBlock.WriteMetaInt32Block(file, 0xBE92, face_count)
-        for mesh_index, mesh in enumerate(model.meshes):
-            vert_offset = vert_offsets[mesh_index]
-            for face in mesh.faces:
-                XBlock.WriteFaceInfoBlock(file, face)
-                for i in range(3):
-                    ind = face.indices[i]
-                    WriteVertexIndexBlock(file, ind.vertex + vert_offset)
-                    XBlock.WriteFaceVertexNormalBlock(file, ind.normal)
-                    XBlock.WriteColorBlock(file, ind.color)
-                    XBlock.WriteFaceVertexUVBlock(file, 1, ind.uv)
-
-        # Objects
-        XBlock.WriteMetaInt16Block(file, 0x62AF, len(model.meshes))
-        for mesh_index, mesh in enumerate(model.meshes):
-            XBlock.WriteMetaObjectInfo(file, 0x87D4, mesh_index, mesh.name)
-
-        # Materials
-        XBlock.WriteMetaInt16Block(file, 0xA1B2, len(model.materials))
-        for material_index, material in enumerate(model.materials):
-            XBlock.WriteMaterialInfoBlock(file, material_index,
-                                          material, extended_features)
-
-            XBlock.WriteColorBlock(file, material.color)
-            XBlock.WriteMetaVec4Block(file, 0x6DAB, material.transparency)
-            XBlock.WriteMetaVec4Block(file, 0x37FF, material.color_ambient)
-            XBlock.WriteMetaVec4Block(file, 0x4265, material.incandescence)
-            XBlock.WriteMetaVec2Block(file, 0xC835, material.coeffs)
-            XBlock.WriteMetaVec2Block(file, 0xFE0C, material.glow)
-            XBlock.WriteMetaVec2Block(file, 0x7E24, material.refractive)
-            XBlock.WriteMetaVec4Block(file, 0x317C, material.color_specular)
-            XBlock.WriteMetaVec4Block(file, 0xE593, material.color_reflective)
-            XBlock.WriteMetaVec2Block(file, 0x7D76, material.reflective)
-            XBlock.WriteMetaVec2Block(file, 0x83C7, material.blinn)
-            XBlock.WriteMetaFloatBlock(file, 0x5CD2, material.phong)
-
-        XBinIO.__compress_internal__(file, real_file, close_files=True)
+        with BlockWriter(open(filepath, "wb"), level=compression_level,
+                         stats=stats, count_blocks=count_blocks) as file:
+            version = 7
+            if header_message != '':
+                XBlock.WriteCommentBlock(file, header_message)
+            XBlock.WriteModelBlock(file)
+            XBlock.WriteVersionBlock(file, version)
+
+            cosmetic_count = len([bone for bone in self.bones
+                                  if bone.cosmetic])
+
+            XBlock.WriteBoneCountBlock(file, len(model.bones))
+            if cosmetic_count > 0:
+                XBlock.WriteCosmeticInfoBlock(file, cosmetic_count)
+
+            for bone_index, bone in enumerate(model.bones):
+                XBlock.WriteBoneInfoBlock(file, bone_index, bone)
+
+            for bone_index, bone in enumerate(model.bones):
+                XBlock.WriteBoneIndexBlock(file, bone_index)
+                XBlock.WriteOffsetBlock(file, bone.offset)
+                XBlock.WriteMetaVec3Block(file, 0x1C56, bone.scale)
+                XBlock.WriteMatrixBlock(file, bone.matrix)
+
+            # Used to offset the vertex indices for each mesh
+            vert_offsets = [0]
+            for mesh in model.meshes:
+                prev_index = len(vert_offsets) - 1
+                vert_offsets.append(vert_offsets[prev_index] + len(mesh.verts))
+
+            vert_count = vert_offsets[len(vert_offsets) - 1]
+
+            vert32 = version == 7 and vert_count > 0xFFFF
+            if vert32:
+                XBlock.WriteVertex32Count(file, vert_count)
+            else:
+                XBlock.WriteVertex16Count(file, vert_count)
+
+            # Vertices & faces are packed in batches to keep the buffers small
+            for mesh_index, mesh in enumerate(model.meshes):
+                vert_offset = vert_offsets[mesh_index]
+                for start in range(0, len(mesh.verts), __WRITE_BATCH_SIZE__):
+                    verts = mesh.verts[start:start + __WRITE_BATCH_SIZE__]
+                    XBlock.WriteVertexBlocks(file, verts,
+                                             vert_offset + start, vert32)
+                    file.drain()
+
+            # Faces
+            face_count = sum([len(mesh.faces) for mesh in model.meshes])
+            XBlock.WriteMetaInt32Block(file, 0xBE92, face_count)
+            for mesh_index, mesh in enumerate(model.meshes):
+                vert_offset = vert_offsets[mesh_index]
+                for start in range(0, len(mesh.faces), __WRITE_BATCH_SIZE__):
+                    faces = mesh.faces[start:start + __WRITE_BATCH_SIZE__]
+                    XBlock.WriteFaceBlocks(file, faces, vert_offset, vert32)
+                    file.drain()
+
+            # Objects
+            XBlock.WriteMetaInt16Block(file, 0x62AF, len(model.meshes))
+            for mesh_index, mesh in enumerate(model.meshes):
+                XBlock.WriteMetaObjectInfo(file, 0x87D4, mesh_index, mesh.name)
+
+            # Materials
+            XBlock.WriteMetaInt16Block(file, 0xA1B2, len(model.materials))
+            for material_index, material in enumerate(model.materials):
+                XBlock.WriteMaterialInfoBlock(file, material_index,
+                                              material, extended_features)
+
+                XBlock.WriteColorBlock(file, material.color)
+                XBlock.WriteMetaVec4Block(file, 0x6DAB, material.transparency)
+                XBlock.WriteMetaVec4Block(file, 0x37FF, material.color_ambient)
+                XBlock.WriteMetaVec4Block(file, 0x4265, material.incandescence)
+                XBlock.WriteMetaVec2Block(file, 0xC835, material.coeffs)
+                XBlock.WriteMetaVec2Block(file, 0xFE0C, material.glow)
+                XBlock.WriteMetaVec2Block(file, 0x7E24, material.refractive)
+                XBlock.WriteMetaVec4Block(file, 0x317C,
+                                          material.color_specular)
+                XBlock.WriteMetaVec4Block(file, 0xE593,
+                                          material.color_reflective)
+                XBlock.WriteMetaVec2Block(file, 0x7D76, material.reflective)
+                XBlock.WriteMetaVec2Block(file, 0x83C7, material.blinn)
+                XBlock.WriteMetaFloatBlock(file, 0x5CD2, material.phong)
+
+        if stats is not None:
+            stats.lap('pack')
 
     def __xbin_writefile_anim_internal__(self, filepath, version=3,
-                                         header_message=""):
+                                         header_message="", stats=None,
+                                         compression_level=1,
+                                         count_blocks=True):
         anim = self
-        real_file = open(filepath, "wb")
-        file = BytesIO()
-        if header_message != '':
-            XBlock.WriteCommentBlock(file, header_message)
-        XBlock.WriteAnimBlock(file)
-        XBlock.WriteVersionBlock(file, 3)
-        XBlock.WritePartCount(file, len(anim.parts))
-
-        for part_index, part in enumerate(anim.parts):
-            XBlock.WritePartInfo(file, part_index, part.name)
-
-        XBlock.WriteFramerate(file, anim.framerate)
-        XBlock.WriteFrameCount(file, len(anim.frames))
-
-        for frame in anim.frames:
-            XBlock.WriteFrameIndex(file, frame.frame)
-            for part_index, part in enumerate(frame.parts):
-                XBlock.WritePartIndex(file, part_index)
-                XBlock.WriteOffsetBlock(file, part.offset)
-                XBlock.WriteMatrixBlock(file, part.matrix)
-
-        XBlock.WriteMetaInt16Block(file, 0x7A6C, len(anim.notes))
-        if len(anim.notes):
-            for note in anim.notes:
-                XBlock.WriteNoteFrame(file, note)
-
-        XBinIO.__compress_internal__(file, real_file, close_files=True)
+        with BlockWriter(open(filepath, "wb"), level=compression_level,
+                         stats=stats, count_blocks=count_blocks) as file:
+            if header_message != '':
+                XBlock.WriteCommentBlock(file, header_message)
+            XBlock.WriteAnimBlock(file)
+            XBlock.WriteVersionBlock(file, 3)
+            XBlock.WritePartCount(file, len(anim.parts))
+
+            for part_index, part in enumerate(anim.parts):
+                XBlock.WritePartInfo(file, part_index, part.name)
+
+            XBlock.WriteFramerate(file, anim.framerate)
+            XBlock.WriteFrameCount(file, len(anim.frames))
+
+            for frame in anim.frames:
+                XBlock.WriteFrameIndex(file, frame.frame)
+                for part_index, part in enumerate(frame.parts):
+                    XBlock.WritePartIndex(file, part_index)
+                    XBlock.WriteOffsetBlock(file, part.offset)
+                    XBlock.WriteMatrixBlock(file, part.matrix)
+                file.drain()
+
+            XBlock.WriteMetaInt16Block(file, 0x7A6C, len(anim.notes))
+            if len(anim.notes):
+                for note in anim.notes:
+                    XBlock.WriteNoteFrame(file, note)
+
+        if stats is not None:
+            stats.lap('pack')
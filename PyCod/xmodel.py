@@ -1,10 +1,15 @@
-from itertools import repeat
+from array import array
+from itertools import accumulate, chain, compress, cycle, islice, repeat
+from operator import add, mul, sub
 from time import strftime
 from math import sqrt
 
-import re
+import mmap
+import os
 
-from .xbin import XBinIO
+from .xbin import XBinIO, XBinStats, __compression_level__, \
+    __float_format__, __compact_floats__, __gc_paused__, \
+    __clamp_float_to_short__, __WRITE_BATCH_SIZE__
 
 
 def __clamp_float__(value, clamp=(-1.0, 1.0)):
@@ -27,15 +32,230 @@ def __clamp_normal__(value):
     return value
 
 
-def __normalized__(iterable):
-    dist = 1.0 / sqrt(sum([v * v for v in iterable]))
-    return [v * dist for v in iterable]
+def __write_batched__(file, records, compact_floats=False):
+    '''
+    Write an iterable of strings to file, joining them into batches of
+    __WRITE_BATCH_SIZE__ records first
+    If compact_floats is True, each batch is run through __compact_floats__
+    '''
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == __WRITE_BATCH_SIZE__:
+            text = ''.join(batch)
+            file.write(__compact_floats__(text) if compact_floats else text)
+            batch = []
+    text = ''.join(batch)
+    file.write(__compact_floats__(text) if compact_floats else text)
+
+
+def __vert_records__(mesh, vert_offset, vert_tok_suffix, precision=6):
+    '''
+    Yield the XMODEL_EXPORT text for each vertex in mesh
+    Each vertex is formatted with a single format string (one per weight
+    count) - the output is the same as Vertex.save()
+    '''
+    head = __float_format__("VERT%s %%d\nOFFSET %%f %%f %%f\nBONES %%d\n" %
+                            vert_tok_suffix, precision)
+    weight_fmt = __float_format__("BONE %d %f\n", precision)
+    formats = {}
+
+    buffer = mesh.buffer
+    if buffer is None:
+        for index, vert in enumerate(mesh.verts, vert_offset):
+            weights = vert.weights
+            count = len(weights)
+            fmt = formats.get(count)
+            if fmt is None:
+                fmt = formats[count] = head + weight_fmt * count + "\n"
+            yield fmt % ((index,) + tuple(vert.offset) + (count,) +
+                         tuple(chain.from_iterable(weights)))
+        return
+
+    # Meshes backed by a MeshBuffer are read straight from its arrays
+    positions = buffer.positions.tolist()
+    offsets = buffer.weight_offsets.tolist()
+    bones = buffer.weight_bones.tolist()
+    values = buffer.weight_values.tolist()
+    for vert in range(buffer.vert_count):
+        start = offsets[vert]
+        end = offsets[vert + 1]
+        count = end - start
+        fmt = formats.get(count)
+        if fmt is None:
+            fmt = formats[count] = head + weight_fmt * count + "\n"
+        args = [vert + vert_offset]
+        args.extend(positions[vert * 3:vert * 3 + 3])
+        args.append(count)
+        for i in range(start, end):
+            args.append(bones[i])
+            args.append(values[i])
+        yield fmt % tuple(args)
+
+
+def __face_records__(mesh, version, vert_offset, vert_tok_suffix,
+                     precision=6):
+    '''
+    Yield the XMODEL_EXPORT text for each face in mesh
+    Each face is formatted with a single format string - the output is the
+    same as Face.save()
+    '''
+    if version == 5:
+        corner_fmt = "VERT %d %f %f %f %f %f\n"
+    else:
+        corner_fmt = ("VERT%s %%d\nNORMAL %%f %%f %%f\n"
+                      "COLOR %%f %%f %%f %%f\nUV 1 %%f %%f\n\n" %
+                      vert_tok_suffix)
+    corner_fmt = __float_format__(corner_fmt, precision)
+    tri_fmt = "TRI %d %d 0 0\n" + corner_fmt * 3 + "\n"
+    # Used for blocks which go over the byte limit
+    tri16_fmt = "TRI16 %d %d 0 0\n" + corner_fmt * 3 + "\n"
+
+    buffer = mesh.buffer
+    if buffer is None:
+        faces = mesh.faces
+        mesh_ids = [face.mesh_id for face in faces]
+        material_ids = [face.material_id for face in faces]
+        corners = ((ind.vertex, ind.normal, ind.color, ind.uv)
+                   for face in faces for ind in face.indices)
+    else:
+        # Meshes backed by a MeshBuffer are read straight from its arrays
+        normals = buffer.normals.tolist()
+        if buffer.normals.typecode == 'h':
+            normals = [v / 32767.0 for v in normals]
+        colors = buffer.colors.tolist()
+        if buffer.colors.typecode == 'B':
+            colors = [v / 255.0 for v in colors]
+        normals = iter(normals)
+        colors = iter(colors)
+        uvs = iter(buffer.uvs.tolist())
+        mesh_ids = buffer.face_mesh_ids.tolist()
+        material_ids = buffer.face_material_ids.tolist()
+        corners = zip(buffer.face_indices.tolist(),
+                      zip(normals, normals, normals),
+                      zip(colors, colors, colors, colors),
+                      zip(uvs, uvs))
+
+    for mesh_id, material_id, a, b, c in zip(mesh_ids, material_ids,
+                                             corners, corners, corners):
+        if mesh_id > 255 or material_id > 255:
+            fmt = tri16_fmt
+        else:
+            fmt = tri_fmt
+        args = [mesh_id, material_id]
+        for vertex, normal, color, uv in (a, b, c):
+            args.append(vertex + vert_offset)
+            # Almost every normal is already valid, so they're only clamped
+            #  when they need to be
+            x, y, z = normal
+            if (-1.0 <= x <= 1.0 and -1.0 <= y <= 1.0 and -1.0 <= z <= 1.0
+                    and (x or y or z)):
+                args.extend(normal)
+            else:
+                args.extend(__clamp_normal__(normal))
+            if version != 5:
+                args.extend(color)
+            args.extend(uv)
+        yield fmt % tuple(args)
+
+
+def __split_lines__(data, offset=0):
+    '''
+    Yield the split tokens of each non-empty line in data (bytes / mmap)
+    starting at offset, along with the offset of the following line
+    '''
+    size = len(data)
+    while offset < size:
+        end = data.find(b'\n', offset)
+        if end == -1:
+            end = size
+        line_split = data[offset:end].decode('utf-8', 'replace').split()
+        offset = end + 1
+        if line_split:
+            yield line_split, offset
+
+
+def __tokenize__(data):
+    '''
+    Split the contents of an *_EXPORT file into whitespace separated tokens
+    Comment lines (starting with //) are dropped & trailing commas are
+    stripped from every token
+    '''
+    comment = data.find('//')
+    if comment != -1:
+        # Comments are rare (usually just the export info at the top of the
+        #  file) so they're found with find() rather than a regex over the
+        #  whole file
+        parts = []
+        start = 0
+        while comment != -1:
+            line_start = data.rfind('\n', 0, comment) + 1
+            line_end = data.find('\n', comment)
+            if line_end == -1:
+                line_end = len(data)
+            if not data[line_start:comment].strip():
+                parts.append(data[start:line_start])
+                start = line_end
+            comment = data.find('//', line_end)
+        parts.append(data[start:])
+        data = ''.join(parts)
+    tokens = data.split()
+    if ',' in data:
+        tokens = [token.rstrip(',') for token in tokens]
+    return tokens
+
+
+def __find_token__(tokens, keyword, pos):
+    '''
+    Get the position of the next keyword token, or len(tokens) if there isn't
+    one
+    '''
+    try:
+        return tokens.index(keyword, pos)
+    except ValueError:
+        return len(tokens)
+
+
+def __load_string__(tokens, pos):
+    '''
+    Read the (quoted) string at tokens[pos]
+    Returns the string and the position of the token following it
+    For strings that contain whitespace, only the first word is returned
+     (as it always has been) and the rest of the string is skipped
+    '''
+    token = tokens[pos]
+    pos += 1
+    if token[:1] == '"' and (len(token) == 1 or token[-1] != '"'):
+        end = len(tokens)
+        while pos < end and tokens[pos][-1:] != '"':
+            pos += 1
+        pos += 1
+    return token.strip('"'), pos
+
+
+# Maps each material property keyword to the attribute it sets, and the type
+#  of each of its values (or a single type for a single value)
+__MATERIAL_PROPERTIES__ = {
+    'COLOR': ('color', (float, float, float, float)),
+    'TRANSPARENCY': ('transparency', (float, float, float, float)),
+    'AMBIENTCOLOR': ('color_ambient', (float, float, float, float)),
+    'INCANDESCENCE': ('incandescence', (float, float, float, float)),
+    'COEFFS': ('coeffs', (float, float)),
+    'GLOW': ('glow', (float, int)),
+    'REFRACTIVE': ('refractive', (int, float)),
+    'SPECULARCOLOR': ('color_specular', (float, float, float, float)),
+    'REFLECTIVECOLOR': ('color_reflective', (float, float, float, float)),
+    'REFLECTIVE': ('reflective', (int, float)),
+    'BLINN': ('blinn', (float, float)),
+    'PHONG': ('phong', float),
+}
 
 
 def deserialize_image_string(ref_string):
     if not ref_string:
         return {"color": "$none.tga"}
 
+    import re
     out = {}
     for key, value in re.findall(r'\s*(\S+?)\s*:\s*(\S+)\s*', ref_string):
         out[key.lower()] = value.lstrip()
@@ -88,50 +308,50 @@ class Vertex(object):
         else:
             self.weights = weights
 
-    def __load_vert__(self, file, vert_count, mesh, vert_tok='VERT'):
-        lines_read = 0
+    def __load_vert__(self, tokens, pos, vert_count, vert_tok='VERT'):
+        '''
+        Load the vertex starting at tokens[pos] one keyword at a time
+        Returns the position of the token following it
+        '''
         state = 0
 
-        vert_index = -1
-
         bone_count = 0  # The number of bones influencing this vertex
         bones_read = 0  # The number of bone weights we've read for this vert
 
-        for line in file:
-            lines_read += 1
-
-            line_split = line.split()
-            if not line_split:
-                continue
-
-            for i, split in enumerate(line_split):
-                if split[-1:] == ',':
-                    line_split[i] = split.rstrip(",")
-
-            if state == 0 and line_split[0] == vert_tok:
-                vert_index = int(line_split[1])
+        end = len(tokens)
+        while pos < end:
+            token = tokens[pos]
+            if state == 0 and token == vert_tok:
+                vert_index = int(tokens[pos + 1])
                 if vert_index >= vert_count:
                     fmt = ("vert_count does not index vert_index -- "
                            "%d not in [0, %d)")
                     raise ValueError(fmt % (vert_index, vert_count))
                 state = 1
-            elif state == 1 and line_split[0] == "OFFSET":
-                self.offset = tuple([float(v) for v in line_split[1:4]])
+                pos += 2
+            elif state == 1 and token == "OFFSET":
+                self.offset = tuple([float(v) for v in tokens[pos + 1:pos + 4]])
                 state = 2
-            elif state == 2 and line_split[0] == "BONES":
-                bone_count = int(line_split[1])
+                pos += 4
+            elif state == 2 and token == "BONES":
+                bone_count = int(tokens[pos + 1])
                 self.weights = [None] * bone_count
+                pos += 2
+                if bone_count == 0:
+                    return pos
                 state = 3
-            elif state == 3 and line_split[0] == "BONE":
-                bone = int(line_split[1])
-                influence = float(line_split[2])
+            elif state == 3 and token == "BONE":
+                bone = int(tokens[pos + 1])
+                influence = float(tokens[pos + 2])
                 self.weights[bones_read] = ((bone, influence))
                 bones_read += 1
+                pos += 3
                 if bones_read == bone_count:
-                    state = -1
-                    return lines_read
+                    return pos
+            else:
+                pos += 1
 
-        return lines_read
+        return pos
 
     def save(self, file, index, vert_tok_suffix=""):
         file.write("VERT%s %d\n" % (vert_tok_suffix, index))
@@ -142,6 +362,29 @@ class Vertex(object):
         file.write("\n")
 
 
+def __vert_weights_end__(tokens, pos, vert_count, vert_tok):
+    '''
+    Check whether the vertex at tokens[pos] is laid out as
+     VERT i OFFSET x y z BONES n (BONE b w) * n
+    Returns the position of the token following it, or None if it isn't
+    '''
+    if (tokens[pos:pos + 1] != [vert_tok] or
+            tokens[pos + 2:pos + 3] != ['OFFSET'] or
+            tokens[pos + 6:pos + 7] != ['BONES']):
+        return None
+    weight_count = int(tokens[pos + 7])
+    weights_end = pos + 8 + weight_count * 3
+    if (not weight_count or
+            tokens[pos + 8:weights_end:3] != ['BONE'] * weight_count):
+        return None
+    vert_index = int(tokens[pos + 1])
+    if vert_index >= vert_count:
+        fmt = ("vert_count does not index vert_index -- "
+               "%d not in [0, %d)")
+        raise ValueError(fmt % (vert_index, vert_count))
+    return weights_end
+
+
 class FaceVertex(object):
     __slots__ = ("vertex", "normal", "color", "uv")
 
@@ -172,67 +415,68 @@ class Face(object):
         self.material_id = material_id
         self.indices = [None] * 3
 
-    def __load_face__(self, file, version, face_count, vert_tok='VERT'):
-        lines_read = 0
+    def __load_face__(self, tokens, pos, version, vert_tok='VERT'):
+        '''
+        Load the face starting at tokens[pos] one keyword at a time
+        Returns the position of the token following it
+        '''
         state = 0
-
-        tri_number = -1
         vert_number = -1
 
-        for line in file:
-            lines_read += 1
-
-            line_split = line.split()
-            if not line_split:
-                continue
-
-            for i, split in enumerate(line_split):
-                if split[-1:] == ',':
-                    line_split[i] = split.rstrip(",")
-
+        end = len(tokens)
+        while pos < end:
+            token = tokens[pos]
             # Support blocks of byte, or ushort (TRI / TRI16)
-            if state == 0 and line_split[0].startswith("TRI"):
-                tri_number += 1
-                self.mesh_id = int(line_split[1])
-                self.material_id = int(line_split[2])
+            if state == 0 and token.startswith("TRI"):
+                self.mesh_id = int(tokens[pos + 1])
+                self.material_id = int(tokens[pos + 2])
                 state = 1
-            elif state == 1 and line_split[0] == vert_tok:
+                pos += 3
+            elif state == 1 and token == vert_tok:
                 vert = FaceVertex()
-                vert.vertex = int(line_split[1])
+                vert.vertex = int(tokens[pos + 1])
                 vert_number += 1
 
                 if version == 5:
-                    vert.normal = tuple([float(v) for v in line_split[2:5]])
-                    vert.uv = (float(line_split[5]), float(line_split[6]))
+                    vert.normal = tuple([float(v)
+                                         for v in tokens[pos + 2:pos + 5]])
+                    vert.uv = (float(tokens[pos + 5]), float(tokens[pos + 6]))
                     self.indices[vert_number] = vert
+                    pos += 7
                     if vert_number == 2:
-                        return lines_read
+                        return pos
 
                 # for Version 6, continue loading the vertex properties for the
                 # last vertex
                 else:
                     state = 2
+                    pos += 2
 
-            elif state == 2 and line_split[0] == "NORMAL":
-                vert.normal = (float(line_split[1]),
-                               float(line_split[2]),
-                               float(line_split[3]))
+            elif state == 2 and token == "NORMAL":
+                vert.normal = (float(tokens[pos + 1]),
+                               float(tokens[pos + 2]),
+                               float(tokens[pos + 3]))
                 state = 3
-            elif state == 3 and line_split[0] == "COLOR":
-                vert.color = (float(line_split[1]),
-                              float(line_split[2]),
-                              float(line_split[3]),
-                              float(line_split[4]))
+                pos += 4
+            elif state == 3 and token == "COLOR":
+                vert.color = (float(tokens[pos + 1]),
+                              float(tokens[pos + 2]),
+                              float(tokens[pos + 3]),
+                              float(tokens[pos + 4]))
                 state = 4
-            elif state == 4 and line_split[0] == "UV":
-                vert.uv = (float(line_split[2]), float(line_split[3]))
+                pos += 5
+            elif state == 4 and token == "UV":
+                vert.uv = (float(tokens[pos + 2]), float(tokens[pos + 3]))
                 self.indices[vert_number] = vert
+                pos += 4
                 if vert_number == 2:
-                    return lines_read
+                    return pos
                 else:
                     state = 1
+            else:
+                pos += 1
 
-        return lines_read
+        return pos
 
     def save(self, file, version, index_offset, vert_tok_suffix=""):
         # Check for blocks which go over the byte limit
@@ -246,6 +490,142 @@ class Face(object):
         file.write("\n")
 
 
+def __face_section_layout__(tokens, pos, face_count, version, vert_tok):
+    '''
+    Check whether every face in the section starting at tokens[pos] is laid
+    out the same way
+     TRI m t a b, then 3 * (VERT i NORMAL x y z COLOR r g b a UV 1 u v)
+     or 3 * (VERT i x y z u v) for version 5
+    so that its numbers can be picked out by their position in each face
+    Returns (corner size, face size, the position of the following token)
+     or None
+    '''
+    if version == 5:
+        corner_size = 7
+    else:
+        corner_size = 15
+    stride = 5 + corner_size * 3
+    end = pos + stride * face_count
+    if face_count <= 0 or end > len(tokens):
+        return None
+
+    for tri in set(tokens[pos:end:stride]):
+        if not tri.startswith('TRI'):
+            return None
+    if version == 5:
+        markers = ((0, vert_tok),)
+    else:
+        markers = ((0, vert_tok), (2, 'NORMAL'), (6, 'COLOR'), (11, 'UV'))
+    expected = {}
+    for corner in range(3):
+        for offset, marker in markers:
+            start = pos + 5 + corner * corner_size + offset
+            if tokens[start:end:stride] != \
+                    expected.setdefault(marker, [marker] * face_count):
+                return None
+    return corner_size, stride, end
+
+
+def __face_section_numbers__(tokens, pos, version, layout):
+    '''
+    Convert every number in a face section with the given layout (See
+    __face_section_layout__) in one go
+    Returns a list of the ints (mesh id, material id & 3 vertex ids per face)
+    & a list of the floats (normal, color & uv per corner - there are no
+    colors in version 5 files) in the order they appear in the file
+    '''
+    corner_size, stride, end = layout
+    if version == 5:
+        float_offsets = (2, 3, 4, 5, 6)
+    else:
+        float_offsets = (3, 4, 5, 7, 8, 9, 10, 13, 14)
+
+    # The numbers are picked out of the section with a mask for each face,
+    #  so that the tokens are read in order rather than column by column
+    int_mask = [False] * stride
+    float_mask = [False] * stride
+    int_mask[1] = int_mask[2] = True
+    for corner in range(3):
+        start = 5 + corner * corner_size
+        int_mask[start + 1] = True
+        for offset in float_offsets:
+            float_mask[start + offset] = True
+
+    section = tokens[pos:end]
+    ints = list(map(int, compress(section, cycle(int_mask))))
+    floats = list(map(float, compress(section, cycle(float_mask))))
+    return ints, floats
+
+
+def __load_face_section__(tokens, pos, face_count, version, layout):
+    '''
+    Load a face section with the given layout (See __face_section_layout__)
+    as a list of Face objects
+    '''
+    ints, floats = __face_section_numbers__(tokens, pos, version, layout)
+    corner_floats = 5 if version == 5 else 9
+    face_floats = corner_floats * 3
+
+    def vectors(offset, size):
+        return zip(*[floats[offset + i::face_floats] for i in range(size)])
+
+    faces = list(map(Face, ints[0::5], ints[1::5]))
+    corners = []
+    for corner in range(3):
+        start = corner * corner_floats
+        vertex_ids = ints[2 + corner::5]
+        if version == 5:
+            corners.append(map(FaceVertex, vertex_ids, vectors(start, 3),
+                               repeat(None), vectors(start + 3, 2)))
+        else:
+            corners.append(map(FaceVertex, vertex_ids, vectors(start, 3),
+                               vectors(start + 3, 4), vectors(start + 7, 2)))
+    for face, a, b, c in zip(faces, *corners):
+        face.indices = [a, b, c]
+    return faces
+
+
+def __load_face_section_buffer__(buffer, tokens, pos, face_count, version,
+                                 layout):
+    '''
+    Load a face section with the given layout (See __face_section_layout__)
+    into a MeshBuffer
+    The numbers are converted into typed arrays all at once, and then
+    (de)interleaved into the buffer's arrays with strided slices
+    '''
+    ints, floats = __face_section_numbers__(tokens, pos, version, layout)
+    ints = array('I', ints)
+    floats = array('f', floats)
+    corner_floats = 5 if version == 5 else 9
+    face_floats = corner_floats * 3
+
+    buffer.face_mesh_ids.extend(array('H', ints[0::5]))
+    buffer.face_material_ids.extend(array('H', ints[1::5]))
+
+    corner_count = face_count * 3
+    indices = array('I', [0]) * corner_count
+    normals = array('f', [0]) * (corner_count * 3)
+    # Version 5 files have no colors, so they're left white
+    colors = array('f', [1]) * (corner_count * 4)
+    uvs = array('f', [0]) * (corner_count * 2)
+    uv_start = 3 if version == 5 else 7
+    for corner in range(3):
+        start = corner * corner_floats
+        indices[corner::3] = ints[2 + corner::5]
+        for i in range(3):
+            normals[corner * 3 + i::9] = floats[start + i::face_floats]
+        if version != 5:
+            for i in range(4):
+                colors[corner * 4 + i::12] = \
+                    floats[start + 3 + i::face_floats]
+        for i in range(2):
+            uvs[corner * 2 + i::6] = floats[start + uv_start + i::face_floats]
+    buffer.face_indices.extend(indices)
+    buffer.normals.extend(normals)
+    buffer.colors.extend(colors)
+    buffer.uvs.extend(uvs)
+
+
 class Material(object):
     __slots__ = (
         'name', 'type', 'images', 'color',
@@ -273,7 +653,8 @@ class Material(object):
         self.blinn = (-1.0, -1.0)
         self.phong = -1.0
 
-    def save(self, file, version, material_index, extended_features=True):
+    def save(self, file, version, material_index, extended_features=True,
+             precision=6, compact_floats=False):
         imgs = serialize_image_string(
             self.images, extended_features=extended_features)
         if version == 5:
@@ -281,101 +662,1040 @@ class Material(object):
         else:
             file.write('MATERIAL %d "%s" "%s" "%s"\n' %
                        (material_index, self.name, self.type, imgs))
-            file.write("COLOR %f %f %f %f\n" % self.color)
-            file.write("TRANSPARENCY %f %f %f %f\n" % self.transparency)
-            file.write("AMBIENTCOLOR %f %f %f %f\n" % self.color_ambient)
-            file.write("INCANDESCENCE %f %f %f %f\n" % self.incandescence)
-            file.write("COEFFS %f %f\n" % self.coeffs)
-            file.write("GLOW %f %d\n" % self.glow)
-            file.write("REFRACTIVE %d %f\n" % self.refractive)
-            file.write("SPECULARCOLOR %f %f %f %f\n" % self.color_specular)
-            file.write("REFLECTIVECOLOR %f %f %f %f\n" % self.color_reflective)
-            file.write("REFLECTIVE %d %f\n" % self.reflective)
-            file.write("BLINN %f %f\n" % self.blinn)
-            file.write("PHONG %f\n\n" % self.phong)
+            properties = (
+                ("COLOR %f %f %f %f\n", self.color),
+                ("TRANSPARENCY %f %f %f %f\n", self.transparency),
+                ("AMBIENTCOLOR %f %f %f %f\n", self.color_ambient),
+                ("INCANDESCENCE %f %f %f %f\n", self.incandescence),
+                ("COEFFS %f %f\n", self.coeffs),
+                ("GLOW %f %d\n", self.glow),
+                ("REFRACTIVE %d %f\n", self.refractive),
+                ("SPECULARCOLOR %f %f %f %f\n", self.color_specular),
+                ("REFLECTIVECOLOR %f %f %f %f\n", self.color_reflective),
+                ("REFLECTIVE %d %f\n", self.reflective),
+                ("BLINN %f %f\n", self.blinn),
+                ("PHONG %f\n\n", self.phong))
+            text = ''.join([__float_format__(fmt, precision) % value
+                            for fmt, value in properties])
+            if compact_floats:
+                text = __compact_floats__(text)
+            file.write(text)
+
+
+def __segments__(items, counts):
+    '''
+    Split items into consecutive lists of the given lengths
+    '''
+    items = iter(items)
+    return [list(islice(items, count)) for count in counts]
+
+
+def __cull_weights__(counts, bones, values, keep):
+    '''
+    Remove the weights whose entry in keep is False, except for the largest
+    weight of any vertex that would be left without weights
+    Returns the new (counts, bones, values)
+    '''
+    new_counts = list(map(sum, __segments__(keep, counts)))
+    empty = [vert for vert, count in enumerate(new_counts)
+             if not count and counts[vert]]
+    if empty:
+        starts = [0] + list(accumulate(counts))
+        for vert in empty:
+            start = starts[vert]
+            weights = values[start:start + counts[vert]]
+            keep[start + weights.index(max(weights))] = True
+            new_counts[vert] = 1
+    return (new_counts, list(compress(bones, keep)),
+            list(compress(values, keep)))
+
+
+def __process_weights__(counts, bones, values, mode='sum', max_influences=0,
+                        min_weight=0.0, quantize=0):
+    '''
+    Process the bone weights of a set of vertices, given as the number of
+    weights of each vertex (CSR) and the flat lists of bones & values
+    See Model.normalize_weights for the options
+    Returns the new (counts, bones, values) lists
+    '''
+    if min_weight > 0.0:
+        counts, bones, values = __cull_weights__(
+            counts, bones, values, [v >= min_weight for v in values])
+
+    # Only the vertices with too many weights need sorting
+    if max_influences > 0 and max(counts, default=0) > max_influences:
+        bone_segments = __segments__(bones, counts)
+        value_segments = __segments__(values, counts)
+        for vert, count in enumerate(counts):
+            if count <= max_influences:
+                continue
+            weights = value_segments[vert]
+            # Keep the largest weights, in their original order
+            kept = sorted(sorted(range(count), key=weights.__getitem__,
+                                 reverse=True)[:max_influences])
+            bone_segments[vert] = [bone_segments[vert][i] for i in kept]
+            value_segments[vert] = [weights[i] for i in kept]
+            counts[vert] = max_influences
+        bones = list(chain.from_iterable(bone_segments))
+        values = list(chain.from_iterable(value_segments))
+
+    if mode is not None:
+        if mode == 'sum':
+            totals = map(sum, __segments__(values, counts))
+        elif mode == 'l2':
+            totals = map(sqrt, map(sum, __segments__(
+                [v * v for v in values], counts)))
+        else:
+            raise ValueError("unknown weight normalization mode '%s'" % mode)
+        # Vertices whose weights are all 0 are left as they are
+        scales = [1.0 / total if total else 1.0 for total in totals]
+        values = list(map(mul, values,
+                          chain.from_iterable(map(repeat, scales, counts))))
+
+    if quantize > 0:
+        steps = [int(round(v * quantize)) for v in values]
+        if mode == 'sum':
+            # Give the rounding error of each vertex to its largest weight,
+            #  so its weights still add up to exactly 1
+            segments = __segments__(steps, counts)
+            start = 0
+            for count, segment in zip(counts, segments):
+                error = quantize - sum(segment)
+                if error and count and segment != [0] * count:
+                    largest = start + segment.index(max(segment))
+                    steps[largest] += error
+                start += count
+        values = [step / float(quantize) for step in steps]
+        # Weights that were rounded down to 0 are removed
+        counts, bones, values = __cull_weights__(
+            counts, bones, values, [step != 0 for step in steps])
+
+    return counts, bones, values
+
+
+class MeshBuffer(object):
+    '''
+    Columnar storage for the vertex and face data of a mesh
+
+    Every attribute is a flat typed array (See the array module) so that
+    they can be handed to other libraries without copying
+     ie. numpy.frombuffer(buffer.positions, numpy.float32).reshape(-1, 3)
+
+    Vertex data:
+        positions           float32 x, y, z per vertex
+        weight_offsets      uint32, vert_count + 1 entries - the weights
+                             for vertex i are [weight_offsets[i],
+                             weight_offsets[i + 1]) (CSR)
+        weight_bones        uint16 bone index per weight
+        weight_values       float32 influence per weight
+
+    Face data:
+        face_indices        uint32 vertex index per corner (3 per face)
+        face_mesh_ids       uint16 per face
+        face_material_ids   uint16 per face
+
+    Face vertex (corner) data:
+        normals             3 per corner - int16 (scaled by 1 / 32767) when
+                             loaded from an XMODEL_BIN, otherwise float32
+        colors              4 per corner - uint8 (scaled by 1 / 255) when
+                             loaded from an XMODEL_BIN, otherwise float32
+        uvs                 float32 u, v per corner
+    '''
+    __slots__ = ('positions', 'weight_offsets', 'weight_bones',
+                 'weight_values', 'face_indices', 'face_mesh_ids',
+                 'face_material_ids', 'normals', 'colors', 'uvs')
+
+    def __init__(self, normal_type='f', color_type='f'):
+        self.positions = array('f')
+        self.weight_offsets = array('I', [0])
+        self.weight_bones = array('H')
+        self.weight_values = array('f')
+
+        self.face_indices = array('I')
+        self.face_mesh_ids = array('H')
+        self.face_material_ids = array('H')
+
+        self.normals = array(normal_type)
+        self.colors = array(color_type)
+        self.uvs = array('f')
+
+    @property
+    def vert_count(self):
+        return len(self.weight_offsets) - 1
+
+    @property
+    def face_count(self):
+        return len(self.face_mesh_ids)
+
+    def offset(self, index):
+        i = index * 3
+        return tuple(self.positions[i:i + 3])
+
+    def weights(self, index):
+        start = self.weight_offsets[index]
+        end = self.weight_offsets[index + 1]
+        return list(zip(self.weight_bones[start:end],
+                        self.weight_values[start:end]))
+
+    def normal(self, corner):
+        i = corner * 3
+        x, y, z = self.normals[i:i + 3]
+        if self.normals.typecode == 'h':
+            return (x / 32767.0, y / 32767.0, z / 32767.0)
+        return (x, y, z)
+
+    def color(self, corner):
+        i = corner * 4
+        r, g, b, a = self.colors[i:i + 4]
+        if self.colors.typecode == 'B':
+            return (r / 255.0, g / 255.0, b / 255.0, a / 255.0)
+        return (r, g, b, a)
+
+    def uv(self, corner):
+        i = corner * 2
+        return tuple(self.uvs[i:i + 2])
+
+    def set_offset(self, index, offset):
+        i = index * 3
+        x, y, z = offset
+        self.positions[i:i + 3] = array('f', (x, y, z))
+
+    def set_weights(self, index, weights):
+        '''
+        Replace the weights of the given vertex, moving the weights of the
+        vertices after it if the number of weights changes
+        '''
+        offsets = self.weight_offsets
+        start = offsets[index]
+        end = offsets[index + 1]
+        self.weight_bones[start:end] = array('H', [w[0] for w in weights])
+        self.weight_values[start:end] = array('f', [w[1] for w in weights])
+        shift = len(weights) - (end - start)
+        if shift:
+            offsets[index + 1:] = array('I', [offset + shift for offset in
+                                              offsets[index + 1:]])
+
+    def set_normal(self, corner, normal):
+        i = corner * 3
+        x, y, z = normal
+        # Quantized (truncated) the same way as by the xbin writer
+        if self.normals.typecode == 'h':
+            x, y, z = [__clamp_float_to_short__(v) for v in (x, y, z)]
+        self.normals[i:i + 3] = array(self.normals.typecode, (x, y, z))
+
+    def set_color(self, corner, color):
+        i = corner * 4
+        # Buffers store white for faces without colors (ie. version 5)
+        r, g, b, a = color or (1.0, 1.0, 1.0, 1.0)
+        if self.colors.typecode == 'B':
+            r, g, b, a = [max(0, min(255, int(v * 255)))
+                          for v in (r, g, b, a)]
+        self.colors[i:i + 4] = array(self.colors.typecode, (r, g, b, a))
+
+    def set_uv(self, corner, uv):
+        i = corner * 2
+        u, v = uv
+        self.uvs[i:i + 2] = array('f', (u, v))
+
+    def vertex(self, index):
+        '''
+        Build a (detached) Vertex object for the given vertex
+        '''
+        return Vertex(self.offset(index), self.weights(index))
+
+    def face(self, index):
+        '''
+        Build a (detached) Face object for the given face
+        '''
+        face = Face(self.face_mesh_ids[index], self.face_material_ids[index])
+        corner = index * 3
+        for i in range(3):
+            face.indices[i] = FaceVertex(self.face_indices[corner + i],
+                                         self.normal(corner + i),
+                                         self.color(corner + i),
+                                         self.uv(corner + i))
+        return face
 
+    def split(self, mesh_count):
+        '''
+        Split the buffer into a separate buffer for each mesh id, only
+        keeping the vertices that are used by that mesh's faces
+        Returns a list of (buffer, vertex_ids) for each mesh where
+        vertex_ids maps the new vertex indices back to the source indices
+        '''
+        # Partition the faces by their mesh id
+        mesh_faces = [array('I') for i in range(mesh_count)]
+        for face_index, mesh_id in enumerate(self.face_mesh_ids):
+            mesh_faces[mesh_id].append(face_index)
+
+        # remap[vert] holds the new index of vert for the mesh whose id is
+        #  stored in remap_owner[vert], so it never has to be cleared
+        vert_count = self.vert_count
+        remap = array('I', [0]) * vert_count
+        remap_owner = array('i', [-1]) * vert_count
+
+        results = []
+        for mesh_id, faces in enumerate(mesh_faces):
+            buffer = MeshBuffer(self.normals.typecode, self.colors.typecode)
+            vertex_ids = array('I')
+            indices = buffer.face_indices
+            for face_index in faces:
+                corner = face_index * 3
+                for vert in self.face_indices[corner:corner + 3]:
+                    if remap_owner[vert] != mesh_id:
+                        remap_owner[vert] = mesh_id
+                        remap[vert] = len(vertex_ids)
+                        vertex_ids.append(vert)
+                    indices.append(remap[vert])
+            buffer.__copy_faces__(self, faces)
+            buffer.__copy_verts__(self, vertex_ids)
+            results.append((buffer, vertex_ids))
+        return results
+
+    def __copy_faces__(self, source, faces):
+        for face_index in faces:
+            self.face_mesh_ids.append(source.face_mesh_ids[face_index])
+            self.face_material_ids.append(
+                source.face_material_ids[face_index])
+            corner = face_index * 3
+            self.normals.extend(source.normals[corner * 3:corner * 3 + 9])
+            self.colors.extend(source.colors[corner * 4:corner * 4 + 12])
+            self.uvs.extend(source.uvs[corner * 2:corner * 2 + 6])
+
+    def __copy_verts__(self, source, vertex_ids):
+        offsets = self.weight_offsets
+        for vert in vertex_ids:
+            self.positions.extend(source.positions[vert * 3:vert * 3 + 3])
+            start = source.weight_offsets[vert]
+            end = source.weight_offsets[vert + 1]
+            self.weight_bones.extend(source.weight_bones[start:end])
+            self.weight_values.extend(source.weight_values[start:end])
+            offsets.append(offsets[-1] + end - start)
+
+    def groups(self, bone_count, material_count):
+        '''
+        Build the bone & material groups for the buffer - See Mesh
+        '''
+        bone_groups = [[] for i in range(bone_count)]
+        material_groups = [[] for i in range(material_count)]
+
+        offsets = self.weight_offsets
+        bones = self.weight_bones
+        values = self.weight_values
+        for vert in range(self.vert_count):
+            for i in range(offsets[vert], offsets[vert + 1]):
+                bone_groups[bones[i]].append((vert, values[i]))
+
+        indices = self.face_indices
+        for face_index, mtl_id in enumerate(self.face_material_ids):
+            corner = face_index * 3
+            material_groups[mtl_id].extend(indices[corner:corner + 3])
+
+        # Remove duplicates (keeping the first occurrence of each)
+        bone_groups = [list(dict.fromkeys(group)) for group in bone_groups]
+        material_groups = [list(dict.fromkeys(group))
+                           for group in material_groups]
+        return bone_groups, material_groups
+
+
+class IndexedBuffer(object):
+    '''
+    Welded & indexed vertex data for a mesh, as built by
+    Model.to_indexed_buffers() - ready to be uploaded as vertex / index
+    buffers
+
+        vertices        float32, VERTEX_STRIDE values per vertex:
+                         x, y, z, nx, ny, nz, u, v, r, g, b, a
+        vertex_ids      uint32 index of the source vertex in mesh.verts for
+                         each vertex (ie. for looking up its weights)
+        indices         {material id: index array, 3 per face} - uint16
+                         if there are at most 0x10000 vertices, else uint32
+    '''
+    __slots__ = ('vertices', 'vertex_ids', 'indices')
+
+    VERTEX_STRIDE = 12
+
+    def __init__(self):
+        self.vertices = array('f')
+        self.vertex_ids = array('I')
+        self.indices = {}
+
+    @property
+    def vert_count(self):
+        return len(self.vertex_ids)
+
+
+def __index_mesh__(mesh):
+    '''
+    Weld the face corners of mesh that share the same vertex, normal, uv &
+    color into an IndexedBuffer
+    '''
+    buffer = mesh.buffer
+    if buffer is None:
+        faces = mesh.faces
+        material_ids = [face.material_id for face in faces]
+        corners = [(ind.vertex, tuple(ind.normal), tuple(ind.uv),
+                    None if ind.color is None else tuple(ind.color))
+                   for face in faces for ind in face.indices]
+        offsets = [vert.offset for vert in mesh.verts]
+        normal_scale = color_scale = None
+    else:
+        # The corners are hashed using the buffer's own (possibly packed)
+        #  values, and only the welded vertices are converted
+        material_ids = buffer.face_material_ids
+        normals = iter(buffer.normals.tolist())
+        uvs = iter(buffer.uvs.tolist())
+        colors = iter(buffer.colors.tolist())
+        corners = zip(buffer.face_indices.tolist(),
+                      zip(normals, normals, normals), zip(uvs, uvs),
+                      zip(colors, colors, colors, colors))
+        positions = iter(buffer.positions.tolist())
+        offsets = list(zip(positions, positions, positions))
+        # Packed normals & colors are scaled the same way as MeshBuffer does
+        normal_scale = 32767.0 if buffer.normals.typecode == 'h' else None
+        color_scale = 255.0 if buffer.colors.typecode == 'B' else None
+
+    # Each new corner gets the next index, in the order they're first used
+    welded = {}
+    corner_ids = [welded.setdefault(corner, len(welded))
+                  for corner in corners]
+
+    result = IndexedBuffer()
+    vertices = []
+    for vertex, normal, uv, color in welded:
+        vertices.extend(offsets[vertex])
+        if normal_scale is None:
+            vertices.extend(normal)
+        else:
+            vertices.extend([v / normal_scale for v in normal])
+        vertices.extend(uv)
+        if color is None:
+            # Faces loaded from version 5 files have no colors
+            vertices.extend((1.0, 1.0, 1.0, 1.0))
+        elif color_scale is None:
+            vertices.extend(color)
+        else:
+            vertices.extend([v / color_scale for v in color])
+    result.vertices = array('f', vertices)
+    result.vertex_ids = array('I', [corner[0] for corner in welded])
+
+    typecode = 'H' if len(welded) <= 0x10000 else 'I'
+    material_corners = {}
+    for face_index, material_id in enumerate(material_ids):
+        corner = face_index * 3
+        group = material_corners.get(material_id)
+        if group is None:
+            group = material_corners[material_id] = []
+        group.extend(corner_ids[corner:corner + 3])
+    result.indices = dict([(material_id, array(typecode, group))
+                           for material_id, group in
+                           material_corners.items()])
+    return result
+
+
+class VertexView(object):
+    '''
+    A Vertex whose offset & weights are read from & written to a MeshBuffer
+    Changing the list returned by weights doesn't change the buffer -
+     assign a new list to weights instead
+    The views only have the attributes & methods of the objects they stand
+    in for (they aren't subclasses), so they don't carry unused slots
+    '''
+    __slots__ = ('buffer', 'index')
+
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        self.index = index
+
+    @property
+    def offset(self):
+        return self.buffer.offset(self.index)
+
+    @offset.setter
+    def offset(self, value):
+        self.buffer.set_offset(self.index, value)
+
+    @property
+    def weights(self):
+        return self.buffer.weights(self.index)
+
+    @weights.setter
+    def weights(self, value):
+        self.buffer.set_weights(self.index, value)
+
+    save = Vertex.save
+
+
+class FaceVertexView(object):
+    '''
+    A FaceVertex whose data is read from & written to a corner of a
+    MeshBuffer
+    '''
+    __slots__ = ('buffer', 'corner')
+
+    def __init__(self, buffer, corner):
+        self.buffer = buffer
+        self.corner = corner
+
+    @property
+    def vertex(self):
+        return self.buffer.face_indices[self.corner]
+
+    @vertex.setter
+    def vertex(self, value):
+        self.buffer.face_indices[self.corner] = value
+
+    @property
+    def normal(self):
+        return self.buffer.normal(self.corner)
+
+    @normal.setter
+    def normal(self, value):
+        self.buffer.set_normal(self.corner, value)
+
+    @property
+    def color(self):
+        return self.buffer.color(self.corner)
+
+    @color.setter
+    def color(self, value):
+        self.buffer.set_color(self.corner, value)
+
+    @property
+    def uv(self):
+        return self.buffer.uv(self.corner)
+
+    @uv.setter
+    def uv(self, value):
+        self.buffer.set_uv(self.corner, value)
+
+    def assign(self, face_vertex):
+        '''
+        Copy the data of another FaceVertex into this corner
+        '''
+        self.vertex = face_vertex.vertex
+        self.normal = face_vertex.normal
+        self.color = face_vertex.color
+        self.uv = face_vertex.uv
+
+    save = FaceVertex.save
+
+
+class FaceVertexList(object):
+    '''
+    The 3 corners of a FaceView - assigning a FaceVertex to one of them
+    copies its data into the MeshBuffer
+    '''
+    __slots__ = ('buffer', 'index')
+
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        self.index = index
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(3))]
+        if i < 0:
+            i += 3
+        if not 0 <= i < 3:
+            raise IndexError("corner index out of range")
+        return FaceVertexView(self.buffer, self.index * 3 + i)
+
+    def __setitem__(self, i, face_vertex):
+        self[i].assign(face_vertex)
+
+    def __iter__(self):
+        corner = self.index * 3
+        for i in range(3):
+            yield FaceVertexView(self.buffer, corner + i)
+
+
+class FaceView(object):
+    '''
+    A Face whose data is read from & written to a MeshBuffer
+    '''
+    __slots__ = ('buffer', 'index')
+
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        self.index = index
+
+    @property
+    def mesh_id(self):
+        return self.buffer.face_mesh_ids[self.index]
+
+    @mesh_id.setter
+    def mesh_id(self, value):
+        self.buffer.face_mesh_ids[self.index] = value
+
+    @property
+    def material_id(self):
+        return self.buffer.face_material_ids[self.index]
+
+    @material_id.setter
+    def material_id(self, value):
+        self.buffer.face_material_ids[self.index] = value
+
+    @property
+    def indices(self):
+        return FaceVertexList(self.buffer, self.index)
+
+    @indices.setter
+    def indices(self, value):
+        if len(value) != 3:
+            raise ValueError("a face has 3 corners, got %d" % len(value))
+        corners = FaceVertexList(self.buffer, self.index)
+        for i, face_vertex in enumerate(value):
+            corners[i] = face_vertex
+
+    save = Face.save
+
+
+class VertexList(object):
+    '''
+    Sequence of VertexView objects for the vertices of a MeshBuffer, created
+    on demand
+    Assigning a Vertex to an item copies its data into the buffer
+    '''
+    __slots__ = ('buffer',)
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def __len__(self):
+        return self.buffer.vert_count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            buffer = self.buffer
+            return [VertexView(buffer, i)
+                    for i in range(*index.indices(len(self)))]
+        return VertexView(self.buffer, self.__check_index__(index))
+
+    def __setitem__(self, index, vertex):
+        index = self.__check_index__(index)
+        self.buffer.set_offset(index, vertex.offset)
+        self.buffer.set_weights(index, vertex.weights)
+
+    def __check_index__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("vertex index out of range")
+        return index
+
+    def __iter__(self):
+        buffer = self.buffer
+        for i in range(len(self)):
+            yield VertexView(buffer, i)
+
+
+class FaceList(object):
+    '''
+    Sequence of FaceView objects for the faces of a MeshBuffer, created on
+    demand
+    Assigning a Face to an item copies its data into the buffer
+    '''
+    __slots__ = ('buffer',)
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def __len__(self):
+        return self.buffer.face_count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            buffer = self.buffer
+            return [FaceView(buffer, i)
+                    for i in range(*index.indices(len(self)))]
+        return FaceView(self.buffer, self.__check_index__(index))
+
+    def __setitem__(self, index, face):
+        view = FaceView(self.buffer, self.__check_index__(index))
+        view.mesh_id = face.mesh_id
+        view.material_id = face.material_id
+        view.indices = face.indices
+
+    def __check_index__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("face index out of range")
+        return index
+
+    def __iter__(self):
+        buffer = self.buffer
+        for i in range(len(self)):
+            yield FaceView(buffer, i)
 
-class Mesh(object):
-    __slots__ = ('name', 'verts', 'faces', 'bone_groups',
-                 'material_groups', '__vert_tok')
 
-    def __init__(self, name):
+class Mesh(object):
+    '''
+    bone_groups lists the (vertex index, weight) pairs for each bone, and
+    material_groups the vertex indices (in an array) used by each material
+
+    For meshes split from a model, the groups are only built when they're
+    first used, and are rebuilt if verts or faces are replaced or resized
+    afterwards (See invalidate_groups for other changes)
+    Otherwise they're kept exactly as they were set
+    '''
+    __slots__ = ('name', 'verts', 'faces', 'buffer', '__vert_tok',
+                 '__groups', '__group_counts')
+
+    def __init__(self, name, buffer=None):
         self.name = name
 
-        self.verts = []
-        self.faces = []
+        # When the mesh is backed by a MeshBuffer, verts and faces are
+        #  sequences of views that read & write it
+        self.buffer = buffer
+        if buffer is None:
+            self.verts = []
+            self.faces = []
+        else:
+            self.verts = VertexList(buffer)
+            self.faces = FaceList(buffer)
 
-        self.bone_groups = []
-        self.material_groups = []
+        # [bone_groups, material_groups, the signature of the mesh data they
+        #  were built from] - either group is None until it's needed
+        self.__groups = [[], [], None]
+        # (bone count, material count) once the groups can be built lazily
+        self.__group_counts = None
 
         # Used for handling VERT vs VERT32 without using a ton of if statements
         self.__vert_tok = 'VERT'
 
-    def __load_verts__(self, file, model):
-        lines_read = 0
-        vert_count = 0
-
-        bones = model.bones
-        # version = model.version
-        self.bone_groups = [[] for i in repeat(None, len(bones))]
-
-        for line in file:
-            lines_read += 1
+    def __groups_signature__(self):
+        return (id(self.verts), len(self.verts), id(self.faces),
+                len(self.faces))
+
+    def __get_group__(self, index):
+        groups = self.__groups
+        if self.__group_counts is not None:
+            signature = self.__groups_signature__()
+            if groups[2] != signature:
+                groups[:] = [None, None, signature]
+            if groups[index] is None:
+                groups[0], groups[1] = self.__build_groups__()
+        return groups[index]
+
+    def __set_group__(self, index, value):
+        groups = self.__groups
+        # Without group counts, the other group can't be rebuilt, so it's
+        #  kept as is
+        if self.__group_counts is not None:
+            signature = self.__groups_signature__()
+            if groups[2] != signature:
+                groups[:] = [None, None, signature]
+        groups[index] = value
+
+    def __set_group_counts__(self, bone_count, material_count):
+        '''
+        Build the groups for the given number of bones & materials when
+        they're first used, rather than now
+        '''
+        self.__group_counts = (bone_count, material_count)
+        self.__groups = [None, None, None]
+
+    def __build_groups__(self):
+        bone_count, material_count = self.__group_counts
+        if self.buffer is not None:
+            bone_groups, material_groups = self.buffer.groups(bone_count,
+                                                              material_count)
+        else:
+            bone_groups = [[] for i in range(bone_count)]
+            material_groups = [[] for i in range(material_count)]
+            for vert_id, vert in enumerate(self.verts):
+                for bone_id, weight in vert.weights:
+                    bone_groups[bone_id].append((vert_id, weight))
+            for face in self.faces:
+                material_groups[face.material_id].extend(
+                    [ind.vertex for ind in face.indices])
+
+            # Remove duplicates (keeping the first occurrence of each)
+            bone_groups = [list(dict.fromkeys(group)) for group in bone_groups]
+            material_groups = [dict.fromkeys(group)
+                               for group in material_groups]
+        return bone_groups, [array('I', group) for group in material_groups]
+
+    @property
+    def bone_groups(self):
+        return self.__get_group__(0)
+
+    @bone_groups.setter
+    def bone_groups(self, value):
+        self.__set_group__(0, value)
+
+    @property
+    def material_groups(self):
+        return self.__get_group__(1)
+
+    @material_groups.setter
+    def material_groups(self, value):
+        self.__set_group__(1, value)
+
+    def invalidate_groups(self):
+        '''
+        Rebuild bone_groups & material_groups the next time they're used
+        Only needed after changing the verts or faces in place
+         (ie. editing the weights of a vertex)
+        '''
+        if self.__group_counts is not None:
+            self.__groups[:] = [None, None, None]
 
-            line_split = line.split()
-            if not line_split:
-                continue
+    def __load_verts__(self, tokens, pos, bone_count):
+        '''
+        Load the vertices that follow the NUMVERTS token at or after pos
+        Meshes with a MeshBuffer have the vertices added to it
+        Returns the position of the token following them
+        '''
+        self.bone_groups = [[] for i in repeat(None, bone_count)]
 
-            if line_split[0] == 'NUMVERTS':
+        end = len(tokens)
+        while pos < end:
+            token = tokens[pos]
+            if token == 'NUMVERTS':
                 self.__vert_tok = 'VERT'
-            elif line_split[0] == 'NUMVERTS32':
+            elif token == 'NUMVERTS32':
                 self.__vert_tok = 'VERT32'
             else:
+                pos += 1
                 continue
-
-            vert_count = int(line_split[1])
-            self.verts = [Vertex() for i in range(vert_count)]
             break
+        if pos >= end:
+            return pos
+
+        vert_count = int(tokens[pos + 1])
+        pos += 2
+        if self.buffer is not None:
+            return self.__load_vert_buffer__(tokens, pos, vert_count)
+        self.verts = verts = [None] * vert_count
 
         vert_tok = self.__vert_tok
-        for vertex in self.verts:
-            lines_read += vertex.__load_vert__(file,
-                                               vert_count, self, vert_tok)
+        for i in range(vert_count):
+            # Vertices are almost always laid out as
+            #  VERT i OFFSET x y z BONES n (BONE b w) * n
+            #  so try to read them directly, before falling back to reading
+            #  them keyword by keyword
+            weights_end = __vert_weights_end__(tokens, pos, vert_count,
+                                               vert_tok)
+            if weights_end is not None:
+                verts[i] = Vertex(
+                    (float(tokens[pos + 3]), float(tokens[pos + 4]),
+                     float(tokens[pos + 5])),
+                    list(zip(map(int, tokens[pos + 9:weights_end:3]),
+                             map(float, tokens[pos + 10:weights_end:3]))))
+                pos = weights_end
+                continue
 
-        return lines_read
+            vertex = Vertex()
+            pos = vertex.__load_vert__(tokens, pos, vert_count, vert_tok)
+            verts[i] = vertex
 
-    def __load_faces__(self, file, version):
-        lines_read = 0
-        face_count = 0
+        return pos
 
-        self.material_groups = []
-
-        for line in file:
-            lines_read += 1
+    def __load_vert_buffer__(self, tokens, pos, vert_count):
+        '''
+        Same as __load_verts__, but the number tokens for every vertex are
+        gathered first, and then converted into the MeshBuffer all at once
+        '''
+        offsets = []
+        weight_counts = []
+        weight_bones = []
+        weight_values = []
 
-            line_split = line.split()
-            if not line_split:
+        vert_tok = self.__vert_tok
+        for i in range(vert_count):
+            weights_end = __vert_weights_end__(tokens, pos, vert_count,
+                                               vert_tok)
+            if weights_end is not None:
+                offsets.extend(tokens[pos + 3:pos + 6])
+                weight_counts.append((weights_end - pos - 8) // 3)
+                weight_bones.extend(tokens[pos + 9:weights_end:3])
+                weight_values.extend(tokens[pos + 10:weights_end:3])
+                pos = weights_end
                 continue
 
-            for i, split in enumerate(line_split):
-                if split[-1:] == ',':
-                    line_split[i] = split.rstrip(",")
+            vertex = Vertex()
+            pos = vertex.__load_vert__(tokens, pos, vert_count, vert_tok)
+            offsets.extend(vertex.offset)
+            weight_counts.append(len(vertex.weights))
+            for bone, value in vertex.weights:
+                weight_bones.append(bone)
+                weight_values.append(value)
+
+        buffer = self.buffer
+        buffer.positions.extend(array('f', map(float, offsets)))
+        buffer.weight_offsets.extend(
+            array('I', accumulate(weight_counts)))
+        buffer.weight_bones.extend(array('H', map(int, weight_bones)))
+        buffer.weight_values.extend(array('f', map(float, weight_values)))
+        return pos
+
+    def __load_faces__(self, tokens, pos, version):
+        '''
+        Load the faces that follow the NUMFACES token at or after pos
+        Meshes with a MeshBuffer have the faces added to it
+        Returns the position of the token following them
+        '''
+        self.material_groups = []
 
-            if line_split[0] == "NUMFACES":
-                face_count = int(line_split[1])
-                self.faces = [Face(None, None) for i in range(face_count)]
-                break
+        pos = __find_token__(tokens, 'NUMFACES', pos)
+        if pos >= len(tokens):
+            return pos
+        face_count = int(tokens[pos + 1])
+        pos += 2
 
         vert_tok = self.__vert_tok
-        for face in self.faces:
-            lines_read += face.__load_face__(file, version,
-                                             face_count, vert_tok=vert_tok)
+        buffer = self.buffer
+        layout = __face_section_layout__(tokens, pos, face_count, version,
+                                         vert_tok)
+        if layout is not None:
+            if buffer is not None:
+                __load_face_section_buffer__(buffer, tokens, pos, face_count,
+                                             version, layout)
+            else:
+                self.faces = __load_face_section__(tokens, pos, face_count,
+                                                   version, layout)
+            return layout[2]
+
+        faces = [Face(None, None) for i in range(face_count)]
+        for face in faces:
+            pos = face.__load_face__(tokens, pos, version, vert_tok=vert_tok)
+        if buffer is None:
+            self.faces = faces
+            return pos
+
+        for face in faces:
+            buffer.face_mesh_ids.append(face.mesh_id)
+            buffer.face_material_ids.append(face.material_id)
+            for ind in face.indices:
+                buffer.face_indices.append(ind.vertex)
+                buffer.normals.extend(ind.normal)
+                buffer.colors.extend(ind.color or (1.0, 1.0, 1.0, 1.0))
+                buffer.uvs.extend(ind.uv)
+        return pos
+
+
+class ModelInfo(object):
+    '''
+    Summary of a model file, as returned by Model.Probe()
+    bones, meshes & materials are lists of names
+    version is None if the file doesn't specify one
+    '''
+    __slots__ = ('version', 'bones', 'cosmetics', 'vert_count', 'face_count',
+                 'meshes', 'materials')
+
+    def __init__(self):
+        self.version = None
+        self.bones = []
+        self.cosmetics = 0
+        self.vert_count = 0
+        self.face_count = 0
+        self.meshes = []
+        self.materials = []
 
-        return lines_read
+
+class Bounds(object):
+    '''
+    An axis aligned bounding box (min, max) and a bounding sphere (center,
+    radius) around a set of points
+    '''
+    __slots__ = ('min', 'max', 'center', 'radius')
+
+    def __init__(self, min, max, center, radius):
+        self.min = min
+        self.max = max
+        self.center = center
+        self.radius = radius
+
+
+class ModelBounds(object):
+    '''
+    The bounds of a model, as returned by Model.compute_bounds()
+        model       Bounds of every vertex
+        meshes      Bounds for each mesh (None for meshes without vertices)
+        bones       Bounds for each bone, of the vertices it influences,
+                     in the bone's own space (ie. relative to its offset &
+                     along the axes of its matrix) - None for bones that
+                     don't influence any vertices
+    '''
+    __slots__ = ('model', 'meshes', 'bones')
+
+    def __init__(self):
+        self.model = None
+        self.meshes = []
+        self.bones = []
+
+
+def __bounds__(xs, ys, zs):
+    '''
+    Get the Bounds of the points with the given coordinate lists, or None
+    if there are none
+    The sphere is centered on the box, with the radius of the furthest point
+    '''
+    if not xs:
+        return None
+    low = (min(xs), min(ys), min(zs))
+    high = (max(xs), max(ys), max(zs))
+    center = tuple([(a + b) * 0.5 for a, b in zip(low, high)])
+    count = len(xs)
+    dx = list(map(sub, xs, repeat(center[0], count)))
+    dy = list(map(sub, ys, repeat(center[1], count)))
+    dz = list(map(sub, zs, repeat(center[2], count)))
+    distances = map(add, map(add, map(mul, dx, dx), map(mul, dy, dy)),
+                    map(mul, dz, dz))
+    return Bounds(low, high, center, sqrt(max(distances)))
+
+
+def __bone_verts__(mesh, bone_count):
+    '''
+    Get the indices of the vertices weighted to each bone of mesh (a vertex
+    may be listed more than once)
+    '''
+    result = [[] for i in range(bone_count)]
+    appends = [verts.append for verts in result]
+    buffer = mesh.buffer
+    if buffer is not None:
+        # Expand the CSR offsets to the vertex of each weight
+        offsets = buffer.weight_offsets
+        vert_ids = chain.from_iterable(map(
+            repeat, range(buffer.vert_count),
+            map(sub, islice(offsets, 1, None), offsets)))
+        pairs = zip(buffer.weight_bones, vert_ids)
+    else:
+        pairs = [(weight[0], vert_id)
+                 for vert_id, vert in enumerate(mesh.verts)
+                 for weight in vert.weights]
+    for bone, vert_id in pairs:
+        if bone < bone_count:
+            appends[bone](vert_id)
+    return result
+
+
+def __bone_space__(bone, xs, ys, zs):
+    '''
+    Convert the given coordinate lists to the space of bone
+    '''
+    if bone.offset is None or not bone.matrix or None in bone.matrix:
+        return xs, ys, zs
+    count = len(xs)
+    dx = list(map(sub, xs, repeat(bone.offset[0], count)))
+    dy = list(map(sub, ys, repeat(bone.offset[1], count)))
+    dz = list(map(sub, zs, repeat(bone.offset[2], count)))
+    # The rows of the matrix are the bone's axes
+    return [list(map(add, map(add, map(mul, dx, repeat(axis[0], count)),
+                              map(mul, dy, repeat(axis[1], count))),
+                     map(mul, dz, repeat(axis[2], count))))
+            for axis in bone.matrix]
 
 
 class Model(XBinIO, object):
-    __slots__ = ('version', 'name', 'bones', 'cosmetics', 'meshes', 'materials')
+    __slots__ = ('version', 'name', 'bones', 'cosmetics', 'meshes',
+                 'materials')
     supported_versions = [5, 6, 7]
 
     def __init__(self, name='$model'):
@@ -388,298 +1708,419 @@ class Model(XBinIO, object):
         self.materials = []
         self.cosmetics = 0
 
-    def __load_header__(self, file):
-        lines_read = 0
-        state = 0
-        for line in file:
-            lines_read += 1
-
-            line_split = line.split()
-            if not line_split:
-                continue
-
-            if state == 0 and line_split[0] == "MODEL":
-                state = 1
-            elif state == 1 and line_split[0] == "VERSION":
-                self.version = int(line_split[1])
-                if self.version not in Model.supported_versions:
-                    fmt = "Invalid model version: %d - must be one of %s"
-                    vargs = (self.version, repr(Model.supported_versions))
-                    raise ValueError(fmt % vargs)
-                return lines_read
-
-        return lines_read
-
-    def __load_bone__(self, file, bone_count):
-        lines_read = 0
-
+    def __load_header__(self, tokens, pos):
+        '''
+        Load the MODEL & VERSION header
+        Returns the position of the token following it
+        '''
+        pos = __find_token__(tokens, 'MODEL', pos)
+        pos = __find_token__(tokens, 'VERSION', pos)
+        if pos < len(tokens):
+            self.version = int(tokens[pos + 1])
+            if self.version not in Model.supported_versions:
+                fmt = "Invalid model version: %d - must be one of %s"
+                vargs = (self.version, repr(Model.supported_versions))
+                raise ValueError(fmt % vargs)
+            pos += 2
+        return pos
+
+    def __load_bone__(self, tokens, pos, bone_count):
+        '''
+        Load the transform of the bone starting at tokens[pos]
+        Returns the position of the token following it
+        '''
         # keeps track of the importer state for a given bone
         state = 0
 
         bone_index = -1
         bone = None
 
-        for line in file:
-            lines_read += 1
-
-            line_split = line.split()
-            if not line_split:
-                continue
-
-            for i, split in enumerate(line_split):
-                if split[-1:] == ',':
-                    line_split[i] = split.rstrip(",")
-
-            if state == 0 and line_split[0] == "BONE":
-                bone_index = int(line_split[1])
+        end = len(tokens)
+        while pos < end:
+            token = tokens[pos]
+            if state == 0 and token == "BONE":
+                bone_index = int(tokens[pos + 1])
                 if bone_index >= bone_count:
                     fmt = ("bone_count does not index bone_index -- "
                            "%d not in [0, %d)")
                     raise ValueError(fmt % (bone_index, bone_count))
                 state = 1
-            elif state == 1 and line_split[0] == "OFFSET":
+                pos += 2
+                continue
+            elif state == 1 and token == "OFFSET":
                 bone = self.bones[bone_index]
-                bone.offset = (float(line_split[1]),
-                               float(line_split[2]),
-                               float(line_split[3]))
+                bone.offset = (float(tokens[pos + 1]),
+                               float(tokens[pos + 2]),
+                               float(tokens[pos + 3]))
                 state = 2
-            elif state == 2 and line_split[0] == "SCALE":
+            elif state == 2 and token == "SCALE":
                 # Scales are not required and not used anymore, so we share state 2
-                scale = (float(line_split[1]),
-                         float(line_split[2]),
-                         float(line_split[3]))
-                bone.scale = scale
-            elif state == 2 and line_split[0] == "X":
-                x = (float(line_split[1]),
-                     float(line_split[2]),
-                     float(line_split[3]))
-                bone.matrix[0] = x
+                bone.scale = (float(tokens[pos + 1]),
+                              float(tokens[pos + 2]),
+                              float(tokens[pos + 3]))
+            elif state == 2 and token == "X":
+                bone.matrix[0] = (float(tokens[pos + 1]),
+                                  float(tokens[pos + 2]),
+                                  float(tokens[pos + 3]))
                 state = 3
-            elif state == 3 and line_split[0] == "Y":
-                y = (float(line_split[1]),
-                     float(line_split[2]),
-                     float(line_split[3]))
-                bone.matrix[1] = y
+            elif state == 3 and token == "Y":
+                bone.matrix[1] = (float(tokens[pos + 1]),
+                                  float(tokens[pos + 2]),
+                                  float(tokens[pos + 3]))
                 state = 4
-            elif state == 4 and line_split[0] == "Z":
-                z = (float(line_split[1]),
-                     float(line_split[2]),
-                     float(line_split[3]))
-                bone.matrix[2] = z
-                state = -1
-                return lines_read
-
-        return lines_read
-
-    def __load_bones__(self, file):
-        lines_read = 0
+            elif state == 4 and token == "Z":
+                bone.matrix[2] = (float(tokens[pos + 1]),
+                                  float(tokens[pos + 2]),
+                                  float(tokens[pos + 3]))
+                return pos + 4
+            else:
+                pos += 1
+                continue
+            pos += 4
+
+        return pos
+
+    def __load_bones__(self, tokens, pos):
+        '''
+        Load the bone list & the transforms of every bone
+        Returns the position of the token following them
+        '''
         bone_count = 0
         bones_read = 0
-        for line in file:
-            lines_read += 1
-
-            line_split = line.split()
-            if not line_split:
-                continue
 
-            if line_split[0] == "NUMCOSMETICS":
-                self.cosmetics = int(line_split[1])
-            elif line_split[0] == "NUMBONES":
-                bone_count = int(line_split[1])
+        end = len(tokens)
+        while pos < end:
+            token = tokens[pos]
+            if token == "NUMCOSMETICS":
+                self.cosmetics = int(tokens[pos + 1])
+                pos += 2
+            elif token == "NUMBONES":
+                bone_count = int(tokens[pos + 1])
                 self.bones = [Bone(None)] * bone_count
-            elif line_split[0] == "BONE":
-                index = int(line_split[1])
-                parent = int(line_split[2])
-                bone = Bone(line_split[3].strip('"'), parent)
+                pos += 2
+            elif token == "BONE" and bones_read < bone_count:
+                index = int(tokens[pos + 1])
+                parent = int(tokens[pos + 2])
+                name, pos = __load_string__(tokens, pos + 3)
+                bone = Bone(name, parent)
                 if index >= (len(self.bones) - self.cosmetics):
                     bone.cosmetic = True
                 self.bones[index] = bone
                 bones_read += 1
                 if bones_read == bone_count:
                     break
+            elif token == "NUMVERTS" or token == "NUMVERTS32":
+                break
+            else:
+                pos += 1
 
         for bone in range(bone_count):
-            lines_read += self.__load_bone__(file, bone_count)
+            pos = self.__load_bone__(tokens, pos, bone_count)
 
-        return lines_read
+        return pos
 
-    def __load_meshes__(self, file):
-        lines_read = 0
+    def __load_meshes__(self, tokens, pos):
+        '''
+        Load the list of (named) meshes
+        Returns the position of the token following it
+        '''
         mesh_count = 0
         meshes_read = 0
-        for line in file:
-            lines_read += 1
 
-            line_split = line.split()
-            if not line_split:
-                continue
-
-            if line_split[0] == "NUMOBJECTS":
-                mesh_count = int(line_split[1])
+        end = len(tokens)
+        while pos < end:
+            token = tokens[pos]
+            if token == "NUMOBJECTS":
+                mesh_count = int(tokens[pos + 1])
                 self.meshes = [None] * mesh_count
-            elif line_split[0] == "OBJECT":
-                index = int(line_split[1])
-                self.meshes[index] = Mesh(line_split[2].strip('"'))
+                pos += 2
+            elif token == "OBJECT":
+                index = int(tokens[pos + 1])
+                name, pos = __load_string__(tokens, pos + 2)
+                self.meshes[index] = Mesh(name)
                 meshes_read += 1
                 if meshes_read == mesh_count:
-                    return lines_read
+                    return pos
+            else:
+                pos += 1
 
-        return lines_read
+        return pos
 
     # Generate actual submesh data from the default mesh
     def __generate_meshes__(self, default_mesh):
         bone_count = len(self.bones)
         mtl_count = len(self.materials)
-        for mesh in self.meshes:
-            mesh.bone_groups = [[] for i in range(bone_count)]
-            mesh.material_groups = [[] for i in range(mtl_count)]
-
-        # An array of vertex mappings for each mesh
-        # used in the format vertex_map[mesh][original_vertex]
-        # yields either None (unset) or the new vertex id
-        vertex_map = [[None] * len(default_mesh.verts)
-                      for i in range(len(self.meshes))]
 
+        # Partition the faces by their mesh id
+        mesh_faces = [[] for mesh in self.meshes]
         for face in default_mesh.faces:
-            mesh_id = face.mesh_id
-            mtl_id = face.material_id
-            mesh = self.meshes[mesh_id]
-            for ind in face.indices:
-                vert_id = vertex_map[mesh_id][ind.vertex]
-                if vert_id is None:
-                    vert_id = len(mesh.verts)
-                    vertex_map[mesh_id][ind.vertex] = vert_id
-                    vert = default_mesh.verts[ind.vertex]
-                    mesh.verts.append(vert)
-                    for bone_id, weight in vert.weights:
-                        mesh.bone_groups[bone_id].append((vert_id, weight))
-                ind.vertex = vert_id
-                mesh.material_groups[mtl_id].append(vert_id)
-            mesh.faces.append(face)
-
-        # Remove duplicates
-        for mesh in self.meshes:
-            for group_index, group in enumerate(mesh.bone_groups):
-                mesh.bone_groups[group_index] = list(set(group))
-            for group_index, group in enumerate(mesh.material_groups):
-                mesh.material_groups[group_index] = list(set(group))
+            mesh_faces[face.mesh_id].append(face)
 
-    def __load_materials__(self, file, version):
-        lines_read = 0
+        # remap[vert] holds the new index of vert for the mesh whose id is
+        #  stored in remap_owner[vert], so it never has to be cleared
+        verts = default_mesh.verts
+        remap = array('I', [0]) * len(verts)
+        remap_owner = array('i', [-1]) * len(verts)
 
+        for mesh_id, faces in enumerate(mesh_faces):
+            mesh = self.meshes[mesh_id]
+            mesh_verts = mesh.verts
+            for face in faces:
+                for ind in face.indices:
+                    vert = ind.vertex
+                    if remap_owner[vert] != mesh_id:
+                        remap_owner[vert] = mesh_id
+                        vert_id = remap[vert] = len(mesh_verts)
+                        mesh_verts.append(verts[vert])
+                    else:
+                        vert_id = remap[vert]
+                    ind.vertex = vert_id
+            mesh.faces.extend(faces)
+            # The bone & material groups are built when they're first used
+            mesh.__set_group_counts__(bone_count, mtl_count)
+
+    # Same as __generate_meshes__, but for models loaded with as_arrays
+    def __generate_mesh_buffers__(self, default_mesh):
+        bone_count = len(self.bones)
+        mtl_count = len(self.materials)
+        split = default_mesh.buffer.split(len(self.meshes))
+        for mesh, (buffer, vertex_ids) in zip(self.meshes, split):
+            mesh.buffer = buffer
+            mesh.verts = VertexList(buffer)
+            mesh.faces = FaceList(buffer)
+            mesh.__set_group_counts__(bone_count, mtl_count)
+
+    def __load_materials__(self, tokens, pos):
+        '''
+        Load the materials & their properties (version 6+), or just their
+        images for version 5 files
+        Returns the position of the token following them
+        '''
         material_count = None
         material = None
-
-        for line in file:
-            lines_read += 1
-
-            line_split = line.split()
-            if not line_split:
-                continue
-
-            for i, split in enumerate(line_split):
-                if split[-1:] == ',':
-                    line_split[i] = split.rstrip(",")
-
-            if material_count is None and line_split[0] == "NUMMATERIALS":
-                material_count = int(line_split[1])
-                self.materials = [None] * material_count
-            elif line_split[0] == "MATERIAL":
-                index = int(line_split[1])
-                name = line_split[2].strip('"')
-                material_type = line_split[3].strip('"')
-                images = deserialize_image_string(line_split[4].strip('"'))
+        properties = __MATERIAL_PROPERTIES__
+
+        end = len(tokens)
+        while pos < end:
+            token = tokens[pos]
+            prop = properties.get(token)
+            if prop is not None:
+                name, types = prop
+                if types is float:
+                    value = float(tokens[pos + 1])
+                    pos += 2
+                else:
+                    value = tuple([convert(v) for convert, v in
+                                   zip(types, tokens[pos + 1:])])
+                    pos += 1 + len(types)
+                setattr(material, name, value)
+            elif token == "MATERIAL":
+                index = int(tokens[pos + 1])
+                name, pos = __load_string__(tokens, pos + 2)
+                if tokens[pos:pos + 1] and tokens[pos][:1] == '"':
+                    material_type, pos = __load_string__(tokens, pos)
+                    images, pos = __load_string__(tokens, pos)
+                else:
+                    # Version 5 materials only have an image string, which
+                    #  is used as the name as well (See
+                    #  serialize_image_string)
+                    material_type = "lambert"
+                    images = name
+                images = deserialize_image_string(images)
                 material = Material(name, material_type, images)
-                self.materials[index] = Material(name, material_type, images)
-                material = self.materials[index]
+                self.materials[index] = material
+            elif material_count is None and token == "NUMMATERIALS":
+                material_count = int(tokens[pos + 1])
+                self.materials = [None] * material_count
+                pos += 2
+            else:
+                pos += 1
 
-                if version == 5:
-                    continue
+        return pos
+
+    def to_indexed_buffers(self):
+        '''
+        Build an IndexedBuffer for each mesh, where face corners with the
+        same vertex, normal, uv & color are welded into a single vertex
+        '''
+        return [__index_mesh__(mesh) for mesh in self.meshes]
 
-            # All of the properties below are only present in version 6
-            elif line_split[0] == "COLOR":
-                material.color = (float(line_split[1]),
-                                  float(line_split[2]),
-                                  float(line_split[3]),
-                                  float(line_split[4]))
-            elif line_split[0] == "TRANSPARENCY":
-                material.transparency = (float(line_split[1]),
-                                         float(line_split[2]),
-                                         float(line_split[3]),
-                                         float(line_split[4]))
-            elif line_split[0] == "AMBIENTCOLOR":
-                material.color_ambient = (float(line_split[1]),
-                                          float(line_split[2]),
-                                          float(line_split[3]),
-                                          float(line_split[4]))
-            elif line_split[0] == "INCANDESCENCE":
-                material.incandescence = (float(line_split[1]),
-                                          float(line_split[2]),
-                                          float(line_split[3]),
-                                          float(line_split[4]))
-            elif line_split[0] == "COEFFS":
-                material.coeffs = (float(line_split[1]), float(line_split[2]))
-            elif line_split[0] == "GLOW":
-                material.glow = (float(line_split[1]), int(line_split[2]))
-            elif line_split[0] == "REFRACTIVE":
-                material.refractive = (int(line_split[1]),
-                                       float(line_split[2]))
-            elif line_split[0] == "SPECULARCOLOR":
-                material.color_specular = (float(line_split[1]),
-                                           float(line_split[2]),
-                                           float(line_split[3]),
-                                           float(line_split[4]))
-            elif line_split[0] == "REFLECTIVECOLOR":
-                material.color_reflective = (float(line_split[1]),
-                                             float(line_split[2]),
-                                             float(line_split[3]),
-                                             float(line_split[4]))
-            elif line_split[0] == "REFLECTIVE":
-                material.reflective = (
-                    int(line_split[1]), float(line_split[2]))
-            elif line_split[0] == "BLINN":
-                material.blinn = (float(line_split[1]), float(line_split[2]))
-            elif line_split[0] == "PHONG":
-                material.phong = float(line_split[1])
-
-        return lines_read
-
-    def normalize_weights(self):
-        """
-        Normalize the bone weights for all verts (in all meshes)
-        """
+    def generate_lods(self, ratios=(0.5, 0.25, 0.1), weight_tolerance=0.25):
+        '''
+        Build a simplified copy of the model for each of the given ratios,
+        where each mesh has at most ratio times as many faces
+        Seams, material borders & bone weights are kept (See lod.Decimator)
+        The ratio is a best effort upper bound - simplification stops short
+        of it once every remaining edge touches a locked seam / border vertex
+        or would break the mesh, so a mesh may end up with more faces
+        The copies share the bones & materials of this model, and can be
+        written like any other model
+        '''
+        from .lod import decimate_mesh
+
+        lods = []
+        for ratio in ratios:
+            model = Model(self.name)
+            model.version = self.version
+            model.cosmetics = self.cosmetics
+            model.bones = list(self.bones)
+            model.materials = list(self.materials)
+            lods.append(model)
+
+        with __gc_paused__():
+            for mesh in self.meshes:
+                meshes = decimate_mesh(mesh, ratios, weight_tolerance)
+                for model, lod_mesh in zip(lods, meshes):
+                    lod_mesh.__set_group_counts__(len(self.bones),
+                                                  len(self.materials))
+                    model.meshes.append(lod_mesh)
+        return lods
+
+    def compute_bounds(self):
+        '''
+        Get the ModelBounds of the model - the bounds of the whole model, of
+        each mesh and of the vertices influenced by each bone (using the
+        weights of the vertices, so the groups don't need to be built)
+        The bounds are computed from the current vertices on every call, as
+        they can be changed in place (ie. vert.offset) - keep the result to
+        reuse it while the model isn't modified
+        '''
+        return self.__build_bounds__()
+
+    def __build_bounds__(self):
+        result = ModelBounds()
+        all_xs = []
+        all_ys = []
+        all_zs = []
+        bone_coords = [([], [], []) for bone in self.bones]
         for mesh in self.meshes:
-            for vert in mesh.verts:
-                vert.weights = __normalized__(vert.weights)
+            if mesh.buffer is not None:
+                positions = mesh.buffer.positions.tolist()
+            else:
+                positions = list(chain.from_iterable(
+                    [vert.offset for vert in mesh.verts]))
+            xs = positions[0::3]
+            ys = positions[1::3]
+            zs = positions[2::3]
+            result.meshes.append(__bounds__(xs, ys, zs))
+            all_xs.extend(xs)
+            all_ys.extend(ys)
+            all_zs.extend(zs)
+
+            for coords, verts in zip(bone_coords,
+                                     __bone_verts__(mesh, len(self.bones))):
+                if not verts:
+                    continue
+                coords[0].extend(map(xs.__getitem__, verts))
+                coords[1].extend(map(ys.__getitem__, verts))
+                coords[2].extend(map(zs.__getitem__, verts))
+
+        result.model = __bounds__(all_xs, all_ys, all_zs)
+        result.bones = [__bounds__(*__bone_space__(bone, *coords))
+                        if coords[0] else None
+                        for bone, coords in zip(self.bones, bone_coords)]
+        return result
+
+    def normalize_weights(self, mode='sum', max_influences=0, min_weight=0.0,
+                          quantize=0):
+        '''
+        Process the bone weights for all verts (in all meshes), in order:
+            min_weight      remove the weights below min_weight (the largest
+                             weight of each vertex is always kept)
+            max_influences  if > 0, only keep the largest max_influences
+                             weights of each vertex
+            mode            'sum' scales the weights of each vertex to add up
+                             to 1, 'l2' to a length of 1, None leaves them
+            quantize        if > 0, round the weights to multiples of
+                             1 / quantize (ie. 255 for 8 bit weights) - with
+                             mode 'sum' they still add up to exactly 1
+        The groups of each mesh are rebuilt from the new weights
+        '''
+        with __gc_paused__():
+            for mesh in self.meshes:
+                buffer = mesh.buffer
+                if buffer is not None:
+                    offsets = buffer.weight_offsets
+                    counts = list(map(sub, offsets[1:], offsets[:-1]))
+                    bones = buffer.weight_bones.tolist()
+                    values = buffer.weight_values.tolist()
+                else:
+                    weights = [vert.weights for vert in mesh.verts]
+                    counts = list(map(len, weights))
+                    weights = list(chain.from_iterable(weights))
+                    bones = [weight[0] for weight in weights]
+                    values = [weight[1] for weight in weights]
+
+                counts, bones, values = __process_weights__(
+                    counts, bones, values, mode, max_influences, min_weight,
+                    quantize)
+
+                if buffer is not None:
+                    buffer.weight_offsets = array('I', [0])
+                    buffer.weight_offsets.extend(accumulate(counts))
+                    buffer.weight_bones = array('H', bones)
+                    buffer.weight_values = array('f', values)
+                else:
+                    weights = iter(list(zip(bones, values)))
+                    for vert, count in zip(mesh.verts, counts):
+                        vert.weights = list(islice(weights, count))
+                mesh.__set_group_counts__(len(self.bones),
+                                          len(self.materials))
 
-    def LoadFile_Raw(self, path, split_meshes=True):
+    def LoadFile_Raw(self, path, split_meshes=True, as_arrays=False):
+        '''
+        Load an XMODEL_EXPORT file
+        If as_arrays is True, the vertex & face data for each mesh is stored
+        in a MeshBuffer (mesh.buffer) instead of Vertex / Face objects, and
+        the numbers for each section are converted all at once
+        '''
+        # The whole file is split into tokens up front, and each section
+        #  continues from the token position the previous one stopped at
         file = open(path, "r")
-        # file automatically keeps track of what line its on across calls
-        self.__load_header__(file)
-        self.__load_bones__(file)
-
-        # A global mesh containing all of the vertex and face data for the
-        # entire model
-        default_mesh = Mesh("$default")
+        try:
+            tokens = __tokenize__(file.read())
+        finally:
+            file.close()
+
+        with __gc_paused__():
+            pos = self.__load_header__(tokens, 0)
+            pos = self.__load_bones__(tokens, pos)
+
+            # A global mesh containing all of the vertex and face data for the
+            # entire model
+            if as_arrays:
+                default_mesh = Mesh("$default", MeshBuffer())
+            else:
+                default_mesh = Mesh("$default")
 
-        default_mesh.__load_verts__(file, self)
-        default_mesh.__load_faces__(file, self.version)
+            pos = default_mesh.__load_verts__(tokens, pos, len(self.bones))
+            pos = default_mesh.__load_faces__(tokens, pos, self.version)
 
-        if split_meshes:
-            self.__load_meshes__(file)
-        self.__load_materials__(file, self.version)
+            if split_meshes:
+                pos = self.__load_meshes__(tokens, pos)
+            self.__load_materials__(tokens, pos)
+            # The tokens take up far more memory than the loaded model
+            del tokens
 
-        if split_meshes:
-            self.__generate_meshes__(default_mesh)
-        else:
-            self.meshes = [default_mesh]
-        file.close()
+            if not split_meshes:
+                self.meshes = [default_mesh]
+            elif as_arrays:
+                self.__generate_mesh_buffers__(default_mesh)
+            else:
+                self.__generate_meshes__(default_mesh)
 
     # Write an xmodel_export file, by default it uses the objects self.version
     def WriteFile_Raw(self, path, version=None,
                       header_message="",
                       extended_features=True,
-                      strict=False):
+                      strict=False,
+                      precision=6,
+                      compact_floats=False):
+        '''
+        Write an XMODEL_EXPORT file
+        Floats are written with precision decimal places, and if
+        compact_floats is True, without any trailing zeros
+        '''
         if version is None:
             version = self.version
 
@@ -723,31 +2164,36 @@ class Model(XBinIO, object):
         file.write("\n")
 
         # Bone Transform Data
-        for bone_index, bone in enumerate(self.bones):
-            file.write("BONE %d\n" % bone_index)
-            file.write("OFFSET %f %f %f\n" %
-                       (bone.offset[0], bone.offset[1], bone.offset[2]))
-            file.write("SCALE %f %f %f\n" % (1.0, 1.0, 1.0))
-            file.write("X %f %f %f\n" % __clamp_multi__(bone.matrix[0]))
-            file.write("Y %f %f %f\n" % __clamp_multi__(bone.matrix[1]))
-            file.write("Z %f %f %f\n\n" % __clamp_multi__(bone.matrix[2]))
+        bone_fmt = __float_format__("BONE %d\n"
+                                    "OFFSET %f %f %f\n"
+                                    "SCALE %f %f %f\n"
+                                    "X %f %f %f\n"
+                                    "Y %f %f %f\n"
+                                    "Z %f %f %f\n\n", precision)
+        __write_batched__(file, [
+            bone_fmt % ((bone_index, bone.offset[0], bone.offset[1],
+                         bone.offset[2], 1.0, 1.0, 1.0) +
+                        __clamp_multi__(bone.matrix[0]) +
+                        __clamp_multi__(bone.matrix[1]) +
+                        __clamp_multi__(bone.matrix[2]))
+            for bone_index, bone in enumerate(self.bones)], compact_floats)
         file.write("\n")
 
         # Vertices
         vert_tok_suffix = "32" if version == 7 and vert_count > 0xFFFF else ""
         file.write("NUMVERTS%s %d\n" % (vert_tok_suffix, vert_count))
         for mesh_index, mesh in enumerate(self.meshes):
-            vert_offset = vert_offsets[mesh_index]
-            for vert_index, vert in enumerate(mesh.verts):
-                vert.save(file, vert_index + vert_offset, vert_tok_suffix)
+            __write_batched__(file, __vert_records__(
+                mesh, vert_offsets[mesh_index], vert_tok_suffix, precision),
+                compact_floats)
 
         # Faces
         face_count = sum([len(mesh.faces) for mesh in self.meshes])
         file.write("NUMFACES %d\n" % face_count)
         for mesh_index, mesh in enumerate(self.meshes):
-            vert_offset = vert_offsets[mesh_index]
-            for face in mesh.faces:
-                face.save(file, version, vert_offset, vert_tok_suffix)
+            __write_batched__(file, __face_records__(
+                mesh, version, vert_offsets[mesh_index], vert_tok_suffix,
+                precision), compact_floats)
 
         # Meshes
         file.write("NUMOBJECTS %d\n" % len(self.meshes))
@@ -759,49 +2205,219 @@ class Model(XBinIO, object):
         file.write("NUMMATERIALS %d\n" % len(self.materials))
         for material_index, material in enumerate(self.materials):
             material.save(file, version, material_index,
-                          extended_features=extended_features)
+                          extended_features=extended_features,
+                          precision=precision, compact_floats=compact_floats)
 
         file.close()
 
     @staticmethod
-    def FromFile_Raw(filepath, split_meshes=True):
+    def FromFile_Raw(filepath, split_meshes=True, cache=None,
+                     as_arrays=False):
         '''
         Load from an XMODEL_EXPORT file and return the resulting Model()
+        cache can be a ParseCache to reuse the result of an earlier load
         '''
+        if cache is not None:
+            options = ('XMODEL_EXPORT', split_meshes, as_arrays)
+            return cache.Load(filepath, options,
+                              lambda: Model.FromFile_Raw(filepath,
+                                                         split_meshes,
+                                                         as_arrays=as_arrays))
         model = Model()
-        model.LoadFile_Raw(filepath, split_meshes)
+        model.LoadFile_Raw(filepath, split_meshes, as_arrays)
         return model
 
     def LoadFile_Bin(self, path, split_meshes=True,
-                     is_compressed=True, dump=False):
+                     is_compressed=True, dump=False, as_arrays=False,
+                     sections=None, stats=None, window_size=None):
+        '''
+        Load an XMODEL_BIN file
+        If as_arrays is True, the vertex & face data for each mesh is stored
+        in a MeshBuffer (mesh.buffer) instead of Vertex / Face objects
+        sections can be used to only load part of the file
+         ie. sections={'bones', 'materials'} (See xbin.SECTIONS)
+        Meshes are only split if 'verts', 'faces' and 'objects' are loaded
+        stats can be an XBinStats to fill in, or a function to call with one
+        If window_size is given, the file is decompressed & loaded in chunks
+         of about window_size bytes, rather than all at once, to limit the
+         memory used (Can't be combined with sections)
+        '''
+        collected = XBinStats.begin(stats)
         file = open(path, "rb")
 
-        if is_compressed:
-            file = XBinIO.__decompress_internal__(file, dump)
-
-        default_mesh = self.__xbin_loadfile_internal__(file, 'MODEL')
-
-        if split_meshes:
-            self.__generate_meshes__(default_mesh)
+        if window_size is not None:
+            data = XBinIO.__stream_internal__(file, window_size,
+                                              is_compressed, dump)
+            if collected is not None:
+                collected.compressed_size = os.path.getsize(path)
+        elif is_compressed:
+            data = XBinIO.__decompress_internal__(file, dump)
         else:
+            data = file.read()
+            file.close()
+
+        if collected is not None and window_size is None:
+            collected.lap('decompress')
+            collected.compressed_size = os.path.getsize(path)
+            collected.uncompressed_size = len(data)
+
+        default_mesh = self.__xbin_loadfile_internal__(data, 'MODEL',
+                                                       as_arrays, sections,
+                                                       collected)
+
+        if sections is not None and not set(
+                ('verts', 'faces', 'objects')).issubset(sections):
+            if 'objects' not in sections and (
+                    'verts' in sections or 'faces' in sections):
+                self.meshes = [default_mesh]
+        elif not split_meshes:
             self.meshes = [default_mesh]
-        file.close()
+        elif as_arrays:
+            self.__generate_mesh_buffers__(default_mesh)
+        else:
+            self.__generate_meshes__(default_mesh)
+
+        if collected is not None:
+            collected.lap('generate_meshes')
+            XBinStats.end(stats, collected)
 
-    def WriteFile_Bin(self, path, version=None,
-                      extended_features=True, header_message=""):
+    def WriteFile_Bin(self, path, version=None, extended_features=True,
+                      header_message="", stats=None, compression='fast',
+                      compression_level=None):
+        '''
+        Write an XMODEL_BIN file
+        compression can be 'fast', 'hc' (using compression_level if given)
+         or 'none' (See xbin.COMPRESSION_MODES)
+        stats can be an XBinStats to fill in, or a function to call with one
+        Returns an XBinStats with the file's sizes, compression ratio & timings
+        '''
         if version is None:
             version = self.version
-        return self.__xbin_writefile_model_internal__(path,
-                                                      version,
-                                                      extended_features,
-                                                      header_message)
+        level = __compression_level__(compression, compression_level)
+        collected = XBinStats.begin(stats) or XBinStats()
+        self.__xbin_writefile_model_internal__(path,
+                                               version,
+                                               extended_features,
+                                               header_message,
+                                               collected,
+                                               level,
+                                               stats is not None)
+        XBinStats.end(stats, collected)
+        return collected
 
     @staticmethod
     def FromFile_Bin(filepath, split_meshes=True,
-                     is_compressed=True, dump=False):
+                     is_compressed=True, dump=False, as_arrays=False,
+                     sections=None, stats=None, window_size=None,
+                     cache=None):
         '''
         Load from an XMODEL_BIN file and return the resulting Model()
+        cache can be a ParseCache to reuse the result of an earlier load
+         (stats are only collected when the file is actually loaded)
         '''
+        if cache is not None:
+            options = ('XMODEL_BIN', split_meshes, is_compressed, as_arrays,
+                       None if sections is None else sorted(sections))
+            return cache.Load(filepath, options,
+                              lambda: Model.FromFile_Bin(
+                                  filepath, split_meshes, is_compressed, dump,
+                                  as_arrays, sections, stats, window_size))
         model = Model()
-        model.LoadFile_Bin(filepath, split_meshes, is_compressed, dump)
+        model.LoadFile_Bin(filepath, split_meshes, is_compressed, dump,
+                           as_arrays, sections, stats, window_size)
         return model
+
+    @staticmethod
+    def __probe_raw__(path):
+        info = ModelInfo()
+        file = open(path, "rb")
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            file.close()
+            return info
+
+        # Everything up to the vertices is parsed line by line, after that
+        #  we jump straight to the NUMFACES, NUMOBJECTS & NUMMATERIALS lines
+        offset = -1
+        for line_split, next_offset in __split_lines__(data):
+            if line_split[0] == "VERSION":
+                info.version = int(line_split[1])
+            elif line_split[0] == "NUMBONES":
+                info.bones = [None] * int(line_split[1])
+            elif line_split[0] == "NUMCOSMETICS":
+                info.cosmetics = int(line_split[1])
+            elif line_split[0] == "BONE" and len(line_split) >= 4:
+                info.bones[int(line_split[1])] = line_split[3].strip('"')
+            elif line_split[0] in ("NUMVERTS", "NUMVERTS32"):
+                info.vert_count = int(line_split[1])
+                offset = next_offset
+                break
+
+        for keyword in (b"NUMFACES", b"NUMOBJECTS", b"NUMMATERIALS"):
+            if offset == -1:
+                break
+            offset = data.find(b"\n" + keyword, offset - 1)
+            if offset == -1:
+                break
+
+            items = None
+            count = 0
+            for line_split, offset in __split_lines__(data, offset + 1):
+                if items is None:
+                    count = int(line_split[1])
+                    if keyword == b"NUMFACES":
+                        info.face_count = count
+                        break
+                    items = [None] * count
+                elif line_split[0] in ("OBJECT", "MATERIAL"):
+                    index = int(line_split[1])
+                    items[index] = line_split[2].rstrip(",").strip('"')
+                    count -= 1
+                if count == 0:
+                    break
+
+            if keyword == b"NUMOBJECTS":
+                info.meshes = items or []
+            elif keyword == b"NUMMATERIALS":
+                info.materials = items or []
+
+        data.close()
+        file.close()
+        return info
+
+    @staticmethod
+    def __probe_bin__(path, is_compressed=True):
+        file = open(path, "rb")
+        if is_compressed:
+            data = XBinIO.__decompress_internal__(file)
+        else:
+            data = file.read()
+            file.close()
+
+        model = Model()
+        counts = model.__xbin_probe_internal__(data, 'MODEL')
+
+        info = ModelInfo()
+        info.version = counts['version']
+        info.bones = [bone.name for bone in model.bones]
+        info.cosmetics = model.cosmetics
+        info.vert_count = counts['verts']
+        info.face_count = counts['faces']
+        info.meshes = [mesh.name for mesh in model.meshes]
+        info.materials = [material.name for material in model.materials]
+        return info
+
+    @staticmethod
+    def Probe(path):
+        '''
+        Read the version, bone names, cosmetic count, vertex & face counts
+        and the object & material names from an XMODEL_EXPORT or XMODEL_BIN
+        file without loading any of its vertices or faces
+        Returns a ModelInfo()
+        '''
+        file_type = XBinIO.__file_type__(path)
+        if file_type == 'RAW':
+            return Model.__probe_raw__(path)
+        return Model.__probe_bin__(path, file_type == 'LZ4')
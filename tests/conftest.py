@@ -0,0 +1,115 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyCod.xmodel import (Model, Mesh, Bone, Vertex, Face, FaceVertex,
+                          Material)
+
+
+def build_model(version=6, size=4):
+    '''
+    Build a model with 2 bones, 2 materials & a single mesh - a size x size
+    grid of quads, with one material on each half
+    '''
+    model = Model('test_model')
+    model.version = version
+    for index, name in enumerate(('root', 'child')):
+        bone = Bone(name, index - 1)
+        bone.offset = (0.0, 0.0, float(index))
+        bone.matrix = [(1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0)]
+        model.bones.append(bone)
+    model.materials = [Material('mtl%d' % i, 'lambert',
+                                {'color': 'image%d.tga' % i})
+                       for i in range(2)]
+
+    mesh = Mesh('grid')
+    for y in range(size + 1):
+        for x in range(size + 1):
+            weight = float(x) / size
+            if weight in (0.0, 1.0):
+                weights = [(int(weight), 1.0)]
+            else:
+                weights = [(0, 1.0 - weight), (1, weight)]
+            mesh.verts.append(Vertex((float(x), float(y), 0.0), weights))
+
+    def corner(x, y):
+        color = None if version == 5 else (1.0, 0.5, 0.25, 1.0)
+        return FaceVertex(y * (size + 1) + x, (0.0, 0.0, 1.0), color,
+                          (float(x) / size, float(y) / size))
+
+    for y in range(size):
+        for x in range(size):
+            material = 0 if x < size // 2 else 1
+            for tri in (((x, y), (x + 1, y), (x + 1, y + 1)),
+                        ((x, y), (x + 1, y + 1), (x, y + 1))):
+                face = Face(0, material)
+                face.indices = [corner(*c) for c in tri]
+                mesh.faces.append(face)
+    model.meshes.append(mesh)
+    return model
+
+
+def build_closed_mesh_model(subdivisions=8):
+    '''
+    Build a model with a single closed, seamless mesh - a cube with each
+    side split into subdivisions x subdivisions quads, projected onto a
+    sphere. Every corner of a vertex has the same normal, color & uv
+    '''
+    model = Model('sphere')
+    model.version = 7
+    bone = Bone('root')
+    bone.offset = (0.0, 0.0, 0.0)
+    bone.matrix = [(1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0)]
+    model.bones.append(bone)
+    model.materials = [Material('mtl', 'lambert', {'color': 'image.tga'})]
+
+    mesh = Mesh('sphere')
+    verts = {}
+
+    def vertex(point):
+        key = tuple([int(round(v * subdivisions * 2)) for v in point])
+        index = verts.get(key)
+        if index is None:
+            length = sum([v * v for v in point]) ** 0.5
+            offset = tuple([v / length for v in point])
+            index = verts[key] = len(mesh.verts)
+            mesh.verts.append(Vertex(offset, [(0, 1.0)]))
+        return index
+
+    def corner(index):
+        return FaceVertex(index, mesh.verts[index].offset,
+                          (1.0, 1.0, 1.0, 1.0), (0.0, 0.0))
+
+    step = 2.0 / subdivisions
+    for axis in range(3):
+        for side in (-1.0, 1.0):
+            for i in range(subdivisions):
+                for j in range(subdivisions):
+                    quad = []
+                    for di, dj in ((0, 0), (1, 0), (1, 1), (0, 1)):
+                        point = [0.0, 0.0, 0.0]
+                        point[axis] = side
+                        point[(axis + 1) % 3] = -1.0 + (i + di) * step
+                        point[(axis + 2) % 3] = -1.0 + (j + dj) * step
+                        quad.append(vertex(point))
+                    if side < 0:
+                        quad.reverse()
+                    for tri in ((0, 1, 2), (0, 2, 3)):
+                        face = Face(0, 0)
+                        face.indices = [corner(quad[k]) for k in tri]
+                        mesh.faces.append(face)
+    model.meshes.append(mesh)
+    return model
+
+
+@pytest.fixture
+def model():
+    return build_model()
+
+
+@pytest.fixture
+def closed_model():
+    return build_closed_mesh_model()
@@ -0,0 +1,188 @@
+import os
+
+from PyCod import cache as cache_module
+from PyCod.cache import ParseCache, __ENTRY_EXT__
+from PyCod.xmodel import Model
+
+from conftest import build_model
+
+
+def entries(directory):
+    return sorted([name for name in os.listdir(directory)
+                   if name.endswith(__ENTRY_EXT__)])
+
+
+def write_model(path):
+    build_model().WriteFile_Raw(str(path))
+    return str(path)
+
+
+def test_hit_and_miss(tmp_path):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    path = write_model(tmp_path / 'test.XMODEL_EXPORT')
+
+    first = Model.FromFile_Raw(path, cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    second = Model.FromFile_Raw(path, cache=cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert second is not first
+    assert len(second.meshes[0].verts) == len(first.meshes[0].verts)
+
+    # Other load options are stored separately
+    Model.FromFile_Raw(path, cache=cache, split_meshes=False)
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert len(entries(cache.directory)) == 2
+
+
+def test_cached_groups_match_fresh_load(tmp_path):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    path = write_model(tmp_path / 'test.XMODEL_EXPORT')
+    for as_arrays in (False, True):
+        Model.FromFile_Raw(path, cache=cache, as_arrays=as_arrays)
+        cached = Model.FromFile_Raw(path, cache=cache, as_arrays=as_arrays)
+        fresh = Model.FromFile_Raw(path, as_arrays=as_arrays)
+        for cached_mesh, fresh_mesh in zip(cached.meshes, fresh.meshes):
+            assert cached_mesh.bone_groups == fresh_mesh.bone_groups
+            assert cached_mesh.material_groups == fresh_mesh.material_groups
+    assert cache.hits == 2
+
+
+def test_modified_file_is_reloaded(tmp_path):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    path = write_model(tmp_path / 'test.XMODEL_EXPORT')
+    Model.FromFile_Raw(path, cache=cache)
+
+    # A new modification time
+    info = os.stat(path)
+    os.utime(path, ns=(info.st_atime_ns, info.st_mtime_ns + 10 ** 9))
+    Model.FromFile_Raw(path, cache=cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    # New contents with the same size & modification time are only caught
+    #  by hashing the file
+    cache = ParseCache(cache.directory, verify=True)
+    Model.FromFile_Raw(path, cache=cache)
+    Model.FromFile_Raw(path, cache=cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    info = os.stat(path)
+    with open(path, 'r') as file:
+        data = file.read()
+    with open(path, 'w') as file:
+        file.write(data.replace('"grid"', '"GRID"'))
+    os.utime(path, ns=(info.st_atime_ns, info.st_mtime_ns))
+    assert os.stat(path).st_size == info.st_size
+    model = Model.FromFile_Raw(path, cache=cache)
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert model.meshes[0].name == 'GRID'
+
+
+def test_damaged_entry_is_replaced(tmp_path):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    path = write_model(tmp_path / 'test.XMODEL_EXPORT')
+    Model.FromFile_Raw(path, cache=cache)
+    (name,) = entries(cache.directory)
+    entry = os.path.join(cache.directory, name)
+    with open(entry, 'wb') as file:
+        file.write(b'not a snapshot')
+
+    model = Model.FromFile_Raw(path, cache=cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert model.meshes[0].name == 'grid'
+    assert os.path.getsize(entry) > len(b'not a snapshot')
+    Model.FromFile_Raw(path, cache=cache)
+    assert cache.hits == 1
+
+
+def test_hit_without_write_access(tmp_path, monkeypatch):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    path = write_model(tmp_path / 'test.XMODEL_EXPORT')
+    Model.FromFile_Raw(path, cache=cache)
+
+    def utime(*args, **kwargs):
+        raise PermissionError('read-only')
+    monkeypatch.setattr(os, 'utime', utime)
+    model = Model.FromFile_Raw(path, cache=cache)
+    assert cache.hits == 1
+    assert model.meshes[0].name == 'grid'
+
+
+def test_trim_removes_least_recently_used(tmp_path):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    paths = []
+    for index in range(3):
+        path = tmp_path / ('file%d' % index)
+        path.write_bytes(b'%d' % index)
+        paths.append(str(path))
+        cache.Load(paths[-1], (), lambda: ['asset'] * 100)
+    names = [os.path.basename(cache.__entry_path__(path, ()))
+             for path in paths]
+    assert entries(cache.directory) == sorted(names)
+
+    # Use the entries from oldest to newest: 1, 0, 2
+    for age, index in enumerate((1, 0, 2)):
+        entry = os.path.join(cache.directory, names[index])
+        os.utime(entry, (1000000 + age, 1000000 + age))
+    sizes = [os.path.getsize(os.path.join(cache.directory, name))
+             for name in names]
+
+    cache.Trim(sum(sizes) - 1)
+    assert entries(cache.directory) == sorted([names[0], names[2]])
+    cache.Trim(sizes[2])
+    assert entries(cache.directory) == [names[2]]
+    cache.Clear()
+    assert entries(cache.directory) == []
+
+
+def test_size_limit_is_applied_on_store(tmp_path):
+    cache = ParseCache(str(tmp_path / 'cache'), max_size=0)
+    path = tmp_path / 'file'
+    path.write_bytes(b'data')
+    assert cache.Load(str(path), (), lambda: [1, 2, 3]) == [1, 2, 3]
+    assert entries(cache.directory) == []
+    assert cache.misses == 1
+
+
+def test_trim_only_when_over_size(tmp_path, monkeypatch):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    calls = []
+    trim = cache.Trim
+    monkeypatch.setattr(ParseCache, 'Trim',
+                        lambda self, *args: calls.append(args) or trim())
+    for index in range(3):
+        path = tmp_path / ('file%d' % index)
+        path.write_bytes(b'%d' % index)
+        cache.Load(str(path), (), lambda: [index])
+    # Only the first store has to count the entries
+    assert len(calls) == 1
+    assert cache.size == sum([os.path.getsize(os.path.join(
+        cache.directory, name)) for name in entries(cache.directory)])
+
+
+def test_failed_store_keeps_result(tmp_path, monkeypatch):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    path = write_model(tmp_path / 'test.XMODEL_EXPORT')
+
+    def replace(*args, **kwargs):
+        raise PermissionError('read-only')
+    monkeypatch.setattr(os, 'replace', replace)
+    model = Model.FromFile_Raw(path, cache=cache)
+    assert model.meshes[0].name == 'grid'
+    assert os.listdir(cache.directory) == []
+
+    # Results that can't be pickled aren't stored either
+    monkeypatch.undo()
+    result = cache.Load(path, ('lambda',), lambda: [lambda: None])
+    assert len(result) == 1
+    assert os.listdir(cache.directory) == []
+
+
+def test_hit_does_not_hash_file(tmp_path, monkeypatch):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    path = write_model(tmp_path / 'test.XMODEL_EXPORT')
+
+    def file_digest(path):
+        raise AssertionError('hashed %s' % path)
+    monkeypatch.setattr(cache_module, '__file_digest__', file_digest)
+    Model.FromFile_Raw(path, cache=cache)
+    Model.FromFile_Raw(path, cache=cache)
+    assert (cache.hits, cache.misses) == (1, 1)
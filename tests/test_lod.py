@@ -0,0 +1,43 @@
+import pytest
+
+from conftest import build_closed_mesh_model
+
+
+def edge_counts(mesh):
+    '''
+    Count the faces using each (undirected) edge of mesh
+    '''
+    counts = {}
+    for face in mesh.faces:
+        verts = [ind.vertex for ind in face.indices]
+        for i in range(3):
+            edge = tuple(sorted((verts[i], verts[(i + 1) % 3])))
+            counts[edge] = counts.get(edge, 0) + 1
+    return counts
+
+
+@pytest.mark.parametrize('ratios', [(0.5, 0.25, 0.1), (0.1, 0.5)])
+def test_closed_mesh(ratios):
+    source = build_closed_mesh_model()
+    face_count = len(source.meshes[0].faces)
+    lods = source.generate_lods(ratios)
+    assert len(lods) == len(ratios)
+
+    for ratio, lod in zip(ratios, lods):
+        assert [bone.name for bone in lod.bones] == ['root']
+        assert len(lod.meshes) == 1
+        mesh = lod.meshes[0]
+        # Nothing is locked on a closed seamless mesh, so every target is met
+        assert len(mesh.faces) <= int(face_count * ratio)
+        assert len(mesh.faces) >= int(face_count * ratio) - 2
+
+        # Still closed & manifold: every edge has exactly two faces, no face
+        #  uses a vertex twice & every vertex is used (Euler characteristic 2)
+        for face in mesh.faces:
+            verts = [ind.vertex for ind in face.indices]
+            assert len(set(verts)) == 3
+        counts = edge_counts(mesh)
+        assert set(counts.values()) == set([2])
+        used = set(ind.vertex for face in mesh.faces for ind in face.indices)
+        assert used == set(range(len(mesh.verts)))
+        assert len(mesh.verts) - len(counts) + len(mesh.faces) == 2
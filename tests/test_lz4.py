@@ -0,0 +1,76 @@
+import os
+import struct
+
+import pytest
+
+from PyCod import _lz4 as lz4
+
+
+def incompressible(size):
+    # 4 byte counters never repeat a 4 byte sequence
+    return b''.join([struct.pack('>I', i * 2654435761 % 0xFFFFFFFB)
+                     for i in range(size // 4)])
+
+
+def text(size):
+    lines = []
+    total = 0
+    index = 0
+    while total < size:
+        line = b'line %d of some text\n' % index
+        lines.append(line)
+        total += len(line)
+        index += 1
+    return b''.join(lines)[:size]
+
+
+def stream(data, level, chunk_size, step=0x1000, use_write=False):
+    '''
+    Compress data with a Compressor, returning the block & the largest size
+    its input buffer reached
+    '''
+    output = []
+    compressor = lz4.Compressor(chunk_size, level,
+                                output.append if use_write else None)
+    largest = 0
+    for start in range(0, len(data), step):
+        output.append(compressor.compress(data[start:start + step]))
+        largest = max(largest, len(compressor.buffer))
+    output.append(compressor.flush())
+    return b''.join(output), largest
+
+
+def uncompress(block, size):
+    return bytes(lz4.__uncompress_python__(struct.pack('I', size) + block))
+
+
+@pytest.mark.parametrize('level', [0, 1, 4])
+@pytest.mark.parametrize('make_data', [incompressible, text, os.urandom])
+@pytest.mark.parametrize('use_write', [False, True])
+def test_compressor_round_trip(level, make_data, use_write):
+    data = make_data(0x18000)
+    block, largest = stream(data, level, 0x1000, use_write=use_write)
+    assert uncompress(block, len(data)) == data
+    # At most 2 chunks of unmatched input, the match window & one write
+    assert largest <= 2 * 0x1000 + lz4.MAX_OFFSET + 0x1000 + 16
+
+
+def test_compressor_level_0_is_literal_only():
+    data = text(0x30000)
+    block, largest = stream(data, 0, 0x2000)
+    assert block == bytes(lz4.__compress_python__(data, 0))
+
+
+def test_compressor_compresses_text():
+    data = text(0x30000)
+    block, largest = stream(data, 1, 0x2000)
+    assert len(block) < len(data) // 2
+
+
+def test_compressor_recovers_after_unmatched_input():
+    # Only SPLIT_PROBES positions of the random part are checked, but the
+    #  text after it is still split & compressed as usual
+    data = os.urandom(0x6000) + text(0x30000)
+    block, largest = stream(data, 1, 0x1000)
+    assert uncompress(block, len(data)) == data
+    assert len(block) < 0x6000 + 0x30000 // 2
@@ -0,0 +1,240 @@
+import io
+
+import pytest
+
+from PyCod.xmodel import Model, Vertex, FaceVertex
+
+from conftest import build_model
+
+
+def write_model(tmp_path):
+    path = str(tmp_path / 'test.XMODEL_EXPORT')
+    build_model().WriteFile_Raw(path)
+    return path
+
+
+def group_sets(mesh):
+    return ([sorted(group) for group in mesh.bone_groups],
+            [sorted(group) for group in mesh.material_groups])
+
+
+@pytest.mark.parametrize('as_arrays', [False, True])
+def test_unsplit_groups(tmp_path, as_arrays):
+    model = Model.FromFile_Raw(write_model(tmp_path), split_meshes=False,
+                               as_arrays=as_arrays)
+    mesh = model.meshes[0]
+    assert mesh.bone_groups == [[], []]
+    assert mesh.material_groups == []
+
+
+@pytest.mark.parametrize('as_arrays', [False, True])
+def test_split_groups(tmp_path, as_arrays):
+    model = Model.FromFile_Raw(write_model(tmp_path), as_arrays=as_arrays)
+    mesh = model.meshes[0]
+    bone_groups, material_groups = group_sets(mesh)
+    # The grid is 5 x 5, with the left column only on bone 0 & the right
+    #  column only on bone 1
+    assert len(bone_groups[0]) == 20 and len(bone_groups[1]) == 20
+    assert len(material_groups[0]) == 15 and len(material_groups[1]) == 15
+
+
+def test_groups_invalidation(tmp_path):
+    model = Model.FromFile_Raw(write_model(tmp_path))
+    mesh = model.meshes[0]
+    vert_count = len(mesh.verts)
+    assert (vert_count, 1.0) not in mesh.bone_groups[0]
+
+    # Resizing the verts is picked up without invalidate_groups
+    mesh.verts.append(Vertex((0.0, 0.0, 0.0), [(0, 1.0)]))
+    assert (vert_count, 1.0) in mesh.bone_groups[0]
+
+    # Changes in place aren't until invalidate_groups is called
+    mesh.verts[vert_count].weights = [(1, 1.0)]
+    assert (vert_count, 1.0) in mesh.bone_groups[0]
+    mesh.invalidate_groups()
+    assert (vert_count, 1.0) not in mesh.bone_groups[0]
+    assert (vert_count, 1.0) in mesh.bone_groups[1]
+
+    # Replacing the faces rebuilds both groups
+    faces = mesh.faces
+    mesh.faces = [face for face in faces if face.material_id == 0]
+    assert len(mesh.material_groups[1]) == 0
+
+
+def test_groups_set_explicitly():
+    mesh = build_model().meshes[0]
+    mesh.bone_groups = [[(0, 1.0)], []]
+    mesh.verts.append(Vertex((0.0, 0.0, 0.0), [(0, 1.0)]))
+    mesh.material_groups = [[0]]
+    assert mesh.bone_groups == [[(0, 1.0)], []]
+    assert mesh.material_groups == [[0]]
+
+
+def load_arrays(tmp_path):
+    return Model.FromFile_Raw(write_model(tmp_path), as_arrays=True)
+
+
+def test_vertex_view_writes_through(tmp_path):
+    mesh = load_arrays(tmp_path).meshes[0]
+    buffer = mesh.buffer
+    vert = mesh.verts[1]
+    assert not hasattr(vert, '__dict__')
+
+    vert.offset = (1.5, 2.5, 3.5)
+    assert buffer.offset(1) == (1.5, 2.5, 3.5)
+    assert mesh.verts[1].offset == (1.5, 2.5, 3.5)
+
+    # Changing the returned list does nothing, assigning a new one does -
+    #  and moves the weights of the vertices after it
+    last = mesh.verts[-1].weights
+    vert.weights.append((1, 0.5))
+    assert len(vert.weights) == 2
+    vert.weights = [(0, 0.25), (1, 0.5), (1, 0.25)]
+    assert mesh.verts[1].weights == [(0, 0.25), (1, 0.5), (1, 0.25)]
+    assert mesh.verts[-1].weights == last
+
+    mesh.verts[2] = Vertex((7.0, 8.0, 9.0), [(1, 1.0)])
+    assert buffer.offset(2) == (7.0, 8.0, 9.0)
+    assert buffer.weights(2) == [(1, 1.0)]
+
+    assert [v.offset for v in mesh.verts[1:3]] == [(1.5, 2.5, 3.5),
+                                                   (7.0, 8.0, 9.0)]
+    with pytest.raises(IndexError):
+        mesh.verts[len(mesh.verts)]
+
+
+def test_face_view_writes_through(tmp_path):
+    mesh = load_arrays(tmp_path).meshes[0]
+    buffer = mesh.buffer
+    face = mesh.faces[0]
+    assert not hasattr(face, '__dict__')
+
+    face.material_id = 1
+    assert buffer.face_material_ids[0] == 1
+
+    corner = face.indices[1]
+    corner.vertex = 3
+    corner.uv = (0.25, 0.75)
+    assert buffer.face_indices[1] == 3
+    assert buffer.uv(1) == (0.25, 0.75)
+
+    face.indices[2] = FaceVertex(4, (1.0, 0.0, 0.0), (0.0, 0.0, 0.0, 1.0),
+                                 (0.5, 0.5))
+    assert mesh.faces[0].indices[2].vertex == 4
+    assert buffer.normal(2) == (1.0, 0.0, 0.0)
+    assert buffer.color(2) == (0.0, 0.0, 0.0, 1.0)
+
+    # Faces are copied into the buffer, rather than stored
+    other = build_model().meshes[0].faces[-1]
+    mesh.faces[0] = other
+    assert [ind.vertex for ind in mesh.faces[0].indices] == [
+        ind.vertex for ind in other.indices]
+    assert mesh.faces[0].material_id == other.material_id
+    with pytest.raises(ValueError):
+        face.indices = face.indices[:2]
+
+
+def test_views_save_like_objects(tmp_path):
+    source = build_model()
+    path = write_model(tmp_path)
+    arrays = Model.FromFile_Raw(path, as_arrays=True).meshes[0]
+    objects = Model.FromFile_Raw(path).meshes[0]
+    for view, obj in zip(arrays.verts, objects.verts):
+        view_file = io.StringIO()
+        obj_file = io.StringIO()
+        view.save(view_file, 0)
+        obj.save(obj_file, 0)
+        assert view_file.getvalue() == obj_file.getvalue()
+    for view, obj in zip(arrays.faces, objects.faces):
+        view_file = io.StringIO()
+        obj_file = io.StringIO()
+        view.save(view_file, source.version, 0)
+        obj.save(obj_file, source.version, 0)
+        assert view_file.getvalue() == obj_file.getvalue()
+
+
+def test_set_normal_matches_writer(tmp_path):
+    # round() & int() quantize these differently
+    normal = (0.99999, -0.99999, 0.5)
+    color = (0.999, 0.5, 0.001, 1.0)
+    source = build_model()
+    for face in source.meshes[0].faces:
+        for ind in face.indices:
+            ind.normal = normal
+            ind.color = color
+    path = str(tmp_path / 'test.XMODEL_BIN')
+    source.WriteFile_Bin(path)
+    written = Model.FromFile_Bin(path, as_arrays=True).meshes[0].buffer
+
+    model = Model.FromFile_Bin(path, as_arrays=True)
+    buffer = model.meshes[0].buffer
+    assert buffer.normals.typecode == 'h'
+    for face in model.meshes[0].faces:
+        for ind in face.indices:
+            ind.normal = normal
+            ind.color = color
+    assert buffer.normals == written.normals
+    assert buffer.colors == written.colors
+
+
+def indexed_faces(indexed):
+    '''
+    Rebuild the (material id, corners) of each face from an IndexedBuffer,
+    with each corner as (vertex id, offset, normal, uv, color)
+    '''
+    stride = indexed.VERTEX_STRIDE
+    values = indexed.vertices.tolist()
+    corners = [(indexed.vertex_ids[i],
+                tuple(values[i * stride:i * stride + 3]),
+                tuple(values[i * stride + 3:i * stride + 6]),
+                tuple(values[i * stride + 6:i * stride + 8]),
+                tuple(values[i * stride + 8:i * stride + 12]))
+               for i in range(indexed.vert_count)]
+    result = []
+    for material_id, indices in sorted(indexed.indices.items()):
+        for i in range(0, len(indices), 3):
+            result.append((material_id,
+                           [corners[j] for j in indices[i:i + 3]]))
+    return result
+
+
+def source_faces(mesh):
+    faces = []
+    for face in mesh.faces:
+        faces.append((face.material_id,
+                      [(ind.vertex, tuple(mesh.verts[ind.vertex].offset),
+                        tuple(ind.normal), tuple(ind.uv), tuple(ind.color))
+                       for ind in face.indices]))
+    faces.sort(key=lambda face: face[0])
+    return faces
+
+
+@pytest.mark.parametrize('as_arrays', [False, True])
+def test_indexed_buffers_round_trip(tmp_path, as_arrays):
+    source = build_model()
+    mesh = source.meshes[0]
+    # A uv seam on one corner of vertex 6
+    seam = mesh.faces[10].indices[0]
+    seam.uv = (0.5, 0.5)
+    path = str(tmp_path / 'test.XMODEL_BIN')
+    source.WriteFile_Bin(path)
+    model = Model.FromFile_Bin(path, as_arrays=as_arrays)
+    mesh = model.meshes[0]
+
+    (indexed,) = model.to_indexed_buffers()
+    # Every vertex is welded into one, except for the seam
+    assert indexed.vert_count == len(mesh.verts) + 1
+    assert indexed.indices[0].typecode == 'H'
+    assert sorted(indexed.indices) == [0, 1]
+
+    expected = source_faces(mesh)
+    faces = indexed_faces(indexed)
+    assert len(faces) == len(expected)
+    for (material_id, corners), (expected_id, expected_corners) in zip(
+            faces, expected):
+        assert material_id == expected_id
+        for corner, expected_corner in zip(corners, expected_corners):
+            assert corner[0] == expected_corner[0]
+            for values, expected_values in zip(corner[1:],
+                                               expected_corner[1:]):
+                assert values == pytest.approx(expected_values, abs=1e-6)
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(code):
+    '''
+    Run code in a fresh interpreter (the tests have already imported the
+    format modules) & return what it prints
+    '''
+    return subprocess.check_output([sys.executable, '-c', code],
+                                   cwd=ROOT).decode().split()
+
+
+def test_import_is_lazy():
+    modules = run("import sys, PyCod\n"
+                  "print(' '.join(sorted(name for name in sys.modules\n"
+                  "                      if name.startswith('PyCod'))))")
+    assert modules == ['PyCod']
+
+
+def test_attributes_import_their_module():
+    modules = run("import sys, PyCod\n"
+                  "PyCod.Anim\n"
+                  "print('PyCod.xanim' in sys.modules,\n"
+                  "      'PyCod.xmodel' in sys.modules,\n"
+                  "      PyCod.Model.__module__)")
+    assert modules == ['True', 'False', 'PyCod.xmodel']
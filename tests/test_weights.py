@@ -0,0 +1,78 @@
+import pytest
+
+from PyCod.xmodel import Model, Bone
+
+from conftest import build_model
+
+
+def weights_model(tmp_path, weights, as_arrays):
+    '''
+    Build a model with 3 bones whose grid vertices have the given weights
+    (repeated), loaded back with or without arrays
+    '''
+    source = build_model()
+    bone = Bone('extra', 0)
+    bone.offset = (0.0, 0.0, 0.0)
+    bone.matrix = [(1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0)]
+    source.bones.append(bone)
+    mesh = source.meshes[0]
+    for index, vert in enumerate(mesh.verts):
+        vert.weights = list(weights[index % len(weights)])
+    path = str(tmp_path / 'test.XMODEL_EXPORT')
+    source.WriteFile_Raw(path)
+    return Model.FromFile_Raw(path, as_arrays=as_arrays)
+
+
+def vert_weights(model, count):
+    return [[(bone, round(weight, 5)) for bone, weight in vert.weights]
+            for vert in model.meshes[0].verts[:count]]
+
+
+CASES = [
+    # Scaled to add up to 1, or to a length of 1, or left as they are
+    ({}, [[(0, 2.0), (1, 2.0)], [(0, 0.0), (1, 0.0)]],
+     [[(0, 0.5), (1, 0.5)], [(0, 0.0), (1, 0.0)]]),
+    ({'mode': 'l2'}, [[(0, 3.0), (1, 4.0)]], [[(0, 0.6), (1, 0.8)]]),
+    ({'mode': None, 'max_influences': 1}, [[(0, 0.25), (2, 0.5)]],
+     [[(2, 0.5)]]),
+    # The largest weights are kept, in their original order
+    ({'max_influences': 2}, [[(0, 0.1), (1, 0.5), (2, 0.4)]],
+     [[(1, 0.55556), (2, 0.44444)]]),
+    # Except for the largest weight, weights below min_weight are removed
+    ({'min_weight': 0.1}, [[(0, 0.05), (1, 0.95)], [(0, 0.01), (2, 0.02)]],
+     [[(1, 1.0)], [(2, 1.0)]]),
+    # The rounding error goes to the largest weight, and weights rounded
+    #  down to 0 are removed
+    ({'quantize': 10},
+     [[(0, 1.0), (1, 1.0), (2, 1.0)], [(0, 0.99), (1, 0.01)]],
+     [[(0, 0.4), (1, 0.3), (2, 0.3)], [(0, 1.0)]]),
+    ({'mode': None, 'quantize': 4}, [[(0, 0.3), (1, 0.3)]],
+     [[(0, 0.25), (1, 0.25)]]),
+]
+
+
+@pytest.mark.parametrize('options, weights, expected', CASES)
+@pytest.mark.parametrize('as_arrays', [False, True])
+def test_normalize_weights(tmp_path, as_arrays, options, weights, expected):
+    model = weights_model(tmp_path, weights, as_arrays)
+    model.normalize_weights(**options)
+    assert vert_weights(model, len(expected)) == expected
+
+
+@pytest.mark.parametrize('as_arrays', [False, True])
+def test_normalize_weights_rebuilds_groups(tmp_path, as_arrays):
+    model = weights_model(tmp_path, [[(0, 0.05), (1, 0.95)]], as_arrays)
+    mesh = model.meshes[0]
+    assert len(mesh.bone_groups[0]) == len(mesh.verts)
+    model.normalize_weights(min_weight=0.1)
+    assert mesh.bone_groups[0] == []
+    group = sorted(mesh.bone_groups[1])
+    assert [vert for vert, weight in group] == list(range(len(mesh.verts)))
+    assert [weight for vert, weight in group] == pytest.approx(
+        [1.0] * len(mesh.verts))
+
+
+def test_unknown_mode():
+    model = build_model()
+    with pytest.raises(ValueError):
+        model.normalize_weights(mode='max')
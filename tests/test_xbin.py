@@ -0,0 +1,106 @@
+import pytest
+
+from PyCod import xbin
+from PyCod.xbin import XBinIO
+from PyCod.xmodel import Model
+
+from test_xmodel import mesh_data
+from conftest import build_model
+
+
+@pytest.fixture(scope='module')
+def bin_files(tmp_path_factory):
+    '''
+    Write a model that decompresses to a few times __STREAM_MARGIN__ as
+    both a compressed & an uncompressed XMODEL_BIN
+    '''
+    directory = tmp_path_factory.mktemp('xbin')
+    path = str(directory / 'test.XMODEL_BIN')
+    build_model(size=40).WriteFile_Bin(path)
+    with open(path, 'rb') as file:
+        data = XBinIO.__decompress_internal__(file)
+    assert len(data) > 3 * xbin.__STREAM_MARGIN__
+    raw_path = str(directory / 'test_raw.XMODEL_BIN')
+    with open(raw_path, 'wb') as file:
+        file.write(data)
+    return path, raw_path, bytes(data)
+
+
+FACE_HASHES = [xbin._BLOCK_HASH.pack(block_hash)
+               for block_hash in (0x562F, 0x6711)]
+
+
+def block_offsets(data):
+    '''
+    Get the (start, end) of every block in decompressed xbin data
+    '''
+    result = []
+    offset = 0
+    while offset < len(data) - 1:
+        block_hash = xbin._BLOCK_HASH.unpack_from(data, offset)[0]
+        size = xbin.BLOCK_SIZES[block_hash]
+        if callable(size):
+            size = size(data, offset)
+        result.append((offset, offset + size))
+        offset += size
+    return result
+
+
+def load(path, **kwargs):
+    model = Model()
+    model.LoadFile_Bin(path, **kwargs)
+    return model
+
+
+def face_window(data, after, offset):
+    '''
+    Get a window size that ends offset bytes after the start of the first
+    face (triangle info block) after the given position in the
+    uncompressed data
+    '''
+    for start, end in block_offsets(data):
+        if start > after and data[start:start + 2] in FACE_HASHES:
+            return start + offset
+    raise AssertionError('no face after 0x%X' % after)
+
+
+# 'margin': The first chunk loads a face that starts just before the
+#  __STREAM_MARGIN__ cut off, so its face vertex blocks straddle it
+# 'chunk': The first chunk ends in the middle of a face, which is held back
+#  until the next one (Only exact for uncompressed files)
+@pytest.mark.parametrize('window_size', [
+    1, 100, 4093, xbin.__STREAM_MARGIN__ - 1, xbin.__STREAM_MARGIN__,
+    xbin.__STREAM_MARGIN__ + 1, 'margin', 'chunk', 0x100000])
+@pytest.mark.parametrize('is_compressed', [True, False])
+@pytest.mark.parametrize('as_arrays', [False, True])
+def test_window_size(bin_files, window_size, is_compressed, as_arrays):
+    path, raw_path, data = bin_files
+    if window_size == 'margin':
+        window_size = xbin.__STREAM_MARGIN__ + face_window(data, 0x1000, 2)
+    elif window_size == 'chunk':
+        window_size = face_window(data, xbin.__STREAM_MARGIN__, 10)
+    if not is_compressed:
+        path = raw_path
+    expected = load(path, is_compressed=is_compressed, as_arrays=as_arrays)
+    model = load(path, is_compressed=is_compressed, as_arrays=as_arrays,
+                 window_size=window_size)
+    assert model.version == expected.version
+    assert [bone.name for bone in model.bones] == [
+        bone.name for bone in expected.bones]
+    assert [material.name for material in model.materials] == [
+        material.name for material in expected.materials]
+    assert mesh_data(model) == mesh_data(expected)
+
+
+def test_failed_write_removes_file(tmp_path):
+    model = build_model()
+    model.meshes[0].faces[-1].indices[0].uv = None
+    path = tmp_path / 'test.XMODEL_BIN'
+    with pytest.raises(TypeError):
+        model.WriteFile_Bin(str(path))
+    assert not path.exists()
+
+    # The same path can still be written
+    model = build_model()
+    model.WriteFile_Bin(str(path))
+    assert mesh_data(load(str(path))) == mesh_data(model)
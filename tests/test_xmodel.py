@@ -0,0 +1,191 @@
+import io
+
+import pytest
+
+from PyCod.xmodel import Model
+
+from conftest import build_model
+
+
+def mesh_data(model):
+    '''
+    Get the vertex & face data of every mesh in a comparable form, with the
+    vertices of each face corner looked up (the loaders may reorder them)
+    '''
+    result = []
+    for mesh in model.meshes:
+        verts = [(tuple(vert.offset),
+                  [(bone, round(weight, 5)) for bone, weight in vert.weights])
+                 for vert in mesh.verts]
+        faces = [(face.mesh_id, face.material_id,
+                  [(verts[ind.vertex], tuple(ind.normal), tuple(ind.uv))
+                   for ind in face.indices])
+                 for face in mesh.faces]
+        result.append((mesh.name, sorted(verts), faces))
+    return result
+
+
+@pytest.mark.parametrize('version', [5, 6, 7])
+@pytest.mark.parametrize('extended_features', [True, False])
+def test_raw_round_trip(tmp_path, version, extended_features):
+    source = build_model(version)
+    path = str(tmp_path / 'test.XMODEL_EXPORT')
+    source.WriteFile_Raw(path, version=version,
+                         extended_features=extended_features)
+
+    model = Model()
+    model.LoadFile_Raw(path)
+    assert model.version == version
+    assert [bone.name for bone in model.bones] == ['root', 'child']
+    assert len(model.materials) == len(source.materials)
+    for material, expected in zip(model.materials, source.materials):
+        assert material is not None
+        assert material.images == expected.images
+        if version != 5:
+            assert material.name == expected.name
+            assert material.type == expected.type
+    assert mesh_data(model) == mesh_data(source)
+
+
+def test_v5_materials_use_one_string(tmp_path):
+    path = tmp_path / 'test.XMODEL_EXPORT'
+    source = build_model(5)
+    source.WriteFile_Raw(str(path), version=5, extended_features=False)
+    lines = [line for line in path.read_text().splitlines()
+             if line.startswith('MATERIAL')]
+    assert lines == ['MATERIAL 0 "image0.tga"', 'MATERIAL 1 "image1.tga"']
+
+    model = Model()
+    model.LoadFile_Raw(str(path))
+    assert [material.images for material in model.materials] == [
+        {'color': 'image0.tga'}, {'color': 'image1.tga'}]
+    assert [material.name for material in model.materials] == [
+        'image0.tga', 'image1.tga']
+
+
+def test_probe_version(tmp_path):
+    source = build_model(7)
+    raw_path = tmp_path / 'test.XMODEL_EXPORT'
+    bin_path = str(tmp_path / 'test.XMODEL_BIN')
+    source.WriteFile_Raw(str(raw_path), version=7)
+    source.WriteFile_Bin(bin_path, version=7)
+    for path in (str(raw_path), bin_path):
+        info = Model.Probe(path)
+        assert info.version == 7
+        assert info.bones == ['root', 'child']
+        assert info.materials == ['mtl0', 'mtl1']
+
+    # Files without a VERSION line (or anything at all)
+    lines = [line for line in raw_path.read_text().splitlines()
+             if not line.startswith('VERSION')]
+    raw_path.write_text('\n'.join(lines) + '\n')
+    assert Model.Probe(str(raw_path)).version is None
+    (tmp_path / 'empty.XMODEL_EXPORT').write_bytes(b'')
+    assert Model.Probe(str(tmp_path / 'empty.XMODEL_EXPORT')).version is None
+
+
+@pytest.mark.parametrize('as_arrays', [False, True])
+def test_bounds_follow_in_place_changes(tmp_path, as_arrays):
+    path = str(tmp_path / 'test.XMODEL_EXPORT')
+    build_model().WriteFile_Raw(path)
+    model = Model.FromFile_Raw(path, as_arrays=as_arrays)
+    before = model.compute_bounds()
+    assert before.model.max[0] < 100.0
+
+    vert = model.meshes[0].verts[0]
+    vert.offset = (100.0, 0.0, 0.0)
+    after = model.compute_bounds()
+    assert after.model.max[0] == 100.0
+    assert after.meshes[0].max[0] == 100.0
+    assert before.model.max[0] < 100.0
+
+
+def bounds_data(bounds):
+    return [(tuple(b.min), tuple(b.max)) if b is not None else None
+            for b in [bounds.model] + bounds.meshes + bounds.bones]
+
+
+def test_bounds_of_built_model():
+    bounds = build_model().compute_bounds()
+    assert tuple(bounds.model.min) == (0.0, 0.0, 0.0)
+    assert tuple(bounds.model.max) == (4.0, 4.0, 0.0)
+    # The left column is only on the root bone, the right one only on the
+    #  child bone (at z = 1)
+    root, child = bounds.bones
+    assert (tuple(root.min), tuple(root.max)) == ((0.0, 0.0, 0.0),
+                                                  (3.0, 4.0, 0.0))
+    assert (tuple(child.min), tuple(child.max)) == ((1.0, 0.0, -1.0),
+                                                    (4.0, 4.0, -1.0))
+
+
+@pytest.mark.parametrize('split_meshes', [True, False])
+@pytest.mark.parametrize('as_arrays', [False, True])
+def test_bounds_of_loaded_model(tmp_path, split_meshes, as_arrays):
+    path = str(tmp_path / 'test.XMODEL_EXPORT')
+    source = build_model()
+    source.WriteFile_Raw(path)
+    model = Model.FromFile_Raw(path, split_meshes=split_meshes,
+                               as_arrays=as_arrays)
+    assert bounds_data(model.compute_bounds()) == bounds_data(
+        source.compute_bounds())
+
+
+def test_compact_floats(tmp_path):
+    source = build_model()
+    path = tmp_path / 'test.XMODEL_EXPORT'
+    source.WriteFile_Raw(str(path), compact_floats=True)
+    text = path.read_text()
+    assert 'OFFSET 1 0 0\n' in text
+    assert '0.25 0.75\n' in text
+    assert '00\n' not in text
+
+    model = Model()
+    model.LoadFile_Raw(str(path))
+    assert mesh_data(model) == mesh_data(source)
+
+
+def save_sections(model, version):
+    '''
+    Build the vertex & face sections of an XMODEL_EXPORT file one record
+    at a time, with Vertex.save() & Face.save()
+    '''
+    file = io.StringIO()
+    vert_count = sum([len(mesh.verts) for mesh in model.meshes])
+    file.write("NUMVERTS %d\n" % vert_count)
+    offset = 0
+    for mesh in model.meshes:
+        for index, vert in enumerate(mesh.verts):
+            vert.save(file, index + offset)
+        offset += len(mesh.verts)
+    file.write("NUMFACES %d\n" % sum([len(mesh.faces)
+                                      for mesh in model.meshes]))
+    offset = 0
+    for mesh in model.meshes:
+        for face in mesh.faces:
+            face.save(file, version, offset)
+        offset += len(mesh.verts)
+    return file.getvalue()
+
+
+@pytest.mark.parametrize('version', [5, 6, 7])
+@pytest.mark.parametrize('as_arrays', [False, True])
+def test_batched_writer_matches_save(tmp_path, version, as_arrays):
+    source = build_model(version)
+    # Normals that have to be clamped, a second mesh & a TRI16 face
+    mesh = source.meshes[0]
+    mesh.faces[0].indices[0].normal = (0.0, 0.0, 0.0)
+    mesh.faces[1].indices[1].normal = (2.0, -3.0, 0.5)
+    mesh.faces[2].material_id = 300
+    source.materials.extend([source.materials[0]] * 300)
+    path = str(tmp_path / 'source.XMODEL_EXPORT')
+    source.WriteFile_Raw(path, version=version)
+    model = Model.FromFile_Raw(path, as_arrays=as_arrays)
+    model.meshes.append(Model.FromFile_Raw(path, split_meshes=False,
+                                           as_arrays=as_arrays).meshes[0])
+
+    path = tmp_path / 'test.XMODEL_EXPORT'
+    model.WriteFile_Raw(str(path), version=version)
+    text = path.read_text()
+    start = text.index('NUMVERTS')
+    end = text.index('NUMOBJECTS')
+    assert text[start:end] == save_sections(model, version)